@@ -0,0 +1,361 @@
+#!/usr/bin/python
+
+import sys, os, io, time, contextlib, subprocess, tempfile, random, json, platform
+
+""" Benchmarks for performance-sensitive code paths. Run with "python benchmark.py <benchmark> [<arguments>]" (e.g.
+"python benchmark.py status 1000" or "python benchmark.py tags ~/music 3"), or without arguments to list the available
+benchmarks.
+"""
+
+def time_calls(func, repetitions):
+    """ Calls the given function the given number of times, returning the duration of each call in seconds.
+
+    @param func: func(void -> void)
+    @param repetitions: int
+
+    @return list(float)
+    """
+    durations = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+
+    return durations
+
+def time_operation(func, repetitions, warmup = 1, setup = None):
+    """ Calls the given function warmup times untimed, then times repetitions calls. If a setup function is given, it's
+    called (untimed) before every call, and its return value passed to the function.
+
+    @param func: func(void -> void), or func(object -> void) with a setup function
+    @param repetitions: int
+    @param warmup: int
+    @param setup: func(void -> object)
+
+    @return list(float)
+    """
+    durations = []
+    for i in range(warmup + repetitions):
+        arg = setup() if setup is not None else None
+        start = time.perf_counter()
+        func(arg) if setup is not None else func()
+        if i >= warmup:
+            durations.append(time.perf_counter() - start)
+
+    return durations
+
+def summarize(durations):
+    """ Returns the mean, median and maximum of the given durations, in milliseconds.
+
+    @param durations: list(float)
+
+    @return dict(str -> float)
+    """
+    durations = sorted(durations)
+    return {
+        "mean_ms": sum(durations) / len(durations) * 1000,
+        "median_ms": durations[len(durations) // 2] * 1000,
+        "max_ms": durations[-1] * 1000
+    }
+
+# Benchmarks below
+
+def _stty_console_width():
+    # How util.console_width() used to read the console width, for comparison
+    stty = os.popen("stty size")
+    width = int(stty.read().split()[1])
+    stty.close()
+
+    return width
+
+def bench_redraw(repetitions = 1000):
+    """ Times util.print_main, reading the console width with stty on every redraw (as before) versus from the cache.
+    Output goes to a buffer rather than the terminal, so only the cost of producing a redraw is measured. The stty
+    variant needs a terminal on stdin.
+
+    @param repetitions: int
+
+    @return dict(str -> dict(str -> float))
+    """
+    import util
+
+    results = {}
+    cached_console_width = util.console_width
+    try:
+        for name, width_func in (("stty", _stty_console_width), ("cached", cached_console_width)):
+            try:
+                width_func()
+            except (IndexError, ValueError): # No terminal for stty to query
+                continue
+
+            util.console_width = width_func
+            with contextlib.redirect_stdout(io.StringIO()):
+                durations = time_calls(lambda: util.print_main("Playing \"benchmark\"", "> skip", "Skipped"), repetitions)
+            results[name] = summarize(durations)
+    finally:
+        util.console_width = cached_console_width
+
+    return results
+
+class _BenchSong:
+    # Stands in for a playing Song, advancing a tenth of a second per call
+    def __init__(self, length):
+        self.length, self.time = length, 0.0
+
+    def get_current_time(self):
+        self.time = (self.time + 0.1) % self.length
+        return self.time
+
+    def __getitem__(self, key):
+        return {"title": "benchmark", "length": self.length}[key]
+
+def bench_status(repetitions = 1000):
+    """ Times one tick of the player's status bar refresh (building the status line and redrawing what changed), and
+    estimates the CPU share of refreshing at player.STATUS_RATE ticks per second.
+
+    @param repetitions: int
+
+    @return dict(str -> dict(str -> float))
+    """
+    import player, util
+
+    p = player.Player(None)
+    p.curr_song = _BenchSong(200)
+    util._SCREEN.min_interval = 0 # Draw every tick, as the player's ticks are further apart than the frame rate limit
+
+    def tick():
+        util.set_status([p._status_line()])
+        util.flush_status()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        util.print_main("Playing \"benchmark\"")
+        summary = summarize(time_calls(tick, repetitions))
+
+    summary["cpu_percent"] = summary["mean_ms"] / 1000 * player.STATUS_RATE * 100
+    return {"status": summary}
+
+def bench_tags(directory, repetitions = 3):
+    """ Times reading the tags and duration of every supported file under the given directory, grouped by container
+    format, reporting each format's throughput in files per second. Sniffing the format is timed separately.
+
+    @param directory: str
+    @param repetitions: int
+
+    @return dict(str -> dict(str -> float))
+    """
+    import tag_readers
+
+    by_container = {}
+    for root, _, file_names in os.walk(directory):
+        for file_name in file_names:
+            file_path = os.path.join(root, file_name)
+            container = tag_readers.sniff(file_path)
+            if container is not None:
+                by_container.setdefault(container, []).append(file_path)
+
+    results = {}
+    for container, file_paths in sorted(by_container.items()):
+        sniff_durations = time_calls(lambda: [tag_readers.sniff(path) for path in file_paths], repetitions)
+        read_durations = time_calls(lambda: [tag_readers.read(path) for path in file_paths], repetitions)
+
+        summary = {"files": len(file_paths)}
+        summary["sniff_us_per_file"] = summarize(sniff_durations)["median_ms"] * 1000 / len(file_paths)
+        summary["read_ms_per_file"] = summarize(read_durations)["median_ms"] / len(file_paths)
+        summary["files_per_sec"] = 1000 / summary["read_ms_per_file"] if summary["read_ms_per_file"] > 0 else 0.0
+        results[container] = summary
+
+    return results
+
+# What main.py does before playing: imports its modules and creates the player, here for an empty library
+STARTUP_STATEMENT = ("import library, player, util, transcoder, session, play_log; "
+                     "player.Player(library.Library(), session = session.SessionLog())")
+DEFERRED_IMPORTS = ("libvlc", "mutagen.mp3", "downloader") # Heavy modules that should only load on first use
+
+def _import_time(statement, baseline = ()):
+    # Runs the statement in a fresh interpreter with "-X importtime", returning the total import time in seconds and
+    # the names of the modules it imported, leaving out the given modules (those the interpreter imports by itself)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], cwd = os.path.dirname(os.path.abspath(__file__)),
+                            stdout = subprocess.DEVNULL, stderr = subprocess.PIPE, universal_newlines = True)
+    if result.returncode != 0:
+        raise ImportError(result.stderr.strip().split("\n")[-1])
+
+    total, modules = 0, set()
+    for line in result.stderr.split("\n"):
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if name.strip() in baseline:
+            continue
+
+        modules.add(name.strip())
+        if not name.startswith("  "): # Top level import, whose cumulative time includes everything it imported
+            total += int(cumulative)
+
+    return total / 1000000, modules
+
+def bench_startup(repetitions = 10):
+    """ Measures the import time of what main.py imports at startup, up to creating the player, in a fresh interpreter
+    each time (leaving out what the interpreter imports by itself), and checks that the heavy modules in
+    DEFERRED_IMPORTS aren't among them. Their own import times are measured for comparison, if
+    they're installed.
+
+    @param repetitions: int
+
+    @return dict(str -> dict(str -> float))
+    """
+    _, baseline = _import_time("pass")
+
+    durations, modules = [], set()
+    for _ in range(repetitions):
+        duration, modules = _import_time(STARTUP_STATEMENT, baseline)
+        durations.append(duration)
+
+    summary = summarize(durations)
+    summary["deferred_loaded"] = sum(1 for name in DEFERRED_IMPORTS if name in modules) # Should be 0
+    results = {"startup": summary}
+
+    for name in DEFERRED_IMPORTS:
+        try:
+            results[name] = summarize([_import_time("import " + name, baseline)[0] for _ in range(repetitions)])
+        except ImportError:
+            continue
+
+    return results
+
+def bench_library(tracks = 1000, repetitions = 5, warmup = 1):
+    """ Times the library's hot paths on a synthetic library of the given size (e.g. 1000, 10000 or 100000 tracks)
+    written to a temporary directory by mp3_fixtures: loading it, exact and fuzzy searches, jumping to a song, queueing and dequeueing,
+    shuffling and sorting. Nothing is played.
+
+    @param tracks: int
+    @param repetitions: int
+    @param warmup: int
+
+    @return dict(str -> dict(str -> float))
+    """
+    import library, mp3_fixtures
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        mp3_fixtures.generate_library(directory, tracks)
+        results["generate"] = {"seconds": time.perf_counter() - start}
+
+        lib = None
+        def load():
+            nonlocal lib
+            lib = library.Library(directory)
+        results["load"] = summarize(time_operation(load, repetitions, warmup))
+        results["load"]["tracks_per_sec"] = tracks / (results["load"]["median_ms"] / 1000)
+
+        lib.first_song()
+        rand = random.Random(1)
+        random_song = lambda: rand.choice(lib.lib)
+
+        results["search_exact"] = summarize(time_operation(lambda song: lib.search({"title": song["title"][: 6]}),
+                                                           repetitions, warmup, random_song))
+        results["search_fuzzy"] = summarize(time_operation(lambda: lib.search({"title": "zzqx mismatch"}), repetitions, warmup))
+        results["jump_to_song"] = summarize(time_operation(lib.jump_to_song, repetitions, warmup, random_song))
+
+        def queue_and_dequeue(song):
+            lib.add_to_queue(song)
+            lib.remove_from_queue(song)
+        results["queue_dequeue"] = summarize(time_operation(queue_and_dequeue, repetitions, warmup, random_song))
+
+        results["shuffle"] = summarize(time_operation(lib.shuffle, repetitions, warmup))
+        for column in ("title", "artist", "length"):
+            results["sort_" + column] = summarize(time_operation(lambda: lib.sort(column), repetitions, warmup))
+
+    return results
+
+_BINDING_SCRIPT = """
+import resource, time
+start = time.perf_counter()
+import %s as vlc
+vlc.Instance().media_player_new()
+print(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+def _run_python(script):
+    # Runs the script in a fresh interpreter, returning what it prints, split on whitespace
+    result = subprocess.run([sys.executable, "-c", script], cwd = os.path.dirname(os.path.abspath(__file__)),
+                            stdout = subprocess.PIPE, stderr = subprocess.PIPE, universal_newlines = True)
+    if result.returncode != 0:
+        raise ImportError(result.stderr.strip().split("\n")[-1])
+
+    return result.stdout.split()
+
+def bench_bindings(repetitions = 10):
+    """ Compares the full vlc.py binding with the trimmed libvlc one: import time (from "-X importtime"), time until a
+    MediaPlayer exists (importing, loading libvlc and creating an Instance and a player), and the resulting increase in
+    peak resident memory over a bare interpreter. Bindings that can't be loaded (e.g. without libvlc installed, or vlc.py
+    on Python 3.11+) are left out.
+
+    @param repetitions: int
+
+    @return dict(str -> dict(str -> float))
+    """
+    _, baseline = _import_time("pass")
+    baseline_rss = int(_run_python("import resource; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)")[0])
+
+    results = {}
+    for module in ("vlc", "libvlc"):
+        try:
+            import_durations = [_import_time("import " + module, baseline)[0] for _ in range(repetitions)]
+            runs = [_run_python(_BINDING_SCRIPT % module) for _ in range(repetitions)]
+        except ImportError as e:
+            print("Skipping %s: %s" % (module, e))
+            continue
+
+        summary = {"import_ms": summarize(import_durations)["median_ms"]}
+        summary["player_ready_ms"] = summarize([float(duration) for duration, _ in runs])["median_ms"]
+        summary["rss_increase_kb"] = sorted(int(rss) for _, rss in runs)[len(runs) // 2] - baseline_rss
+        results[module] = summary
+
+    return results
+
+BENCHMARKS = {
+    "bindings": bench_bindings,
+    "library": bench_library,
+    "redraw": bench_redraw,
+    "startup": bench_startup,
+    "status": bench_status,
+    "tags": bench_tags
+}
+
+def _git_commit():
+    # The commit the benchmarks ran on, to compare results across commits
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd = os.path.dirname(os.path.abspath(__file__)),
+                                       stderr = subprocess.DEVNULL, universal_newlines = True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == "__main__":
+    argv = sys.argv[1 :]
+    json_file = None
+    if "--json" in argv: # "--json <file>" also writes the results there, with what they were measured on
+        i = argv.index("--json")
+        json_file = argv[i + 1]
+        del argv[i : i + 2]
+
+    if len(argv) < 1 or argv[0] not in BENCHMARKS:
+        print("Usage: python benchmark.py <benchmark> [<arguments>] [--json <file>]\nAvailable benchmarks: %s" % ", ".join(sorted(BENCHMARKS)))
+        sys.exit(1)
+
+    args = [int(arg) if arg.isdigit() else arg for arg in argv[1 :]] # E.g. a directory, then repetitions
+    results = BENCHMARKS[argv[0]](*args)
+    for name, summary in results.items():
+        print("%s: %s" % (name, ", ".join("%s = %.3f" % (key, val) for key, val in summary.items())))
+
+    if json_file is not None:
+        with open(json_file, "w") as f:
+            json.dump({
+                "benchmark": argv[0],
+                "arguments": args,
+                "commit": _git_commit(),
+                "python": platform.python_version(),
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "results": results
+            }, f, indent = 4)
@@ -0,0 +1,234 @@
+from concurrent.futures import ThreadPoolExecutor, Future
+import asyncio, os, time
+
+""" Runs song downloads in the background, on a bounded pool of worker threads.
+"""
+
+QUEUED      = "queued"
+SEARCHING   = "searching"
+CHOOSING    = "choosing" # Waiting for a search result to be picked
+DOWNLOADING = "downloading"
+CONVERTING  = "converting"
+DONE        = "done"
+FAILED      = "failed"
+
+class DownloadJob:
+    """ A single download request and its progress through the download manager.
+    """
+
+    def __init__(self, job_id, query, file_path, file_name = None, use_first_match = False):
+        """ Initializes a queued job to search for the given query and download the chosen result into the given
+        directory, under the given file name (without extension) or the result's title if None.
+
+        @param job_id: int
+        @param query: str
+        @param file_path: str
+        @param file_name: str
+        @param use_first_match: bool
+        """
+        self.id = job_id
+        self.query = query
+        self.file_path = file_path
+        self.file_name = file_name
+        self.use_first_match = use_first_match
+
+        self.state = QUEUED
+        self.title = None # Title of the chosen search result
+        self.path = None # Where the downloaded file ended up, once it's done
+        self.error = None # Why the job failed, if it did
+        self.size = 0 # Size of the downloaded file, in bytes
+        self.download_start = self.download_end = None # Time at which the download itself started and ended
+
+    def is_active(self):
+        """ Returns if the job hasn't finished yet.
+
+        @return bool
+        """
+        return self.state not in (DONE, FAILED)
+
+    def __str__(self):
+        ret = "[%s] \"%s\"" % (self.state, self.title if self.title is not None else self.query)
+
+        if self.state == DONE:
+            ret += " (%s in %.1f s)" % (format_size(self.size), self.download_end - self.download_start)
+        elif self.state == FAILED and self.error is not None:
+            ret += ": " + self.error
+
+        return ret
+
+class DownloadManager:
+    """ Runs download jobs on a bounded pool of worker threads and keeps track of each job's state. Jobs beyond the
+    pool's size wait in its queue. The search and download functions default to the ones in the downloader module
+    but can be replaced, e.g. with local stand-ins for testing.
+    """
+
+    def __init__(self, max_workers = 2, search = None, download = None):
+        """ Initializes a download manager running at most max_workers searches or downloads at once.
+
+        @param max_workers: int
+        @param search: func(str -> list(dict(str -> str))), like downloader.youtube_search
+        @param download: func(str, str, str -> str), like downloader.youtube_download_audio, which can also return a
+                         concurrent.futures.Future of the path if the file is still being processed (e.g. converted)
+        """
+        self._search = search # The defaults are resolved by the first run(), as importing the downloader is slow
+        self._download = download
+        self._executor = ThreadPoolExecutor(max_workers = max_workers)
+        self._next_id = 1
+
+        self.jobs = [] # All jobs, in submission order
+
+    def submit(self, query, file_path, file_name = None, use_first_match = False):
+        """ Creates a queued job for the given request. The job is run by passing it to run().
+
+        @param query: str
+        @param file_path: str
+        @param file_name: str
+        @param use_first_match: bool
+
+        @return DownloadJob
+        """
+        job = DownloadJob(self._next_id, query, file_path, file_name, use_first_match)
+        self._next_id += 1
+        self.jobs.append(job)
+        return job
+
+    async def run(self, job, choose = None):
+        """ Runs the given job to completion: searches for its query, picks a result (the first one, or the one
+        returned by the given coroutine function, which gets the list of results and returns None to cancel), and
+        downloads it. Searching and downloading take a slot in the worker pool; choosing doesn't. Returns the job.
+
+        @param job: DownloadJob
+        @param choose: func(list(dict(str -> str)) -> dict(str -> str)), a coroutine function
+
+        @return DownloadJob
+        """
+        loop = asyncio.get_running_loop()
+
+        try:
+            if self._search is None or self._download is None:
+                self._load_downloader()
+            results = await loop.run_in_executor(self._executor, self._search_job, job)
+            if len(results) == 0:
+                return self._fail(job, "No Youtube results found for query")
+
+            if job.use_first_match or choose is None:
+                video = results[0]
+            else:
+                job.state = CHOOSING
+                video = await choose(results)
+                if video is None:
+                    return self._fail(job, "No result chosen")
+
+            job.title = video["title"]
+            if job.file_name is None:
+                job.file_name = video["title"]
+            job.file_name += ".mp3"
+
+            url = "https://www.youtube.com/watch?v=%s" % video["id"]
+            job.state = QUEUED # Until a worker is free to download it
+            path = await loop.run_in_executor(self._executor, self._download_job, job, url)
+            if isinstance(path, Future): # Converting, which is waited for without holding a worker
+                job.state = CONVERTING
+                path = await asyncio.wrap_future(path)
+
+            if path is False:
+                return self._fail(job, "Download failed")
+            elif not isinstance(path, str): # Download function that doesn't report where the file went
+                path = os.path.join(job.file_path, job.file_name)
+
+            job.state, job.path = DONE, path
+            if os.path.exists(path):
+                job.size = os.path.getsize(path)
+        except Exception as e:
+            self._fail(job, str(e))
+
+        return job
+
+    def active_jobs(self):
+        """ Returns the jobs that haven't finished yet.
+
+        @return list(DownloadJob)
+        """
+        return [job for job in self.jobs if job.is_active()]
+
+    def throughput(self):
+        """ Returns the aggregate download throughput, in bytes per second: the total size of finished downloads
+        divided by the time during which at least one download was running.
+
+        @return float
+        """
+        intervals = sorted((job.download_start, job.download_end) for job in self.jobs if job.state == DONE)
+
+        busy_time, total_size = 0.0, sum(job.size for job in self.jobs if job.state == DONE)
+        busy_start = busy_end = None
+        for start, end in intervals: # Merge overlapping downloads so parallel time isn't counted twice
+            if busy_end is None or start > busy_end:
+                if busy_end is not None:
+                    busy_time += busy_end - busy_start
+                busy_start, busy_end = start, end
+            else:
+                busy_end = max(busy_end, end)
+        if busy_end is not None:
+            busy_time += busy_end - busy_start
+
+        return total_size / busy_time if busy_time > 0 else 0.0
+
+    def describe(self):
+        """ Returns a listing of all jobs and the aggregate throughput, for display.
+
+        @return str
+        """
+        if len(self.jobs) == 0:
+            return "No downloads"
+
+        ret = "Downloads (%s/s aggregate):" % format_size(self.throughput())
+        for job in self.jobs:
+            ret += "\n\t" + str(job)
+
+        return ret
+
+    def shutdown(self):
+        """ Stops accepting work, abandoning queued jobs without waiting for running ones.
+        """
+        self._executor.shutdown(wait = False, cancel_futures = True)
+
+    # Helper functions below
+
+    def _load_downloader(self):
+        from downloader import youtube_search, youtube_download_audio
+        if self._search is None:
+            self._search = youtube_search
+        if self._download is None:
+            self._download = youtube_download_audio
+
+    # Run on worker threads
+
+    def _search_job(self, job):
+        job.state = SEARCHING
+        return self._search(job.query)
+
+    def _download_job(self, job, url):
+        job.state = DOWNLOADING
+        job.download_start = time.time()
+        try:
+            return self._download(url, job.file_path, job.file_name)
+        finally:
+            job.download_end = time.time()
+
+    def _fail(self, job, error):
+        job.state, job.error = FAILED, error
+        return job
+
+def format_size(num_bytes):
+    """ Formats the given number of bytes for display, e.g. "3.4 MB".
+
+    @param num_bytes: float
+
+    @return str
+    """
+    for unit in ("B", "KB", "MB"):
+        if num_bytes < 1024:
+            return "%.1f %s" % (num_bytes, unit)
+        num_bytes /= 1024
+
+    return "%.1f GB" % num_bytes
@@ -1,4 +1,5 @@
-import sys, urllib.request, os, subprocess, shutil
+import sys, urllib.request, os, shutil, tempfile, threading, json, time
+import transcoder
 
 """ Code for downloading songs from the Internet, through various channels such as YouTube, Soundcloud, etc.
 """
@@ -9,23 +10,145 @@ def _get_youtube_api_key(file_name = "./.api_key.txt"):
 
     return api_key
 
+SEARCH_CACHE_TTL = 24 * 60 * 60 # How long search results are reused for, in seconds
+DEFAULT_SEARCH_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".music_player_search_cache")
+
+class SearchCache:
+    """ Caches search results by normalized query and number of results, for a limited time, optionally persisting
+    them to a JSON file so they survive restarts. Safe to use from multiple threads.
+    """
+
+    def __init__(self, ttl = SEARCH_CACHE_TTL, file_name = None):
+        """ Initializes a cache whose entries expire after ttl seconds, loading previously persisted entries from the
+        given file if it's given and exists.
+
+        @param ttl: float
+        @param file_name: str
+        """
+        self.ttl = ttl
+        self.file_name = file_name
+        self._entries = {} # Maps keys to (time stored, results)
+        self._lock = threading.Lock()
+
+        if file_name is not None and os.path.exists(file_name):
+            try:
+                with open(file_name, "r") as f:
+                    self._entries = {key: tuple(entry) for key, entry in json.load(f).items()}
+            except (ValueError, OSError): # Corrupt or unreadable, so start over
+                self._entries = {}
+
+    @staticmethod
+    def key(query, max_results):
+        """ Returns the cache key for the given search, ignoring case and extra whitespace in the query.
+
+        @param query: str
+        @param max_results: int
+
+        @return str
+        """
+        return "%s|%i" % (" ".join(query.lower().split()), max_results)
+
+    def get(self, query, max_results):
+        """ Returns the cached results for the given search, or None if there are none or they've expired.
+
+        @param query: str
+        @param max_results: int
+
+        @return list(dict(str -> str))
+        """
+        key = SearchCache.key(query, max_results)
+        with self._lock:
+            if key not in self._entries:
+                return None
+
+            stored, results = self._entries[key]
+            if time.time() - stored > self.ttl:
+                del self._entries[key]
+                return None
+
+            return results
+
+    def put(self, query, max_results, results):
+        """ Caches the results of the given search, persisting the cache if it has a file.
+
+        @param query: str
+        @param max_results: int
+        @param results: list(dict(str -> str))
+        """
+        with self._lock:
+            self._entries[SearchCache.key(query, max_results)] = (time.time(), results)
+
+            if self.file_name is not None:
+                now = time.time()
+                entries = {key: entry for key, entry in self._entries.items() if now - entry[0] <= self.ttl}
+
+                # Write to a temporary file and rename it, so a crash can't leave a half-written cache
+                temp_file_name = self.file_name + ".tmp"
+                try:
+                    with open(temp_file_name, "w") as f:
+                        json.dump(entries, f)
+                    os.replace(temp_file_name, self.file_name)
+                except OSError: # The results are still cached for this run
+                    pass
+
+_search_cache = SearchCache(file_name = DEFAULT_SEARCH_CACHE_FILE) # Kept next to the player's session file
+_youtube_service = None
+_youtube_service_lock = threading.Lock() # Service objects aren't thread-safe, so calls through one are serialized
+
+def configure_search_cache(ttl = SEARCH_CACHE_TTL, file_name = None):
+    """ Replaces the search cache with one using the given TTL, persisted to the given file if it isn't None. By
+    default, results are kept for SEARCH_CACHE_TTL seconds in DEFAULT_SEARCH_CACHE_FILE.
+
+    @param ttl: float
+    @param file_name: str
+    """
+    global _search_cache
+    _search_cache = SearchCache(ttl, file_name)
+
+def set_youtube_service(service):
+    """ Sets the Youtube API service object used for searching, e.g. to a local fake. None makes the next search build
+    a real one.
+
+    @param service: object with the googleapiclient Youtube service's search() interface
+    """
+    global _youtube_service
+    with _youtube_service_lock:
+        _youtube_service = service
+
+def _get_youtube_service():
+    # Must be called with _youtube_service_lock held. Building the client is expensive, so it's done once.
+    global _youtube_service
+    if _youtube_service is None:
+        try:
+            from apiclient.discovery import build
+        except ImportError:
+            print("Youtube API not installed - install with \"pip3 install --upgrade google-api-python-client\"")
+            raise
+
+        API_KEY = _get_youtube_api_key()
+        YOUTUBE_API_SERVICE_NAME = "youtube"
+        YOUTUBE_API_VERSION = "v3"
+
+        _youtube_service = build(YOUTUBE_API_SERVICE_NAME, YOUTUBE_API_VERSION, developerKey = API_KEY)
+
+    return _youtube_service
+
 def youtube_search(query, max_results = 25):
-    try:
-        from apiclient.discovery import build
-    except ImportError:
-        print("Youtube API not installed - install with \"pip3 install --upgrade google-api-python-client\"")
+    """ Searches Youtube for videos matching the given query, returning metadata about each one. Results are cached,
+    so repeating a search doesn't hit the API.
 
-    try:
-        from oauth2client.tools import argparser
-    except ImportError:
-        print("OAuth2 API not installed - install with \"pip3 install --upgrade oauth2client\"")
+    @param query: str
+    @param max_results: int
 
-    API_KEY = _get_youtube_api_key()
-    YOUTUBE_API_SERVICE_NAME = "youtube"
-    YOUTUBE_API_VERSION = "v3"
+    @return list(dict(str -> str))
+    """
+    videos = _search_cache.get(query, max_results)
+    if videos is not None:
+        return videos
 
-    youtube_service = build(YOUTUBE_API_SERVICE_NAME, YOUTUBE_API_VERSION, developerKey = API_KEY)
-    search_result = youtube_service.search().list(q = query, part = "id, snippet", maxResults = max_results).execute()
+    with _youtube_service_lock:
+        youtube_service = _get_youtube_service()
+        search_result = youtube_service.search().list(q = query, part = "id, snippet", maxResults = max_results).execute()
 
     videos = []
     for result in search_result.get("items", []):
@@ -39,35 +162,55 @@ def youtube_search(query, max_results = 25):
             }
 
             videos.append(metadata_dict)
+
+    _search_cache.put(query, max_results, videos)
     return videos
 
+TEMP_DIR_PREFIX = ".download-" # Hidden, so library scans skip directories holding partial downloads
+
 def youtube_download_audio(video_url, file_path, file_name):
+    """ Downloads the audio of the given Youtube video to the given directory under the given file name, converting it
+    to MP3 if ffmpeg is installed (through the shared transcoder, so conversions are limited to one per CPU) or
+    otherwise keeping it as M4A with a matching extension. The download is written to a private temporary directory
+    inside the target directory (so on the same filesystem) and renamed into place once it's complete, so concurrent
+    downloads don't interfere and the file never appears half-written. Returns the path of the downloaded file, or
+    False if the download couldn't be done. Conversions are queued rather than waited for, so if the file is being
+    converted, a future resolving to its path once it's in place is returned instead.
+
+    @param video_url: str
+    @param file_path: str
+    @param file_name: str
+
+    @return str or concurrent.futures.Future
+    """
     try:
         import pafy
     except ImportError:
         print("Module \"pafy\" not installed - install with \"pip3 install pafy\"")
         return False
 
-    temp_dir_name = "./temp_audio_downloads"
-    if not os.path.exists(temp_dir_name):
-        os.mkdir(temp_dir_name)
+    file_path = os.path.abspath(file_path)
+    base_name = os.path.splitext(file_name)[0]
+    temp_dir_name = tempfile.mkdtemp(prefix = TEMP_DIR_PREFIX, dir = file_path)
+    converting = False
 
     try:
         # Download
         video = pafy.new(video_url)
-        video.getbestaudio(preftype = "m4a").download(filepath = os.path.join(file_path, file_name), quiet = True)
-
-        # TODO Check if this is even necessary
-        # Convert to MP3
-#        m4aFile = os.path.join(temp_dir_name, file_name)
-#        mp3File = os.path.join(file_path, "%s.mp3" % file_name[: -4])
-#        subprocess.call(["ffmpeg", "-i", m4aFile, "-acodec", "libmp3lame", "-ab", "256k", mp3File])
-    except FileNotFoundError as err:
-        if "ffmpeg" in str(err): # ffmpeg not installed
-            print("Package \"ffmpeg\" not install - install with \"sudo apt-get install ffmpeg\"")
-            return False
+        temp_file = os.path.join(temp_dir_name, base_name + ".m4a")
+        video.getbestaudio(preftype = "m4a").download(filepath = temp_file, quiet = True)
+
+        if transcoder.ffmpeg_installed():
+            # Waiting here would hold up a download worker behind every conversion already queued, e.g. at startup
+            target = os.path.join(file_path, base_name + ".mp3")
+            future = transcoder.get_default_transcoder().submit(temp_file, target, remove_source = True)
+            future.add_done_callback(lambda _: shutil.rmtree(temp_dir_name, ignore_errors = True))
+            converting = True
+            return future
         else:
-            raise err
+            target = os.path.join(file_path, base_name + ".m4a")
+            os.replace(temp_file, target) # Atomic, since it's on the same filesystem
+            return target
     finally:
-        shutil.rmtree(temp_dir_name)
-
+        if not converting:
+            shutil.rmtree(temp_dir_name, ignore_errors = True)
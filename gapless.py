@@ -0,0 +1,255 @@
+from player import Player
+from player_pool import get_default_pool
+import util, instrumentation
+
+""" Alternative playback backend in which VLC itself moves from one song to the next, through a MediaListPlayer.
+"""
+
+print_main = util.print_main
+
+MAX_PLAYED_ITEMS = 32 # Items kept before the current one in the media list, before they're dropped
+
+class MediaListBackend:
+    """ Mirrors the current song and the next few songs of a library's history into a vlc.MediaList played by a
+    vlc.MediaListPlayer, so VLC handles transitions between consecutive songs without any gap. Changes to the history
+    (queueing, jumping, etc.) are applied by editing the media list after the current item, never by recreating players.
+
+    The MediaListPlayer tracks its current item by index, so items before the current one can only be removed when
+    jumping to an item, which resets that index. Once more than MAX_PLAYED_ITEMS have piled up, they're dropped on the
+    next jump, or if VLC advances by itself, by jumping to the item it just started, costing one short gap.
+    """
+
+    def __init__(self, lib, window = 3):
+        """ Initializes a backend for the given library, mirroring the given number of songs ahead of the current one.
+
+        @param lib: Library
+        @param window: int
+        """
+        self.library = lib
+        self.window = window
+
+        instance = get_default_pool().get_instance()
+        self._instance = instance
+        self._media_player = instance.media_player_new()
+        self._media_list = instance.media_list_new()
+        self._list_player = instance.media_list_player_new()
+        self._list_player.set_media_player(self._media_player)
+        self._list_player.set_media_list(self._media_list)
+
+        self._paths = [] # File paths of the media list's items, in order
+        self._index = -1 # Index of the current item in the media list
+        self._pending_jumps = 0 # Item changes caused by play(), whose events shouldn't count as VLC advancing
+
+    def get_media_player(self):
+        """ Returns the MediaPlayer that the media list plays through, to bind the current song to.
+
+        @return vlc.MediaPlayer
+        """
+        return self._media_player
+
+    def attach_event(self, event_type, callback):
+        """ Registers a callback for the given VLC event on the MediaListPlayer (e.g. MediaListPlayerNextItemSet).
+
+        @param event_type: vlc.EventType
+        @param callback: func(vlc.Event -> void)
+        """
+        self._list_player.event_manager().event_attach(event_type, callback)
+
+    def play(self, song):
+        """ Plays the given song right away, by placing it right after the current item and jumping to it.
+
+        @param song: Song
+        """
+        self._truncate(self._index + 1)
+        self._append(song)
+        self._jump_to(self._index + 1)
+
+        self.sync()
+
+    def advanced(self):
+        """ Accounts for the MediaListPlayer moving to the next item by itself. Returns False if the item change was
+        caused by play() instead.
+
+        @return bool
+        """
+        if self._pending_jumps > 0:
+            self._pending_jumps -= 1
+            return False
+
+        self._index += 1
+        if self._index > MAX_PLAYED_ITEMS: # Just started, so restarting it is barely noticeable
+            self._jump_to(self._index)
+        return True
+
+    def sync(self):
+        """ Updates the items after the current one to match the library's upcoming songs, removing and adding only
+        the items past the first one that differs.
+        """
+        upcoming = [song.get_file_path() for song in self.library.get_next_songs(self.window)]
+        mirrored = self._paths[self._index + 1 :]
+
+        common = 0
+        while common < min(len(upcoming), len(mirrored)) and upcoming[common] == mirrored[common]:
+            common += 1
+
+        if common == len(upcoming) and common == len(mirrored):
+            return
+
+        self._truncate(self._index + 1 + common)
+        for path in upcoming[common :]:
+            self._append_path(path)
+
+    def stop(self):
+        """ Stops playback and frees the native objects.
+        """
+        self._list_player.stop()
+        self._list_player.release()
+        self._media_list.release()
+        self._media_player.release()
+
+    # Helper functions below
+
+    def _jump_to(self, index):
+        # Plays the item at the given index, first dropping the items before it if there are too many
+        if index > MAX_PLAYED_ITEMS:
+            self._media_list.lock()
+            try:
+                for _ in range(index):
+                    self._media_list.remove_index(0)
+            finally:
+                self._media_list.unlock()
+            del self._paths[: index]
+            index = 0
+
+        self._pending_jumps += 1
+        self._index = index
+        self._list_player.play_item_at_index(index)
+
+    def _truncate(self, length):
+        # Removes the items from the given index on
+        self._media_list.lock()
+        try:
+            while len(self._paths) > max(length, 0):
+                self._media_list.remove_index(len(self._paths) - 1)
+                self._paths.pop()
+        finally:
+            self._media_list.unlock()
+
+    def _append(self, song):
+        self._append_path(song.get_file_path())
+
+    def _append_path(self, path):
+        media = self._instance.media_new(path)
+        self._media_list.lock()
+        try:
+            self._media_list.add_media(media)
+        finally:
+            self._media_list.unlock()
+        media.release() # The media list holds its own reference to the media
+
+        self._paths.append(path)
+
+class GaplessPlayer(Player):
+    """ Player that plays the library through a MediaListBackend. Songs are bound to the backend's shared MediaPlayer
+    rather than given their own, and the back, jump, next, queue, etc. commands edit the media list.
+    """
+
+    def __init__(self, lib, volume = 100, session = None, resume_at = None, play_log = None):
+        """ Initializes a gapless player for the given library.
+
+        @param lib: Library
+        @param volume: int
+        @param session: SessionLog
+        @param resume_at: float, in seconds
+        @param play_log: PlayLog
+        """
+        Player.__init__(self, lib, volume, session = session, resume_at = resume_at, play_log = play_log)
+        self._backend = None
+        self._resume_seek = None # Time to seek the first song to once it's playing, if resuming a session
+
+    async def _play_songs(self):
+        from libvlc import EventType
+
+        self._backend = MediaListBackend(self.library)
+        self._backend.attach_event(EventType.MediaListPlayerNextItemSet,
+                                   lambda event: self._loop.call_soon_threadsafe(self._on_next_item))
+
+        try:
+            self._start(self._first_song())
+            await self._song_done.wait()
+        finally:
+            self.curr_song.stop()
+            self._backend.stop()
+
+    def _first_song(self):
+        # The media list player starts each item from the beginning, so the resume position is seeked to once the song
+        # is actually playing instead
+        self._resume_seek = self._resume_at if self._resume_at is not None and self._resume_at > 0 else None
+        return Player._first_song(self)
+
+    def _on_playing(self, song):
+        if song is self.curr_song and self._resume_seek is not None:
+            song.set_time(self._resume_seek)
+            self._resume_seek = None
+
+        Player._on_playing(self, song)
+
+    def _start(self, song):
+        self._backend.play(song)
+        instrumentation.mark("play")
+        self._bind(song)
+        instrumentation.mark("display")
+
+    def _bind(self, song):
+        """ Makes the given song the current one, playing through the backend's player.
+
+        @param song: Song
+        """
+        from libvlc import EventType
+
+        self.curr_song, self.paused = song, False
+
+        song.bind(self._backend.get_media_player())
+        song.attach_event(EventType.MediaPlayerPlaying, self._threadsafe(self._on_playing, song))
+        song.attach_event(EventType.MediaPlayerEndReached, self._threadsafe(self._on_end_reached, song))
+
+        print_main(self._main_str())
+
+    def _switch_to(self, song = None):
+        self._log_play(skipped = self._end_time is None)
+        self.curr_song.stop() # Only unbinds the song; the shared player keeps going
+        instrumentation.mark("teardown")
+        if song is None:
+            if not self.library.is_running():
+                self._song_done.set()
+                return
+            song = self.library.next_song()
+
+        self._start(song)
+
+    def _on_end_reached(self, song):
+        if song is self.curr_song:
+            self._end_time = self._loop.time()
+            if not self.library.is_running(): # VLC has nothing left to advance to
+                self._song_done.set()
+
+    def _on_next_item(self):
+        """ Called when the MediaListPlayer moves to a new item. If VLC advanced by itself, advances the library to
+        match.
+        """
+        if not self._backend.advanced() or not self.library.is_running():
+            return
+
+        self._log_play(skipped = False)
+        self.curr_song.stop()
+        self._bind(self.library.next_song())
+        self._backend.sync()
+
+    def _schedule_prefetch(self, song):
+        pass # VLC opens the next item itself
+
+    def _handle_input(self, inp):
+        Player._handle_input(self, inp)
+
+        if not self._song_done.is_set():
+            self._backend.sync() # Mirror any change the command made to the queue or history
@@ -0,0 +1,257 @@
+import time, json, threading, functools
+
+""" Lightweight runtime instrumentation: named counters and latency histograms, cheap enough to leave on. Hot paths are
+wrapped with timed() or call record() directly; the results are shown by the player's "stats" command and can be dumped
+to JSON. When disabled, a timed function costs one extra call and a flag check.
+"""
+
+BUCKET_BOUNDS = tuple(2 ** i for i in range(25)) # Histogram bucket upper bounds in microseconds, 1 us to ~16.8 s
+
+_enabled = True
+_lock = threading.Lock()
+_counters = {} # Name -> int
+_histograms = {} # Name -> Histogram
+_trace = None # Trace in progress, if any
+
+class Histogram:
+    """ Latency histogram with power of two buckets, which keeps the count, total and maximum exactly and estimates
+    percentiles to within a factor of two.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1) # The last bucket holds everything above the last bound
+        self.count = 0
+        self.total = 0.0 # In seconds
+        self.max = 0.0
+
+    def add(self, seconds):
+        """ Records one sample.
+
+        @param seconds: float
+        """
+        micros = int(seconds * 1000000)
+        self.counts[min(micros.bit_length(), len(BUCKET_BOUNDS))] += 1 # Bucket i holds [2^(i-1), 2^i) us
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """ Returns the upper bound of the bucket holding the p-th percentile sample, in seconds (capped at the maximum
+        sample), or 0 if there are no samples.
+
+        @param p: float, from 0 to 100
+
+        @return float
+        """
+        if self.count == 0:
+            return 0.0
+
+        rank, seen = p / 100 * self.count, 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count > 0:
+                bound = BUCKET_BOUNDS[i] / 1000000 if i < len(BUCKET_BOUNDS) else self.max
+                return min(bound, self.max)
+
+        return self.max
+
+    def summary(self):
+        """ Returns the count and the mean, p50, p90, p99 and maximum latencies in milliseconds.
+
+        @return dict(str -> float)
+        """
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count * 1000 if self.count > 0 else 0.0,
+            "p50_ms": self.percentile(50) * 1000,
+            "p90_ms": self.percentile(90) * 1000,
+            "p99_ms": self.percentile(99) * 1000,
+            "max_ms": self.max * 1000
+        }
+
+def set_enabled(enabled):
+    """ Turns recording on or off. Already recorded data is kept.
+
+    @param enabled: bool
+    """
+    global _enabled
+    _enabled = enabled
+
+def is_enabled():
+    return _enabled
+
+def incr(name, amount = 1):
+    """ Adds the given amount to the named counter.
+
+    @param name: str
+    @param amount: int
+    """
+    if _enabled:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + amount
+
+def record(name, seconds):
+    """ Adds a latency sample to the named histogram.
+
+    @param name: str
+    @param seconds: float
+    """
+    if _enabled:
+        with _lock:
+            histogram = _histograms.get(name)
+            if histogram is None:
+                histogram = _histograms[name] = Histogram()
+            histogram.add(seconds)
+
+def timed(name):
+    """ Decorator recording how long each call of the decorated function takes in the named histogram.
+
+    @param name: str
+
+    @return func(func -> func)
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+class Trace:
+    """ Latency trace of one operation, such as a command switching songs, split into consecutive spans. Each span is
+    recorded in the "<trace name>.<span name>" histogram and the whole trace in "<trace name>.total".
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.start = self._last = time.perf_counter()
+        self.spans = 0 # Spans ended so far
+
+    def mark(self, span):
+        """ Ends the given span, which started when the previous one ended (or when the trace started).
+
+        @param span: str
+        """
+        now = time.perf_counter()
+        record("%s.%s" % (self.name, span), now - self._last)
+        self._last = now
+        self.spans += 1
+
+    def finish(self):
+        record(self.name + ".total", time.perf_counter() - self.start)
+
+def start_trace(name):
+    """ Starts tracing the named operation, abandoning (without recording its total) any trace in progress. Spans are
+    then ended with mark(), from wherever the operation gets to, and the trace with finish_trace().
+
+    @param name: str
+    """
+    global _trace
+    _trace = Trace(name) if _enabled else None
+
+def mark(span):
+    """ Ends the given span of the trace in progress, if there is one.
+
+    @param span: str
+    """
+    if _trace is not None:
+        _trace.mark(span)
+
+def finish_trace(span = None):
+    """ Ends the trace in progress, if there is one, optionally ending a last span first.
+
+    @param span: str
+    """
+    global _trace
+    if _trace is not None:
+        if span is not None:
+            _trace.mark(span)
+        _trace.finish()
+        _trace = None
+
+def abandon_trace():
+    """ Drops the trace in progress, if there is one, without recording its total, e.g. when the operation turned out
+    not to do what's being traced.
+    """
+    global _trace
+    _trace = None
+
+def traced_spans():
+    """ Returns the number of spans ended so far in the trace in progress, or 0 if there isn't one.
+
+    @return int
+    """
+    return _trace.spans if _trace is not None else 0
+
+def tracing():
+    """ Returns whether a trace is in progress.
+
+    @return bool
+    """
+    return _trace is not None
+
+def snapshot():
+    """ Returns the current counters and histogram summaries.
+
+    @return dict
+    """
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "histograms": {name: histogram.summary() for name, histogram in _histograms.items()}
+        }
+
+def reset():
+    """ Discards everything recorded so far.
+    """
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+def dump_json(file_path, extra = None):
+    """ Writes a snapshot, plus the given extra data (e.g. other components' stats), to the given file as JSON.
+
+    @param file_path: str
+    @param extra: dict
+    """
+    data = snapshot()
+    data["time"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    if extra is not None:
+        data.update(extra)
+
+    with open(file_path, "w") as f:
+        json.dump(data, f, indent = 4)
+
+def describe(prefix = ""):
+    """ Returns the counters and histograms whose names start with the given prefix as a table, for display.
+
+    @param prefix: str
+
+    @return str
+    """
+    data = snapshot()
+    data["counters"] = {name: count for name, count in data["counters"].items() if name.startswith(prefix)}
+    data["histograms"] = {name: summary for name, summary in data["histograms"].items() if name.startswith(prefix)}
+    if len(data["counters"]) == 0 and len(data["histograms"]) == 0:
+        return "No stats recorded" + ("" if _enabled else " (instrumentation is off)")
+
+    lines = []
+    if len(data["histograms"]) > 0:
+        lines.append("%-28s %8s %9s %9s %9s %9s" % ("Latency (ms)", "count", "p50", "p90", "p99", "max"))
+        for name, summary in sorted(data["histograms"].items()):
+            lines.append("%-28s %8i %9.3f %9.3f %9.3f %9.3f" % (name, summary["count"], summary["p50_ms"],
+                                                                 summary["p90_ms"], summary["p99_ms"], summary["max_ms"]))
+    for name, count in sorted(data["counters"].items()):
+        lines.append("%-28s %8i" % (name, count))
+
+    return "\n".join(lines)
@@ -1,25 +1,37 @@
 from song import Song
+from song_exception import SongException
 from library_exception import LibraryException
-import os, random, time, difflib, heapq
+from transcoder import TRANSCODE_EXTENSIONS
+import os, random, time, difflib, heapq, queue, instrumentation
 
 class Library:
     """ Class representing a music library.
     NOTE: This class and the Song class require the vlc module to be installed. On Unix systems, it can be installed with apt-get.
     """
 
-    def __init__(self, *directories, verbose = False, shuffle = False):
-        """ Initializes a library by loading in music from the given directories.
+    def __init__(self, *directories, verbose = False, shuffle = False, transcoder = None):
+        """ Initializes a library by loading in music from the given directories. If a transcoder is given, non-MP3
+        files are converted to MP3 in the background and added to the library by load_transcoded() once converted.
 
         @param *directories: Tuple of str
+        @param transcoder: Transcoder
         """
         self.lib = [] # List of song objects tracked
         self.running = False # Whether or not the library is currently in 'running' mode, used when music is playing
         self.current_index = self.queue_index = -1
         self.directories = directories
+        self.transcoder = transcoder
+        self.transcode_failures = [] # Files that couldn't be converted, with the reason
+        self.unsupported_files = [] # Files skipped because their format can't be read or converted
+        self._transcoded = queue.SimpleQueue() # Paths of converted files waiting to be added to the library
+        self._on_transcoded_callback = None
 
         for directory in directories:
             self._load_music(directory, recurse = True, verbose = verbose)
 
+        if len(self.unsupported_files) > 0: # Reported once rather than per file, which is slow for large collections
+            print("Skipped %i files in unsupported formats" % len(self.unsupported_files))
+
         self.history = list(self.lib) # List tracking currently playing song and entire song history
 
         if shuffle:
@@ -54,6 +66,17 @@ class Library:
 
         return self.history[self.current_index]
 
+    def peek_next_song(self):
+        """ Returns the song that will play after the current one (the head of the queue, if it's non-empty) without
+        advancing internal pointers, or None if the current song is the last one.
+
+        @return: Song
+        """
+        if not self.is_running():
+            return None
+
+        return self.history[self.current_index + 1]
+
     def last_song(self):
         """ Returns the last song played, and moves internal pointers back.
         
@@ -112,20 +135,25 @@ class Library:
             if from_disk:
                 song.delete_from_disk()
 
-    def jump_to_time(self, time, song = None):
-        """ Jumps to the given time, in seconds, of the given song, which is the current song by default.
+    def jump_to_time(self, time, song = None, on_seeked = None):
+        """ Jumps to the given time, in seconds, of the given song, which is the current song by default. Returns False
+        if the time is out of range. See Song.set_time() for on_seeked.
 
         @param time: int or float
         @param song: Song
+        @param on_seeked: func(float -> void)
+
+        @return bool
         """
         if song is None:
             song = self.history[self.current_index]
 
-        song.set_time(time)
+        return song.set_time(time, on_seeked)
 
     def get_current_time(self):
         return self.history[self.current_index].get_current_time()
 
+    @instrumentation.timed("library.search")
     def search(self, query, k = 5):
         """ Given a query, formatted as a dictionary mapping columns in Song.ID3_COLUMNS + Song.NON_ID3_COLUMN
         to arguments, returns k matches, which are songs whose corresponding columns start with the
@@ -318,6 +346,92 @@ class Library:
         self.first_song() # Reset song pointers
         self.history = self.get_queued_songs() + list(self.lib)
 
+    def load_transcoded(self):
+        """ Adds the songs that have finished converting to MP3 since this was last called to the end of the library.
+        Returns how many songs were added.
+
+        @return int
+        """
+        count = 0
+        while not self._transcoded.empty():
+            abs_path = self._transcoded.get()
+            name, artist = Library._parse_song(os.path.basename(abs_path))
+
+            try:
+                song = Song(abs_path, name, artist)
+            except Exception as e:
+                self.transcode_failures.append((abs_path, str(e)))
+                continue
+
+            self.lib.append(song)
+            self.history.append(song)
+            count += 1
+
+        return count
+
+    def add_converted(self, abs_path):
+        """ Queues the given file, converted or downloaded in the background, to be added to the library by
+        load_transcoded(), and calls the transcoded callback. Can be called from any thread.
+
+        @param abs_path: str
+        """
+        self._transcoded.put(abs_path)
+        if self._on_transcoded_callback is not None:
+            self._on_transcoded_callback()
+
+    def set_transcoded_callback(self, callback):
+        """ Sets a function to call, from a transcoder thread, whenever a converted song is ready to be added with
+        load_transcoded().
+
+        @param callback: func(void -> void)
+        """
+        self._on_transcoded_callback = callback
+
+    def restore(self, lib_paths, history_paths, current_index, queue_index):
+        """ Puts the library back in the order, with the history, queue and position in it, saved from an earlier
+        session (see the session module). Songs that no longer exist are dropped, and songs that are new since are
+        added to the end. Returns the current song, or None if the session couldn't be restored, which it can't be if no
+        song was left to play after the current one. If the saved current song no longer exists, the song after it takes
+        its place, so callers resuming playback partway through the song should check it's the one they saved.
+
+        @param lib_paths: list(str)
+        @param history_paths: list(str)
+        @param current_index: int
+        @param queue_index: int
+
+        @return Song
+        """
+        songs = {song.get_file_path(): song for song in self.lib}
+        remaining = dict(songs)
+        lib = [remaining.pop(path) for path in lib_paths if path in remaining]
+        new_songs = [song for song in self.lib if song.get_file_path() in remaining] # In load order
+
+        history = []
+        for i, path in enumerate(history_paths):
+            if path in songs:
+                history.append(songs[path])
+            elif i < current_index:
+                current_index -= 1
+                queue_index -= 1
+            elif i < queue_index: # Queued song, or the current song, whose place the next one takes
+                queue_index -= 1
+
+        # A session saved at the end of the library has nothing left to play, so it's not worth resuming
+        if not (0 <= current_index < len(history) + len(new_songs) - 1):
+            return None
+
+        self.lib = lib + new_songs
+        self.history = history + new_songs
+        self.current_index, self.queue_index = current_index, max(queue_index, current_index + 1)
+        return self.current_song()
+
+    def current_song(self):
+        """ Returns the song at the current position, without moving it.
+
+        @return: Song
+        """
+        return self.history[self.current_index]
+
     def get_current_index(self):
         """ Returns the current index.
         
@@ -343,21 +457,26 @@ class Library:
         recurse_paths = []
         songs = os.listdir(directory)
         for i, file_name in enumerate(songs):
+            if file_name.startswith("."): # Hidden, e.g. a download in progress
+                continue
+
             abs_path = os.path.join(directory, file_name)
             # Parse name and artist based on my personal convention, throwing away the file extension
             name, artist = Library._parse_song(file_name)
 
             if not os.path.isdir(abs_path):
-                if not file_name.lower().endswith(".mp3"):
-                    print("Can't load non-MP3 file \"%s\"" % file_name)
-                else:
-                    try:
-                        self.lib.append(Song(abs_path, name, artist))
-
-                        if verbose:
-                            print("Loading from directory \"%s\": song %s of %s" % (directory, str(i), str(len(songs))), end = "\r")
-                    except Exception as e:
-                        print("Can't load file \"%s\" due to raised the following raised exception:\n\t\"%s\"" % (abs_path, str(e)))
+                try:
+                    self.lib.append(Song(abs_path, name, artist)) # Format is detected from the file's contents
+
+                    if verbose:
+                        print("Loading from directory \"%s\": song %s of %s" % (directory, str(i), str(len(songs))), end = "\r")
+                except SongException: # Not a format that can be read
+                    if self.transcoder is not None and file_name.lower().endswith(TRANSCODE_EXTENSIONS):
+                        self._transcode(abs_path)
+                    else:
+                        self.unsupported_files.append(abs_path)
+                except Exception as e:
+                    print("Can't load file \"%s\" due to raised the following raised exception:\n\t\"%s\"" % (abs_path, str(e)))
             elif recurse:
                 recurse_paths.append(abs_path)
         
@@ -367,6 +486,27 @@ class Library:
             for path in recurse_paths:
                 self._load_music(path, recurse, verbose)
    
+    def _transcode(self, abs_path):
+        """ Queues the given file to be converted to an MP3 next to it, unless that MP3 already exists (in which case
+        it's loaded like any other song).
+
+        @param abs_path: str
+        """
+        target = os.path.splitext(abs_path)[0] + ".mp3"
+        if os.path.exists(target):
+            return
+
+        def on_done(future):
+            if future.cancelled():
+                return
+            elif future.exception() is not None:
+                self.transcode_failures.append((abs_path, str(future.exception())))
+                return
+
+            self.add_converted(future.result())
+
+        self.transcoder.submit(abs_path, target).add_done_callback(on_done)
+
     @staticmethod
     def _parse_song(file_name):
         """
@@ -376,11 +516,11 @@ class Library:
 
         @return: tuple(str, str)
         """
+        file_name = os.path.splitext(file_name)[0]
         if " - " in file_name:
             name, artist = file_name.split(" - ")
-            artist = artist[: -4]
         else:
-            name = file_name[: -4]
+            name = file_name
             artist = None
 
         return name, artist
@@ -0,0 +1,317 @@
+import ctypes, ctypes.util, os, itertools
+
+""" Minimal ctypes binding to libvlc, covering only what the player uses: playback, seeking, volume, events, media
+parsing, and the media lists behind gapless playback. Unlike the full vlc.py binding, importing this module does no
+work; the library is loaded, and each function's symbol resolved, the first time it's called.
+
+Mirrors the names of vlc.py's classes and methods, so either module can be used with the same code.
+"""
+
+class EventType:
+    """ libvlc event types (libvlc_events.h) that the player listens for.
+    """
+    MediaPlayerPlaying          = 0x104
+    MediaPlayerPaused           = 0x105
+    MediaPlayerStopped          = 0x106
+    MediaPlayerEndReached       = 0x109
+    MediaPlayerEncounteredError = 0x10A
+    MediaPlayerTimeChanged      = 0x10B
+    MediaListPlayerPlayed       = 0x400
+    MediaListPlayerNextItemSet  = 0x401
+    MediaListPlayerStopped      = 0x402
+
+class MediaParseFlag:
+    """ Flags for Media.parse_with_options() (libvlc_media_parse_flag_t).
+    """
+    local         = 0x0
+    network       = 0x1
+    fetch_local   = 0x2
+    fetch_network = 0x4
+    interact      = 0x8
+
+class Event(ctypes.Structure):
+    """ The start of a libvlc_event_t, enough to tell which event a callback is being called for.
+    """
+    _fields_ = [("type", ctypes.c_int), ("obj", ctypes.c_void_p)]
+
+_EventCallback = ctypes.CFUNCTYPE(None, ctypes.POINTER(Event), ctypes.c_void_p)
+
+_p = ctypes.c_void_p
+_SIGNATURES = { # Function name -> (return type, argument types)
+    "libvlc_new":                                  (_p, (ctypes.c_int, ctypes.POINTER(ctypes.c_char_p))),
+    "libvlc_release":                              (None, (_p,)),
+    "libvlc_media_new_path":                       (_p, (_p, ctypes.c_char_p)),
+    "libvlc_media_new_location":                   (_p, (_p, ctypes.c_char_p)),
+    "libvlc_media_release":                        (None, (_p,)),
+    "libvlc_media_parse_with_options":             (ctypes.c_int, (_p, ctypes.c_uint, ctypes.c_int)),
+    "libvlc_media_player_new":                     (_p, (_p,)),
+    "libvlc_media_player_release":                 (None, (_p,)),
+    "libvlc_media_player_set_media":               (None, (_p, _p)),
+    "libvlc_media_player_get_media":               (_p, (_p,)),
+    "libvlc_media_player_event_manager":           (_p, (_p,)),
+    "libvlc_media_player_play":                    (ctypes.c_int, (_p,)),
+    "libvlc_media_player_pause":                   (None, (_p,)),
+    "libvlc_media_player_stop":                    (None, (_p,)),
+    "libvlc_media_player_is_playing":              (ctypes.c_int, (_p,)),
+    "libvlc_media_player_is_seekable":             (ctypes.c_int, (_p,)),
+    "libvlc_media_player_get_time":                (ctypes.c_longlong, (_p,)),
+    "libvlc_media_player_set_time":                (None, (_p, ctypes.c_longlong)),
+    "libvlc_media_player_get_length":              (ctypes.c_longlong, (_p,)),
+    "libvlc_audio_get_volume":                     (ctypes.c_int, (_p,)),
+    "libvlc_audio_set_volume":                     (ctypes.c_int, (_p, ctypes.c_int)),
+    "libvlc_audio_set_mute":                       (None, (_p, ctypes.c_int)),
+    "libvlc_media_list_new":                       (_p, (_p,)),
+    "libvlc_media_list_release":                   (None, (_p,)),
+    "libvlc_media_list_lock":                      (None, (_p,)),
+    "libvlc_media_list_unlock":                    (None, (_p,)),
+    "libvlc_media_list_add_media":                 (ctypes.c_int, (_p, _p)),
+    "libvlc_media_list_remove_index":              (ctypes.c_int, (_p, ctypes.c_int)),
+    "libvlc_media_list_count":                     (ctypes.c_int, (_p,)),
+    "libvlc_media_list_player_new":                (_p, (_p,)),
+    "libvlc_media_list_player_release":            (None, (_p,)),
+    "libvlc_media_list_player_set_media_player":   (None, (_p, _p)),
+    "libvlc_media_list_player_set_media_list":     (None, (_p, _p)),
+    "libvlc_media_list_player_play_item_at_index": (ctypes.c_int, (_p, ctypes.c_int)),
+    "libvlc_media_list_player_stop":               (None, (_p,)),
+    "libvlc_media_list_player_event_manager":      (_p, (_p,)),
+    "libvlc_event_attach":                         (ctypes.c_int, (_p, ctypes.c_uint, _EventCallback, _p)),
+    "libvlc_event_detach":                         (None, (_p, ctypes.c_uint, _EventCallback, _p)),
+}
+
+_dll = None
+_functions = {} # Function name -> resolved ctypes function
+
+def load_library():
+    """ Loads libvlc, if it isn't loaded yet, and returns it. The PYTHON_VLC_LIB_PATH environment variable overrides
+    where it's loaded from.
+
+    @return ctypes.CDLL
+    """
+    global _dll
+    if _dll is None:
+        path = os.environ.get("PYTHON_VLC_LIB_PATH") or ctypes.util.find_library("vlc") or "libvlc.so.5"
+        _dll = ctypes.CDLL(path)
+
+    return _dll
+
+def loaded_functions():
+    """ Returns the names of the functions resolved so far.
+
+    @return list(str)
+    """
+    return sorted(_functions)
+
+def _call(name, *args):
+    # Calls the named libvlc function, resolving and caching its symbol on first use
+    func = _functions.get(name)
+    if func is None:
+        restype, argtypes = _SIGNATURES[name]
+        try:
+            func = getattr(load_library(), name)
+        except AttributeError: # Older libvlc, as vlc.py reports it
+            raise NotImplementedError(name)
+        func.restype, func.argtypes = restype, argtypes
+        _functions[name] = func
+
+    return func(*args)
+
+class _Object:
+    # Wraps a pointer to a libvlc object; passed to ctypes functions as the pointer itself
+    def __init__(self, ptr):
+        if not ptr:
+            raise MemoryError("libvlc returned NULL")
+        self._as_parameter_ = ctypes.c_void_p(ptr)
+
+class Instance(_Object):
+    def __init__(self, *args):
+        """ Initializes a libvlc instance with the given command line options (e.g. "--no-video").
+
+        @param *args: tuple of str
+        """
+        argv = (ctypes.c_char_p * len(args))(*[os.fsencode(arg) for arg in args])
+        _Object.__init__(self, _call("libvlc_new", len(args), argv))
+
+    def media_new(self, path):
+        """ Returns a Media for the given file path or MRL (e.g. "http://...").
+
+        @param path: str
+
+        @return Media
+        """
+        if "://" in path:
+            return Media(_call("libvlc_media_new_location", self, os.fsencode(path)))
+        return Media(_call("libvlc_media_new_path", self, os.fsencode(path)))
+
+    def media_player_new(self):
+        return MediaPlayer(_call("libvlc_media_player_new", self))
+
+    def media_list_new(self):
+        return MediaList(_call("libvlc_media_list_new", self))
+
+    def media_list_player_new(self):
+        return MediaListPlayer(_call("libvlc_media_list_player_new", self))
+
+    def release(self):
+        _call("libvlc_release", self)
+
+class Media(_Object):
+    def parse_with_options(self, parse_flag, timeout):
+        """ Starts parsing the media in the background. Returns -1 on error, 0 otherwise.
+
+        @param parse_flag: int, a MediaParseFlag
+        @param timeout: int, in milliseconds, or -1 for VLC's default
+
+        @return int
+        """
+        return _call("libvlc_media_parse_with_options", self, parse_flag, timeout)
+
+    def release(self):
+        _call("libvlc_media_release", self)
+
+class EventManager(_Object):
+    """ Registers Python callbacks for the events of a libvlc object. Only one callback per event type, as in vlc.py.
+    """
+
+    _next_key = itertools.count(1)
+    _callbacks = {} # Key passed to libvlc as the callback's user data -> Python callback, for all event managers
+
+    def __init__(self, ptr):
+        _Object.__init__(self, ptr)
+        self._keys = {} # Event type -> key of the callback attached for it
+
+    def event_attach(self, event_type, callback):
+        """ Calls the given function, from a libvlc thread, with the Event whenever an event of the given type occurs.
+
+        @param event_type: int, an EventType
+        @param callback: func(Event -> void)
+        """
+        self.event_detach(event_type)
+
+        key = next(EventManager._next_key)
+        EventManager._callbacks[key] = callback
+        self._keys[event_type] = key
+        if _call("libvlc_event_attach", self, event_type, _handle_event, key) != 0:
+            self.event_detach(event_type)
+            raise MemoryError("Couldn't attach libvlc event callback")
+
+    def event_detach(self, event_type):
+        """ Removes the callback for the given event type, if there is one.
+
+        @param event_type: int, an EventType
+        """
+        key = self._keys.pop(event_type, None)
+        if key is not None:
+            _call("libvlc_event_detach", self, event_type, _handle_event, key)
+            del EventManager._callbacks[key]
+
+@_EventCallback
+def _handle_event(event, key):
+    callback = EventManager._callbacks.get(key)
+    if callback is not None:
+        callback(event.contents)
+
+class MediaPlayer(_Object):
+    def __init__(self, ptr):
+        _Object.__init__(self, ptr)
+        self._event_manager = None # Kept, since it holds the callbacks attached through it
+
+    def set_media(self, media):
+        _call("libvlc_media_player_set_media", self, media)
+
+    def get_media(self):
+        """ Returns the player's media, or None. The caller doesn't own a reference to it.
+
+        @return Media
+        """
+        ptr = _call("libvlc_media_player_get_media", self)
+        if not ptr:
+            return None
+
+        media = Media(ptr)
+        _call("libvlc_media_release", media) # get_media() adds a reference, which the player's own one outlives
+        return media
+
+    def event_manager(self):
+        if self._event_manager is None:
+            self._event_manager = EventManager(_call("libvlc_media_player_event_manager", self))
+        return self._event_manager
+
+    def play(self):
+        return _call("libvlc_media_player_play", self)
+
+    def pause(self):
+        _call("libvlc_media_player_pause", self)
+
+    def stop(self):
+        _call("libvlc_media_player_stop", self)
+
+    def is_playing(self):
+        return _call("libvlc_media_player_is_playing", self)
+
+    def is_seekable(self):
+        return _call("libvlc_media_player_is_seekable", self)
+
+    def get_time(self):
+        return _call("libvlc_media_player_get_time", self)
+
+    def set_time(self, ms):
+        _call("libvlc_media_player_set_time", self, ms)
+
+    def get_length(self):
+        return _call("libvlc_media_player_get_length", self)
+
+    def audio_get_volume(self):
+        return _call("libvlc_audio_get_volume", self)
+
+    def audio_set_volume(self, volume):
+        return _call("libvlc_audio_set_volume", self, volume)
+
+    def audio_set_mute(self, mute):
+        _call("libvlc_audio_set_mute", self, int(mute))
+
+    def release(self):
+        _call("libvlc_media_player_release", self)
+
+class MediaList(_Object):
+    def lock(self):
+        _call("libvlc_media_list_lock", self)
+
+    def unlock(self):
+        _call("libvlc_media_list_unlock", self)
+
+    def add_media(self, media):
+        return _call("libvlc_media_list_add_media", self, media)
+
+    def remove_index(self, index):
+        return _call("libvlc_media_list_remove_index", self, index)
+
+    def count(self):
+        return _call("libvlc_media_list_count", self)
+
+    def release(self):
+        _call("libvlc_media_list_release", self)
+
+class MediaListPlayer(_Object):
+    def __init__(self, ptr):
+        _Object.__init__(self, ptr)
+        self._event_manager = None
+
+    def set_media_player(self, media_player):
+        _call("libvlc_media_list_player_set_media_player", self, media_player)
+
+    def set_media_list(self, media_list):
+        _call("libvlc_media_list_player_set_media_list", self, media_list)
+
+    def play_item_at_index(self, index):
+        return _call("libvlc_media_list_player_play_item_at_index", self, index)
+
+    def stop(self):
+        _call("libvlc_media_list_player_stop", self)
+
+    def event_manager(self):
+        if self._event_manager is None:
+            self._event_manager = EventManager(_call("libvlc_media_list_player_event_manager", self))
+        return self._event_manager
+
+    def release(self):
+        _call("libvlc_media_list_player_release", self)
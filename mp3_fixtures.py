@@ -0,0 +1,181 @@
+#!/usr/bin/python
+
+import sys, os, random, struct
+
+""" Writes synthetic MP3 files and libraries for benchmarks: minimal but valid MPEG audio frames behind ID3v2.4 tags, so
+loading them goes through the same parsing as real music. Each file holds only a few silent frames, with a Xing (VBR) or
+Info (CBR) header declaring the full duration, so a 100,000 file library takes a few hundred MB at most and seconds to
+write. Run "python mp3_fixtures.py <directory> <tracks>" to write a library from the command line.
+"""
+
+SAMPLE_RATE = 44100
+SAMPLES_PER_FRAME = 1152
+BITRATES = (32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320) # kbps, MPEG 1 layer III
+CBR_BITRATE = 128
+VBR_AVERAGE_BITRATE = 192 # Declared by Xing headers, as if the audio were all there
+
+GENRES = ("Rock", "Pop", "Jazz", "Hip-Hop", "Electronic", "Classical", "Folk", "Metal", "Soul", "Country", "Blues",
+          "Reggae", "Ambient", "Punk", "Indie")
+WORDS = ("love", "night", "city", "fire", "blue", "dream", "river", "heart", "light", "road", "gold", "rain", "wild",
+         "summer", "ghost", "paper", "echo", "stone", "silver", "ocean", "shadow", "electric", "morning", "highway",
+         "velvet", "glass", "winter", "neon", "honey", "thunder", "satellite", "garden", "mirror", "midnight")
+
+_JPEG_HEADER = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00"
+_cover_art = {} # Size -> APIC frame data, built once per size
+
+def frame_header(bitrate):
+    """ Returns the 4 byte header of an MPEG 1 layer III frame at the given bitrate (joint stereo, 44.1 kHz, no CRC).
+
+    @param bitrate: int, in kbps, one of BITRATES
+
+    @return bytes
+    """
+    return struct.pack(">I", 0xFFFB0064 | (BITRATES.index(bitrate) + 1) << 12)
+
+def frame_size(bitrate):
+    """ Returns the size of an unpadded frame at the given bitrate, in bytes.
+
+    @param bitrate: int, in kbps
+
+    @return int
+    """
+    return 144 * bitrate * 1000 // SAMPLE_RATE
+
+def audio_frames(num_frames, vbr = False, rand = None):
+    """ Returns the given number of silent frames, at CBR_BITRATE or, if vbr is set, at random bitrates.
+
+    @param num_frames: int
+    @param vbr: bool
+    @param rand: random.Random
+
+    @return bytes
+    """
+    if not vbr:
+        return (frame_header(CBR_BITRATE) + bytes(frame_size(CBR_BITRATE) - 4)) * num_frames
+
+    rand = rand if rand is not None else random
+    bitrates = [rand.choice(BITRATES[6 :]) for _ in range(num_frames)] # 96 kbps and up, like a typical V0-V4 encode
+    return b"".join(frame_header(bitrate) + bytes(frame_size(bitrate) - 4) for bitrate in bitrates)
+
+def info_frame(duration, vbr = False):
+    """ Returns a frame holding a Xing (VBR) or Info (CBR) header, which declares the stream's length (and a size to
+    match its bitrate) so that readers don't have to estimate it from the file size.
+
+    @param duration: float, in seconds
+    @param vbr: bool
+
+    @return bytes
+    """
+    num_frames = int(duration * SAMPLE_RATE / SAMPLES_PER_FRAME)
+    num_bytes = int(duration * (VBR_AVERAGE_BITRATE if vbr else CBR_BITRATE) * 1000 / 8)
+    header = frame_header(CBR_BITRATE) + bytes(32) # Side information, 32 bytes for stereo MPEG 1
+    header += (b"Xing" if vbr else b"Info") + struct.pack(">III", 0x3, num_frames, num_bytes) # Frames and bytes fields
+
+    return header + bytes(frame_size(CBR_BITRATE) - len(header))
+
+def id3_tag(tags, padding = 0, cover_art_size = 0):
+    """ Returns an ID3v2.4 tag with UTF-8 text frames for the given {frame ID: text}, e.g. {"TIT2": "Title"}, optionally
+    followed by a front cover picture of the given size and the given number of padding bytes.
+
+    @param tags: dict(str -> str)
+    @param padding: int
+    @param cover_art_size: int, in bytes
+
+    @return bytes
+    """
+    frames = [_frame(frame_id, b"\x03" + text.encode()) for frame_id, text in tags.items()]
+    if cover_art_size > 0:
+        if cover_art_size not in _cover_art:
+            image = _JPEG_HEADER + bytes(max(cover_art_size - len(_JPEG_HEADER), 0))
+            _cover_art[cover_art_size] = _frame("APIC", b"\x03image/jpeg\x00\x03\x00" + image) # Front cover, no description
+        frames.append(_cover_art[cover_art_size])
+
+    body = b"".join(frames) + bytes(padding)
+    return b"ID3\x04\x00\x00" + _syncsafe(len(body)) + body
+
+def write_mp3(file_path, tags, duration = 180, vbr = False, padding = 0, cover_art_size = 0, num_frames = 4, rand = None):
+    """ Writes an MP3 file with the given ID3 tags, declaring the given duration but holding only num_frames frames of
+    (silent) audio.
+
+    @param file_path: str
+    @param tags: dict(str -> str), ID3 frame IDs to text
+    @param duration: float, in seconds
+    @param vbr: bool
+    @param padding: int, bytes of padding in the ID3 tag
+    @param cover_art_size: int, bytes of embedded cover art, or 0 for none
+    @param num_frames: int
+    @param rand: random.Random, for VBR bitrates
+    """
+    audio = audio_frames(num_frames, vbr, rand)
+    data = id3_tag(tags, padding, cover_art_size) + info_frame(duration, vbr) + audio
+
+    with open(file_path, "wb") as f:
+        f.write(data)
+
+def generate_library(directory, tracks, seed = 0, tracks_per_album = 10, albums_per_artist = 4, fan_out = True,
+                     vbr = False, padding = 1024, cover_art_size = 0, num_frames = 4):
+    """ Writes a synthetic library of the given number of tracks into the given directory. Tracks are grouped into
+    albums and albums by artist, each with a title, artist, album, genre, year and track number tag, and named by the
+    library's "<title> - <artist>.mp3" convention. The same seed always produces the same library.
+
+    @param directory: str
+    @param tracks: int
+    @param seed: int
+    @param tracks_per_album: int
+    @param albums_per_artist: int
+    @param fan_out: bool, whether to put each album in an "<artist>/<album>" subdirectory rather than all files in one
+    @param vbr: bool
+    @param padding: int, bytes of padding in each ID3 tag (taggers usually leave some, so edits don't rewrite files)
+    @param cover_art_size: int, bytes of embedded cover art per file, or 0 for none
+    @param num_frames: int, frames of audio per file
+
+    @return list(str), the paths of the files written
+    """
+    rand = random.Random(seed)
+    cbr_audio = audio_frames(num_frames) # Identical for every CBR file, so built once
+    paths = []
+    album_dir = directory
+
+    for i in range(tracks):
+        album_index, track = divmod(i, tracks_per_album)
+        artist_index = album_index // albums_per_artist
+
+        if track == 0 and album_index % albums_per_artist == 0: # New artist
+            artist = "%s %s %i" % (rand.choice(WORDS).title(), rand.choice(WORDS).title(), artist_index)
+        if track == 0: # New album
+            album = "%s %s" % (rand.choice(WORDS).title(), rand.choice(WORDS).title())
+            genre, year = rand.choice(GENRES), str(rand.randint(1960, 2024))
+            if fan_out:
+                album_dir = os.path.join(directory, artist, "%s (%i)" % (album, album_index))
+                os.makedirs(album_dir, exist_ok = True)
+
+        title = " ".join(rand.choice(WORDS) for _ in range(rand.randint(1, 4))).title() + " %i" % i
+        tags = {"TIT2": title, "TPE1": artist, "TALB": album, "TCON": genre, "TDRC": year, "TRCK": str(track + 1)}
+
+        audio = audio_frames(num_frames, True, rand) if vbr else cbr_audio
+        duration = rand.uniform(120, 360)
+        data = id3_tag(tags, padding, cover_art_size) + info_frame(duration, vbr) + audio
+
+        path = os.path.join(album_dir, "%s - %s.mp3" % (title, artist))
+        with open(path, "wb") as f:
+            f.write(data)
+        paths.append(path)
+
+    return paths
+
+# Helper functions below
+
+def _frame(frame_id, data):
+    return frame_id.encode() + _syncsafe(len(data)) + b"\x00\x00" + data
+
+def _syncsafe(n):
+    # ID3v2.4 sizes use 7 bits per byte
+    return bytes([(n >> 21) & 0x7F, (n >> 14) & 0x7F, (n >> 7) & 0x7F, n & 0x7F])
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or not sys.argv[2].isdigit():
+        print("Usage: python mp3_fixtures.py <directory> <tracks>")
+        sys.exit(1)
+
+    os.makedirs(sys.argv[1], exist_ok = True)
+    print("Wrote %i files" % len(generate_library(sys.argv[1], int(sys.argv[2]))))
@@ -1,38 +1,39 @@
-import sys, threading, os
-import main, util
+import os, time
+import util, instrumentation
 from song import Song
-from downloader import youtube_search, youtube_download_audio
 
-# Can't do "from main import _" due to circular import problems
-USER_INPUT_MARKER = main.USER_INPUT_MARKER
-POLL_INTERVAL     = main.POLL_INTERVAL
-PLAY_STR          = main.PLAY_STR
 help_message      = util.help_message
 help_dict         = util.help_dict
-print_main        = util.print_main
-read_stdin        = util.read_stdin
 
-def _volume(inp, main_str, curr_song, volume):
+COMMAND_ALIASES   = {"s": "skip", "b": "back"} # Keyboard shortcuts -> the commands they stand for
+
+def _volume(inp, curr_song, volume):
+    """ Parses a "volume" command, setting the volume of the current song if requested. Returns the new volume and
+    the output message to print.
+
+    @param inp: str
+    @param curr_song: Song
+    @param volume: int
+
+    @return tuple(int, str)
+    """
     new_volume = volume
     tokens = inp.lower().split()
 
     if len(tokens) == 1:
-        print_main(main_str % str(curr_song["title"]), USER_INPUT_MARKER + inp, "Volume at %s%%" % volume)
+        return (volume, "Volume at %s%%" % volume)
     elif len(tokens) == 2:
         try:
             new_volume = int(tokens[1])
             if new_volume < 0 or new_volume > 100:
-                print_main(main_str % str(curr_song["title"]), USER_INPUT_MARKER + inp, "Argument out of range (0 to 100)")
+                return (volume, "Argument out of range (0 to 100)")
             else:
                 curr_song.set_volume(new_volume)
-                print_main(main_str % str(curr_song["title"]), USER_INPUT_MARKER + inp, "Volume set to %s%%" % new_volume)
+                return (new_volume, "Volume set to %s%%" % new_volume)
         except ValueError:
-            print_main(main_str % str(curr_song["title"]), USER_INPUT_MARKER + inp, "Argument is not an integer")
-            new_volume = volume
+            return (volume, "Argument is not an integer")
     else:
-        print_main(main_str % str(curr_song["title"]), USER_INPUT_MARKER + inp, "Couldn't parse argument to \"volume\" command")
-
-    return new_volume
+        return (volume, "Couldn't parse argument to \"volume\" command")
 
 class Parser:
     """ Class used to parse user input and perform the appropriate library manipulation or provide
@@ -41,6 +42,7 @@ class Parser:
 
     def __init__(self, lib):
         self.library = lib
+        self.on_seeked = None # Called from a VLC thread with the song and the latency in ms once a "time" seek is done
 
     def parse_user_input(self, curr_song, inp):
         """ Given user input, parses the input and executes the appropriate command in the
@@ -59,9 +61,20 @@ class Parser:
 
         if len(inp) == 0 or len(tokens) == 0:
             return (None, None)
-        elif inp == "stop":
-            return self._stop(curr_song)
-        elif tokens[0] == "help":
+        elif not instrumentation.is_enabled():
+            return self._dispatch(curr_song, inp, tokens)
+
+        start = time.perf_counter()
+        result = self._dispatch(curr_song, inp, tokens)
+        if result[1] == "Unrecognized command": # Counted, rather than letting typos create histograms
+            instrumentation.incr("parser.unrecognized")
+        else:
+            instrumentation.record("parser." + COMMAND_ALIASES.get(tokens[0], tokens[0]), time.perf_counter() - start)
+        return result
+
+    def _dispatch(self, curr_song, inp, tokens):
+        # Executes the command given by the (lowercased, stripped and non-empty) input
+        if tokens[0] == "help":
             return self._help(tokens)
         elif inp == "columns":
             return self._columns()
@@ -100,11 +113,6 @@ class Parser:
         else:
             return (None, "Unrecognized command")
 
-    def _stop(self, curr_song):
-        curr_song.stop()
-        sys.exit()
-        return (None, None) # Unreachable line
-
     def _help(self, tokens):
         if len(tokens) == 1:
             return (None, help_message())
@@ -122,10 +130,16 @@ class Parser:
         return (None, columns_str)
 
     def _skip(self):
-        return (self.library.next_song(), None)
+        instrumentation.mark("parse")
+        song = self.library.next_song()
+        instrumentation.mark("library")
+        return (song, None)
 
     def _back(self):
-        return (self.library.last_song(), None)
+        instrumentation.mark("parse")
+        song = self.library.last_song()
+        instrumentation.mark("library")
+        return (song, None)
 
     def _delete(self, tokens):
         if len(tokens) == 1:
@@ -175,7 +189,9 @@ class Parser:
 
         matched_songs, guessed_songs = self.library.search(query)
         if len(matched_songs) == 1:
+            instrumentation.mark("parse")
             next_song = self.library.jump_to_song(matched_songs[0])
+            instrumentation.mark("library")
         else:
             next_song = None
 
@@ -187,6 +203,7 @@ class Parser:
             return (None, "Playing \"%s\" again" % str(curr_song))
 
     def _restart(self, curr_song):
+        instrumentation.mark("parse")
         return (curr_song, None)
 
     def _time(self, curr_song, tokens):
@@ -204,8 +221,13 @@ class Parser:
                 elif time > curr_song["length"]:
                     return (None, "Can't jump to length %i in song \"%s\" - out of bounds" % (time, curr_song))
                 else:
-                    self.library.jump_to_time(time)
-                    return (None, None)
+                    instrumentation.mark("parse")
+                    on_seeked = None
+                    if self.on_seeked is not None:
+                        on_seeked = lambda latency: self.on_seeked(curr_song, latency)
+                    if not self.library.jump_to_time(time, on_seeked = on_seeked):
+                        return (None, "Can't jump to length %i in song \"%s\" - out of bounds" % (time, curr_song))
+                    return (None, "Jumping to %s seconds" % time)
             except ValueError:
                 return (None, "Couldn't parse timestamp")
 
@@ -430,137 +452,50 @@ class Parser:
             matches_str = Parser._matches_str(matched_songs, guessed_songs, on_success)
             return (None, matches_str)
 
-    def _download(self, main_str, curr_song, inp, tokens):
+    def _download(self, tokens):
+        """ Parses a "download" command into a download request, without doing any network access. Returns the request
+        as a tuple of the search query, the directory to save to, the file name (None to use the video title) and
+        whether to use the first search match, or None and an error message if the command couldn't be parsed.
+
+        @param tokens: list(str)
+
+        @return tuple(tuple(str, str, str, bool), str)
+        """
         if len(tokens) == 1:
             return (None, "No Youtube search query given")
-        else:
-            # Build query
-            query, accepted_options = {}, set(["query", "filepath", "filename", "best"])
-            for key, val in Parser._parse_all_args(tokens[1 :], sanitize_quotes = True).items():
-                if key.lower() not in accepted_options:
-                    return (None, "Could not parse argument")
-                elif key.lower() == "filepath" or key.lower() == "filename":
-                    query[key] = val
-                else:
-                    query[key.lower()] = val.lower()
-
-            # Error checking and initialization
-            use_first_match = "best" in query
 
-            if query is None:
-                return (None, "Could not pass argument")
-            elif "query" not in query:
-                return (None, "No \"query\" option given")
-            
-            if "filepath" not in query:
-                file_path = self.lib.get_directories()[0]
+        # Build query
+        parsed_args = Parser._parse_all_args(tokens[1 :], sanitize_quotes = True)
+        if parsed_args is None:
+            return (None, "Could not parse argument")
+
+        query, accepted_options = {}, set(["query", "filepath", "filename", "best"])
+        for key, val in parsed_args.items():
+            if key.lower() not in accepted_options:
+                return (None, "Could not parse argument")
+            elif key.lower() == "filepath" or key.lower() == "filename":
+                query[key.lower()] = val
             else:
-                file_path = query["filepath"].strip()
+                query[key.lower()] = val.lower()
 
-                if not os.path.exists(file_path):
-                    return (None, "Invalid or non-existent file_path")
+        # Error checking and initialization
+        if "query" not in query:
+            return (None, "No \"query\" option given")
 
-            if "filename" not in query:
-                file_name = None
-            else:
-                file_name = query["filename"].strip()
+        if "filepath" not in query:
+            file_path = self.library.get_directories()[0]
+        else:
+            file_path = query["filepath"].strip()
 
-            # Search Youtube and get search results
-            results = youtube_search(query["query"])
-            if len(results) == 0:
-                return (None, "No Youtube results found for query")
+            if not os.path.exists(file_path):
+                return (None, "Invalid or non-existent file_path")
 
-            # Choose which video to download
-            if use_first_match:
-                # Find best match
-                video = results[0]
-            else:
-                # Prompt user for each search result, asking whether to download
-                for metadata_dict in results:
-                    output_message = "Download \"%s\" from Youtube (type \"download info\" for more information " + \
-                                     "or \"break\" to abort)? (y/n)" % metadata_dict["title"]
-                    print_main(main_str % curr_song["title"], USER_INPUT_MARKER + inp, output_message)
-
-                    found = False
-                    while True:
-                        inp = read_stdin(POLL_INTERVAL)
-
-                        if inp:
-                            inp = inp.lower().strip()
-                            if inp == "y":
-                                found = True
-                                break
-                            elif inp == "n":
-                                break
-                            elif inp == "break":
-                                return (None, None)
-                            elif inp == "download info": # Provide additional information about current video
-                                output_message = ""
-                                for key in metadata_dict:
-                                    output_message += key.upper() + ": " + str(metadata_dict[key]) + "\n"
-
-                                output_message = output_message[: -1] # Trim last newline
-                                print_main(main_str % current["title"], USER_INPUT_MARKER + inp, output_message)
-                            else:
-                                output_message = "Unrecognized input"
-                                print_main(main_str % curr["title"], USER_INPUT_MARKER + inp, output_message)
-
-                    if found:
-                        video = metadata_dict
-                        break
-
-                if not found:
-                    return (None, None)
-
-
-            # Download on another thread
-            if file_name is None:
-                file_name = video["title"]
-            file_name += ".mp3"
-            url = "https://www.youtube.com/watch?v=%s" % video["id"]
-
-            thread = threading.Thread(target = youtube_download_audio, args = (url, file_path, file_name))
-            thread.start()
-
-            return (thread, "Downloading on another thread")
-
-    def _pause(self, main_str, curr_song, inp):
-        curr_song.pause()
-        pause_main_str = main_str + " [paused]"
-        print_main(pause_main_str % str(curr_song["title"]), USER_INPUT_MARKER + inp, None)
-
-        thread = None
-        while True:
-            inp = read_stdin(POLL_INTERVAL)
-
-            if inp is not None:
-                inp = inp.lower().strip()
-                if inp == "unpause" or inp == "up": # Keyboard shortcut
-                    curr_song.play()
-
-                    print_main(main_str % str(curr_song["title"]), USER_INPUT_MARKER + inp, None)
-
-                    return (None, inp, None)
-                elif inp.lower().strip() != "pause":
-                    next_song, output_message = self.parse_user_input(curr_song, inp)
-                    if next_song is not None:
-                        return (next_song, inp, output_message)
-                elif inp.lower.startswith("download"):
-                    thread, output_message = self._download(main_str, curr_song, inp)
-                    next_song = None
-                else:
-                    next_song, output_message = None, None
+        if "filename" not in query:
+            file_name = None
+        else:
+            file_name = query["filename"].strip()
 
-                if thread is not None:
-                    if thread.is_alive():
-                        download_main_str = pause_main_str + " [downloading]"
-                        print_main(download_main_str % str(curr_song["title"]), USER_INPUT_MARKER + inp, output_message)
-                    else:
-                        thread.join()
-                        thread = None
-                        print_main(pause_main_str % str(curr_song["title"]), USER_INPUT_MARKER + inp, output_message)
-                else:
-                    print_main(pause_main_str % str(curr_song["title"]), USER_INPUT_MARKER + inp, output_message)
+        return ((query["query"], file_path, file_name, "best" in query), None)
 
     # Helper functions below
 
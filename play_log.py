@@ -0,0 +1,135 @@
+import os, json, heapq
+
+""" Durable record of what was actually played, kept apart from the library's history (which is playback order, and
+includes songs that were only skipped past). Every play is appended to a log, one line per play; per-song aggregates
+(play and skip counts, last played, time spent on each) are rolled up from the log into a separate file, so queries
+and startup only ever read the aggregates plus the part of the log written since the last rollup.
+"""
+
+DEFAULT_LOG_FILE = os.path.join(os.path.expanduser("~"), ".music_player_plays")
+ROLLUP_EVERY = 50 # Plays appended between rollups
+
+# Indices into a song's aggregate
+PLAYS, SKIPS, LAST_PLAYED, SECONDS = range(4)
+
+class PlayLog:
+    """ Append-only log of plays, with rolled up per-song aggregates. Each line of the log is a JSON list of the song's
+    file path, the start and end times of the play (as Unix timestamps) and whether it was skipped before the end. The
+    rollup, in "<log file>.rollup", holds the aggregates and how many bytes of the log they cover.
+    """
+
+    def __init__(self, file_path = DEFAULT_LOG_FILE):
+        """ Opens the log at the given path, creating it if needed, and brings the aggregates up to date with it.
+
+        @param file_path: str
+        """
+        self.file_path = file_path
+        self.rollup_path = file_path + ".rollup"
+        self.songs = {} # File path -> [plays, skips, last played, seconds spent on the song]
+        self._offset = 0 # Bytes of the log covered by the rollup
+        self._pending = 0 # Plays appended since the last rollup
+
+        try:
+            with open(self.rollup_path) as f:
+                rollup = json.load(f)
+            self.songs, self._offset = rollup["songs"], rollup["offset"]
+        except (OSError, ValueError, KeyError): # No rollup yet, or a broken one, so roll up the whole log
+            self.songs, self._offset = {}, 0
+
+        with open(self.file_path, "ab+") as f:
+            if f.tell() < self._offset: # Log was replaced or truncated under the rollup
+                self.songs, self._offset = {}, 0
+
+            f.seek(self._offset)
+            tail = f.read()
+            if len(tail) > 0 and not tail.endswith(b"\n"): # Play cut short by a crash, which the next would merge with
+                end = tail.rfind(b"\n") + 1
+                f.truncate(self._offset + end)
+                tail = tail[: end]
+
+        for line in tail.decode(errors = "replace").splitlines():
+            self._add(*json.loads(line))
+            self._pending += 1
+
+        self._file = open(self.file_path, "a")
+        if self._pending > 0:
+            self.rollup()
+
+    def record(self, file_path, start, end, skipped):
+        """ Appends a play of the given song to the log and updates its aggregates.
+
+        @param file_path: str
+        @param start: float, Unix timestamp
+        @param end: float, Unix timestamp
+        @param skipped: bool, whether the song was switched away from before it ended
+        """
+        start, end = round(start, 1), round(end, 1) # As logged, so the aggregates match a rollup of the log
+        self._file.write(json.dumps([file_path, start, end, skipped]) + "\n")
+        self._file.flush()
+        self._add(file_path, start, end, skipped)
+
+        self._pending += 1
+        if self._pending >= ROLLUP_EVERY:
+            self.rollup()
+
+    def rollup(self):
+        """ Writes the aggregates, covering everything logged so far, to the rollup file.
+        """
+        self._file.flush()
+        rollup = {"offset": os.path.getsize(self.file_path), "songs": self.songs}
+
+        temp_path = self.rollup_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(rollup, f, separators = (",", ":"))
+        os.replace(temp_path, self.rollup_path) # Atomic, so the rollup always matches some prefix of the log
+
+        self._offset, self._pending = rollup["offset"], 0
+
+    def close(self):
+        """ Rolls up anything logged since the last rollup and closes the log.
+        """
+        if self._pending > 0:
+            self.rollup()
+        self._file.close()
+
+    def most_played(self, k = 10):
+        """ Returns the file paths and play counts of the k songs played through to the end the most times.
+
+        @param k: int
+
+        @return list(tuple(str, int))
+        """
+        top = heapq.nlargest(k, self.songs.items(), key = lambda item: (item[1][PLAYS], item[1][LAST_PLAYED]))
+        return [(file_path, song[PLAYS]) for file_path, song in top if song[PLAYS] > 0]
+
+    def recently_played(self, k = 10):
+        """ Returns the file paths of the k songs played (or skipped) most recently, and when, as Unix timestamps.
+
+        @param k: int
+
+        @return list(tuple(str, float))
+        """
+        top = heapq.nlargest(k, self.songs.items(), key = lambda item: item[1][LAST_PLAYED])
+        return [(file_path, song[LAST_PLAYED]) for file_path, song in top]
+
+    def never_played(self, file_paths):
+        """ Returns the given file paths (e.g. of the songs in the library) that have never been played through to
+        the end, in the order given.
+
+        @param file_paths: iterable(str)
+
+        @return list(str)
+        """
+        return [file_path for file_path in file_paths
+                if file_path not in self.songs or self.songs[file_path][PLAYS] == 0]
+
+    # Helper functions below
+
+    def _add(self, file_path, start, end, skipped):
+        song = self.songs.get(file_path)
+        if song is None:
+            song = self.songs[file_path] = [0, 0, 0.0, 0.0]
+
+        song[SKIPS if skipped else PLAYS] += 1
+        song[LAST_PLAYED] = max(song[LAST_PLAYED], end)
+        song[SECONDS] += max(end - start, 0)
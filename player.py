@@ -0,0 +1,623 @@
+from parser import Parser, _volume, COMMAND_ALIASES
+from download_manager import DownloadManager
+from profiler import SamplingProfiler
+from session import CHECKPOINT_INTERVAL
+from player_pool import get_default_pool
+import util, screen, instrumentation
+import asyncio, sys, os, collections, time
+
+PREFETCH_WINDOW = 5 # How many seconds before the end of a song to prepare the next song's player
+STATUS_RATE = 4 # How many times per second the status bar is refreshed
+TRACED_COMMANDS = ("skip", "back", "jump", "restart", "time") # Commands whose latency is traced, span by span
+PLAY_STR          = screen.PLAY_STR
+USER_INPUT_MARKER = screen.USER_INPUT_MARKER
+print_main        = util.print_main
+print_notification = util.print_notification
+get_thread_str    = util.get_thread_str
+set_status        = util.set_status
+flush_status      = util.flush_status
+
+class Player:
+    """ Plays the songs in a library and reacts to user input. Everything runs on a single asyncio event loop: standard
+    input is read through a reader callback, VLC events are forwarded onto the loop from VLC's threads, and downloads
+    run as tasks. Waiting on any one of these (e.g. a paused song or a download prompt) never blocks the others.
+    """
+
+    def __init__(self, lib, volume = 100, status_rate = STATUS_RATE, session = None, resume_at = None, play_log = None):
+        """ Initializes a player for the given library, refreshing the status bar the given number of times per second.
+        If a session log is given, the session is checkpointed to it after every command and song change. If resume_at
+        is given, playback starts from the library's current song at that time instead of from the first song. If a
+        play log is given, every song played, or skipped once it started, is recorded in it.
+
+        @param lib: Library
+        @param volume: int
+        @param status_rate: float
+        @param session: SessionLog
+        @param resume_at: float, in seconds
+        @param play_log: PlayLog
+        """
+        self.library = lib
+        self.parser = Parser(lib)
+        self.parser.on_seeked = lambda song, latency: self._loop.call_soon_threadsafe(self._on_seeked, song, latency)
+        self.volume = volume
+        self.status_rate = status_rate
+        self.session = session
+        self._resume_at = resume_at
+        self.play_log = play_log
+        self._play_start = None # Unix time at which the current song started playing, until its play is logged
+        self.curr_song = None
+        self.paused = False
+
+        self._loop = None
+        self._song_done = None # Set when the current song is over, or should be switched for self._next_song
+        self._next_song = None # Song to play next instead of the library's next song, if not None
+        self._stopped = False # Whether the user stopped the player, which ends it once the current song is stopped
+        self._prompt = None # Future resolved with the next line of user input, while a download is prompting
+        self._prompt_lock = None # Ensures only one download prompts the user at a time
+        self._download_tasks = set() # Tasks running download jobs, referenced so they aren't garbage collected
+        self.downloads = DownloadManager()
+        self._stdin_buffer = "" # Partial line of user input read so far
+        self._prefetched = None # Song initialized ahead of time because it's expected to play next
+        self._prefetch_handle = None # Timer that prefetches the next song near the end of the current one
+        self._end_time = None # Loop time at which the current song ended by itself, until the next one starts playing
+
+        self._status_seconds = 0.0 # Time spent refreshing the status bar
+        self._status_start = None # When the status bar started being refreshed
+
+        self.transition_gaps = collections.deque(maxlen = 100) # Recent gaps between songs, in milliseconds
+        self.profiler = None # SamplingProfiler started by the "profile" command, if any
+        self._last_checkpoint = 0 # Loop time of the last session checkpoint
+
+    def run(self):
+        """ Plays songs until the library runs out or the user stops the player.
+        """
+        asyncio.run(self._main())
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._song_done = asyncio.Event()
+        self._prompt_lock = asyncio.Lock()
+        self._loop.add_reader(sys.stdin.fileno(), self._on_stdin)
+
+        # Songs converted to MP3 in the background are added to the library from the loop, not the transcoder's threads
+        self.library.set_transcoded_callback(lambda: self._loop.call_soon_threadsafe(self.library.load_transcoded))
+        self.library.load_transcoded()
+
+        status_task = self._loop.create_task(self._refresh_status())
+
+        try:
+            await self._play_songs()
+        finally:
+            status_task.cancel()
+            self.downloads.shutdown()
+            self.library.set_transcoded_callback(None)
+            self._loop.remove_reader(sys.stdin.fileno())
+            self._cancel_prefetch()
+            if self.profiler is not None and self.profiler.running:
+                self.profiler.stop()
+            self._checkpoint()
+            if self.session is not None:
+                self.session.close()
+            self._log_play(skipped = self._end_time is None)
+            if self.play_log is not None:
+                self.play_log.close()
+            if self.curr_song is not None:
+                self.curr_song.stop()
+
+    async def _play_songs(self):
+        """ Plays songs one after another until the library runs out, creating a player for each song.
+        """
+        song = self._first_song()
+        while self.library.is_running():
+            self._start(song)
+            await self._song_done.wait()
+            instrumentation.mark("wakeup")
+            self._song_done.clear()
+            self._log_play(skipped = self._end_time is None)
+            self.curr_song.stop()
+            instrumentation.mark("teardown")
+
+            if self._stopped:
+                break
+            elif self._next_song is not None:
+                song, self._next_song = self._next_song, None
+            else:
+                song = self.library.next_song()
+
+            self._cancel_prefetch(keep = song)
+
+    def _first_song(self):
+        """ Returns the song to start playing with: the library's first song, or the current one if resuming a session,
+        set to play from where it was left.
+
+        @return Song
+        """
+        if self._resume_at is None:
+            return self.library.first_song()
+
+        song = self.library.current_song()
+        if self._resume_at > 0:
+            song.set_time(self._resume_at)
+        self._resume_at = None
+        return song
+
+    def _checkpoint(self):
+        """ Checkpoints the session, if there's a session log, recording only what changed since the last checkpoint.
+        Once the current song has been stopped (e.g. on exit) its position can't be read, so the last one is kept.
+        """
+        if self.session is None or self.curr_song is None:
+            return
+
+        position = self.curr_song.get_current_time() or 0 if self.curr_song.is_initialized() else None
+        try:
+            self.session.checkpoint(self.library, self.volume, position)
+        except OSError as e: # Playback matters more than being able to resume it
+            self._notify("Couldn't save session, no longer saving it: %s" % e)
+            self.session = None
+        self._last_checkpoint = self._loop.time()
+
+    def _log_play(self, skipped):
+        """ Logs the play of the current song, if there's a play log and the song started playing.
+
+        @param skipped: bool, whether the song was switched away from before it ended
+        """
+        if self.play_log is None or self._play_start is None:
+            return
+
+        try:
+            self.play_log.record(self.curr_song.get_file_path(), self._play_start, time.time(), skipped)
+        except OSError as e:
+            self._notify("Couldn't log play, no longer logging plays: %s" % e)
+            self.play_log = None
+        self._play_start = None
+
+    def _start(self, song):
+        """ Starts playing the given song. The song reports back through VLC events instead of being polled.
+
+        @param song: Song
+        """
+        from libvlc import EventType # Loaded with the first song, rather than at startup
+
+        self.curr_song, self.paused = song, False
+
+        song.init()
+        instrumentation.mark("create")
+        song.attach_event(EventType.MediaPlayerPlaying, self._threadsafe(self._on_playing, song))
+        song.attach_event(EventType.MediaPlayerEndReached, self._threadsafe(self._on_end_reached, song))
+        song.play(sleep_interval = 0)
+        instrumentation.mark("play")
+
+        print_main(self._main_str())
+        instrumentation.mark("display")
+
+    def _switch_to(self, song = None):
+        """ Stops the current song and plays the given one, or the library's next song if None.
+
+        @param song: Song
+        """
+        self._next_song = song
+        self._song_done.set()
+
+    def _main_str(self, song = None):
+        """ Returns the main line to display for the given song, which is the current song by default.
+
+        @param song: Song
+
+        @return str
+        """
+        if song is None:
+            song = self.curr_song
+
+        main_str = get_thread_str(PLAY_STR, len(self.downloads.active_jobs()))
+        if self.paused:
+            main_str += " [paused]"
+
+        return main_str % str(song["title"])
+
+    def status_cpu_share(self):
+        """ Returns the fraction of time spent refreshing the status bar since playback started.
+
+        @return float
+        """
+        if self._status_start is None:
+            return 0.0
+
+        return self._status_seconds / max(time.perf_counter() - self._status_start, 1e-9)
+
+    async def _refresh_status(self):
+        """ Refreshes the status bar self.status_rate times per second. This is the only place the status bar is
+        updated from, so updates are coalesced into at most one redraw per tick, and the screen only rewrites it when
+        the line actually changed.
+        """
+        self._status_start = time.perf_counter()
+        while True:
+            await asyncio.sleep(1 / self.status_rate)
+
+            start = time.perf_counter()
+            if self.curr_song is not None:
+                set_status([self._status_line()])
+            flush_status()
+            self._status_seconds += time.perf_counter() - start
+
+            if not self.paused and self._loop.time() - self._last_checkpoint >= CHECKPOINT_INTERVAL:
+                self._checkpoint() # Keeps the play position current
+
+    def _status_line(self):
+        """ Returns the status bar line for the current song: a progress bar with the elapsed time and length, followed
+        by the remaining time, the volume, and whether playback is paused or anything is downloading.
+
+        @return str
+        """
+        song, width = self.curr_song, util.console_width()
+        elapsed = song.get_current_time() or 0
+
+        labels = ["-" + screen.format_time(max(song["length"] - elapsed, 0)), "vol %i%%" % self.volume]
+        if self.paused:
+            labels.append("paused")
+        if len(self.downloads.active_jobs()) > 0:
+            labels.append("downloading %i" % len(self.downloads.active_jobs()))
+
+        return screen.progress_line(elapsed, song["length"], width, " | ".join(labels))
+
+    # Event handlers below
+
+    def _threadsafe(self, callback, song):
+        """ Wraps the given callback into a VLC event callback that schedules it on the event loop, since VLC invokes
+        event callbacks from its own threads.
+
+        @param callback: func(Song -> void)
+        @param song: Song
+
+        @return func(vlc.Event -> void)
+        """
+        return lambda event: self._loop.call_soon_threadsafe(callback, song)
+
+    def _on_playing(self, song):
+        if song is not self.curr_song:
+            return
+
+        if self._end_time is not None:
+            self.transition_gaps.append((self._loop.time() - self._end_time) * 1000)
+            self._end_time = None
+        instrumentation.finish_trace("playing") # Time until VLC actually started playing
+        if self._play_start is None: # Not just unpaused or restarted by a seek
+            self._play_start = time.time()
+        self._checkpoint()
+
+        # Volume can only be set once VLC has actually started playing
+        song.set_volume(self.volume)
+        self._schedule_prefetch(song)
+
+    def _on_seeked(self, song, latency):
+        # Called once VLC reports the time a "time" command seeked to
+        if song is not self.curr_song:
+            return
+
+        instrumentation.finish_trace("seek")
+        if not self.paused: # Seeking moves the end of the song
+            self._schedule_prefetch(song)
+        self._notify("Seek took %.1f ms" % latency)
+
+    def _on_end_reached(self, song):
+        # Ignore events from songs that were switched away from before the event was delivered
+        if song is self.curr_song:
+            self._end_time = self._loop.time()
+            instrumentation.start_trace("trace.song_end")
+            self._switch_to(None)
+
+    # Prefetching below
+
+    def _schedule_prefetch(self, song):
+        """ Schedules the next song to be prefetched PREFETCH_WINDOW seconds before the given song ends. Rescheduled
+        every time the song starts playing, so pausing and seeking are accounted for.
+
+        @param song: Song
+        """
+        if self._prefetch_handle is not None:
+            self._prefetch_handle.cancel()
+
+        curr_time = song.get_current_time() or 0
+        delay = max(0, song["length"] - curr_time - PREFETCH_WINDOW)
+        self._prefetch_handle = self._loop.call_later(delay, self._prefetch)
+
+    def _prefetch(self):
+        self._prefetch_handle = None
+
+        next_song = self.library.peek_next_song()
+        if next_song is None or next_song is self.curr_song: # A song can't be initialized twice
+            return
+
+        if self._prefetched is not None and self._prefetched is not next_song:
+            self._prefetched.stop()
+        next_song.prefetch()
+        self._prefetched = next_song
+
+    def _cancel_prefetch(self, keep = None):
+        """ Cancels any pending prefetch and frees the prefetched song's player, unless it's the given song.
+
+        @param keep: Song
+        """
+        if self._prefetch_handle is not None:
+            self._prefetch_handle.cancel()
+            self._prefetch_handle = None
+
+        if self._prefetched is not None and self._prefetched is not keep:
+            self._prefetched.stop()
+        self._prefetched = None
+
+    def _on_stdin(self):
+        # Read the file descriptor directly, since sys.stdin's buffer could hold lines that never make it readable again
+        data = os.read(sys.stdin.fileno(), 4096)
+        if len(data) == 0: # EOF, so there will be no more input
+            self._loop.remove_reader(sys.stdin.fileno())
+            return
+
+        self._stdin_buffer += data.decode(errors = "replace")
+        while "\n" in self._stdin_buffer:
+            inp, self._stdin_buffer = self._stdin_buffer.split("\n", 1)
+
+            if self._prompt is not None and not self._prompt.done():
+                self._prompt.set_result(inp)
+            else:
+                self._handle_input(inp.lower().strip())
+
+    # Commands that change player state below; all other commands are handled by the Parser class
+
+    def _handle_input(self, inp):
+        """ Executes the given user command and redraws the display.
+
+        @param inp: str
+        """
+        next_song, output_message = None, None
+        if inp == "stop":
+            return self._stop()
+
+        command = COMMAND_ALIASES.get(inp.split(" ", 1)[0], inp.split(" ", 1)[0])
+        if command in TRACED_COMMANDS and inp.strip() != "time": # "time" on its own only shows the position
+            instrumentation.start_trace("trace." + command)
+
+        if inp.startswith("volume"):
+            self.volume, output_message = _volume(inp, self.curr_song, self.volume)
+        elif inp == "pause" or inp == "p": # Keyboard shortcut
+            output_message = self._pause()
+        elif inp == "unpause" or inp == "up": # Keyboard shortcut
+            output_message = self._unpause()
+        elif inp == "downloads":
+            output_message = self.downloads.describe()
+        elif inp == "stats" or inp.startswith("stats "):
+            output_message = self._stats(inp.split())
+        elif inp == "profile" or inp.startswith("profile "):
+            output_message = self._profile(inp.split())
+        elif inp == "plays" or inp.startswith("plays "):
+            output_message = self._plays(inp.split())
+        elif inp.startswith("download"):
+            output_message = self._download(inp, inp.split())
+        else:
+            next_song, output_message = self.parser.parse_user_input(self.curr_song, inp)
+
+        if next_song is not None:
+            self._switch_to(next_song)
+            print_main(self._main_str(next_song), USER_INPUT_MARKER + inp, output_message)
+            instrumentation.mark("output") # The trace goes on until the new song plays
+        else:
+            print_main(self._main_str(), USER_INPUT_MARKER + inp, output_message)
+            if command in TRACED_COMMANDS:
+                if instrumentation.traced_spans() > 0: # Seeking, so the trace goes on until VLC reports the new time
+                    instrumentation.mark("output")
+                else: # Didn't seek or switch songs, e.g. "time" on its own or a jump without a single match
+                    instrumentation.abandon_trace()
+
+        self._checkpoint()
+
+    def _stop(self):
+        """ Stops the player, which returns from run() once the current song is stopped and everything is saved.
+        """
+        self._checkpoint() # While the song can still report its position
+        self._stopped = True
+        self._song_done.set()
+
+    def _pause(self):
+        if not self.paused:
+            self.curr_song.pause()
+            self.paused = True
+
+        return None
+
+    def _unpause(self):
+        if not self.paused:
+            return "Song isn't paused"
+
+        self.curr_song.play(sleep_interval = 0)
+        self.paused = False
+        return None
+
+    def _stats(self, tokens):
+        """ Handles the "stats" command: shows the recorded counters and latencies along with the player's own metrics,
+        only those whose names start with a prefix with "stats <prefix>" (e.g. "stats trace"), or writes them all to a
+        JSON file with "stats dump <file>".
+
+        @param tokens: list(str)
+
+        @return str
+        """
+        extra = self.stats()
+        if len(tokens) == 2 and tokens[1] != "dump":
+            return instrumentation.describe(tokens[1])
+        elif len(tokens) == 1:
+            lines = [instrumentation.describe()]
+            lines += ["%-28s %s" % (name, value) for name, value in sorted(extra["player_pool"].items())]
+            lines.append("%-28s %.2f%%" % ("status_cpu_share", extra["status_cpu_share"] * 100))
+            if len(self.transition_gaps) > 0:
+                lines.append("%-28s %.1f ms mean, %.1f ms max" % ("transition_gaps", extra["transition_gap_mean_ms"],
+                                                                   extra["transition_gap_max_ms"]))
+            return "\n".join(lines)
+        elif len(tokens) == 3 and tokens[1] == "dump":
+            try:
+                instrumentation.dump_json(tokens[2], extra)
+            except OSError as e:
+                return "Couldn't write stats: %s" % e
+            return "Wrote stats to %s" % tokens[2]
+        else:
+            return "Couldn't parse argument"
+
+    def _profile(self, tokens):
+        """ Handles the "profile" command: "profile start [cpu]" starts sampling the stacks of all threads, "profile stop
+        [<file>]" stops and writes the samples as collapsed stacks, and just "profile" shows the hottest functions.
+
+        @param tokens: list(str)
+
+        @return str
+        """
+        if len(tokens) == 1:
+            return self.profiler.describe() if self.profiler is not None else "Profiler hasn't been started"
+        elif tokens[1] == "start" and (len(tokens) == 2 or (len(tokens) == 3 and tokens[2] == "cpu")):
+            if self.profiler is not None and self.profiler.running:
+                return "Profiler is already running"
+
+            self.profiler = SamplingProfiler(cpu_time = len(tokens) == 3)
+            self.profiler.start()
+            return "Started profiling (%s time); type \"profile stop [<file>]\" to stop" % \
+                   ("CPU" if self.profiler.cpu_time else "wall clock")
+        elif tokens[1] == "stop" and len(tokens) <= 3:
+            if self.profiler is None or not self.profiler.running:
+                return "Profiler isn't running"
+
+            self.profiler.stop()
+            file_path = tokens[2] if len(tokens) == 3 else time.strftime("profile-%Y%m%d-%H%M%S.collapsed")
+            try:
+                self.profiler.write_collapsed(file_path)
+            except OSError as e:
+                return "Couldn't write profile: %s" % e
+            return "%s\nWrote collapsed stacks to %s" % (self.profiler.describe(), file_path)
+        else:
+            return "Couldn't parse argument"
+
+    def _plays(self, tokens, k = 10):
+        """ Handles the "plays [most | recent | never] [<n>]" command, which lists the n (10 by default) songs played
+        the most, played most recently or never played, from the play log's aggregates.
+
+        @param tokens: list(str)
+        @param k: int
+
+        @return str
+        """
+        if self.play_log is None:
+            return "Plays aren't being logged"
+
+        query = tokens[1] if len(tokens) > 1 else "most"
+        if len(tokens) > 3 or query not in ("most", "recent", "never"):
+            return "Couldn't parse argument"
+        elif len(tokens) == 3:
+            try:
+                k = int(tokens[2])
+            except ValueError:
+                return "Argument is not an integer"
+
+        songs = {song.get_file_path(): song for song in self.library.get_library()}
+        name = lambda file_path: str(songs[file_path]) if file_path in songs else os.path.basename(file_path)
+
+        if query == "most":
+            lines = ["Most played:"]
+            lines += ["\t%s (%i plays)" % (name(path), plays) for path, plays in self.play_log.most_played(k)]
+        elif query == "recent":
+            lines = ["Recently played:"]
+            lines += ["\t%s (%s)" % (name(path), time.strftime("%Y-%m-%d %H:%M", time.localtime(when)))
+                      for path, when in self.play_log.recently_played(k)]
+        else:
+            lines = ["Never played:"] + ["\t" + name(path) for path in self.play_log.never_played(songs)[: k]]
+
+        return "\n".join(lines) if len(lines) > 1 else "No songs to show"
+
+    def stats(self):
+        """ Returns the player's own metrics, to go with the instrumentation module's.
+
+        @return dict
+        """
+        gaps = list(self.transition_gaps)
+        return {
+            "player_pool": get_default_pool().stats(),
+            "status_cpu_share": self.status_cpu_share(),
+            "transition_gap_mean_ms": sum(gaps) / len(gaps) if len(gaps) > 0 else 0.0,
+            "transition_gap_max_ms": max(gaps, default = 0.0)
+        }
+
+    def _download(self, inp, tokens):
+        request, output_message = self.parser._download(tokens)
+        if request is None:
+            return output_message
+
+        job = self.downloads.submit(*request)
+        task = self._loop.create_task(self.downloads.run(job, lambda results: self._choose_video(inp, results)))
+        self._download_tasks.add(task)
+        task.add_done_callback(self._on_download_done)
+        return "Queued download of \"%s\" (type \"downloads\" to see progress)" % job.query
+
+    async def _choose_video(self, inp, results):
+        """ Prompts the user for each search result, asking whether to download it. Returns the chosen result, or None
+        if none was chosen.
+
+        @param inp: str
+        @param results: list(dict(str -> str))
+
+        @return dict(str -> str)
+        """
+        async with self._prompt_lock:
+            for metadata_dict in results:
+                output_message = ("Download \"%s\" from Youtube (type \"download info\" for more information " + \
+                                  "or \"break\" to abort)? (y/n)") % metadata_dict["title"]
+
+                while True:
+                    answer = await self._ask(inp, output_message)
+
+                    if answer == "y":
+                        return metadata_dict
+                    elif answer == "n":
+                        break
+                    elif answer == "break":
+                        return None
+                    elif answer == "download info": # Provide additional information about current video
+                        output_message = ""
+                        for key in metadata_dict:
+                            output_message += key.upper() + ": " + str(metadata_dict[key]) + "\n"
+
+                        output_message = output_message[: -1] # Trim last newline
+                    else:
+                        output_message = "Unrecognized input"
+
+                    inp = answer
+
+        return None
+
+    async def _ask(self, inp, output_message):
+        """ Displays the given prompt and waits for the user's answer, while playback carries on.
+
+        @param inp: str
+        @param output_message: str
+
+        @return str
+        """
+        print_main(self._main_str(), USER_INPUT_MARKER + inp, output_message)
+
+        self._prompt = self._loop.create_future()
+        try:
+            return (await self._prompt).lower().strip()
+        finally:
+            self._prompt = None
+
+    def _on_download_done(self, task):
+        self._download_tasks.discard(task)
+
+        if task.cancelled():
+            return
+
+        job = task.result()
+        if job.path is not None and all(song.get_file_path() != job.path for song in self.library.lib):
+            self.library.add_converted(job.path) # Added to the library by the transcoded callback, like conversions
+        self._notify(str(job))
+
+    def _notify(self, output_message):
+        """ Displays a message that isn't a response to user input, e.g. from a background task.
+
+        @param output_message: str
+        """
+        print_notification(self._main_str(), output_message)
@@ -0,0 +1,137 @@
+import time
+
+""" Manages the native VLC objects used for playback, so songs don't each create (and throw away) their own.
+"""
+
+class PlayerPool:
+    """ Owns a single vlc.Instance and a small pool of reusable MediaPlayers. Songs borrow a player with their media set
+    on it through acquire() and hand it back with release(), instead of creating a new player (and audio output) per
+    playback.
+    """
+
+    def __init__(self, size = 2):
+        """ Initializes a pool that keeps up to the given number of idle players around for reuse. Two is enough for
+        the playing song and a prefetched one.
+
+        @param size: int
+        """
+        self.size = size
+        self._instance = None # Created on first use
+        self._idle = [] # Stopped players ready for reuse
+        self._acquired = set() # Players in use
+        self._playing = set() # Players in use that are playing
+
+        # Metrics
+        self.players_created = 0
+        self.media_created = 0
+        self.players_reused = 0
+        self._seconds_playing = 0.0 # Total time during which any player was playing
+        self._playing_since = None # When the current stretch of playback started, if a player is playing
+
+    def get_instance(self):
+        """ Returns the shared vlc.Instance, for creating other VLC objects (e.g. media lists) on it.
+
+        @return vlc.Instance
+        """
+        if self._instance is None:
+            from libvlc import Instance # Loading libvlc is slow, so it's put off until something is played
+            self._instance = Instance()
+
+        return self._instance
+
+    def acquire(self, file_path):
+        """ Returns a MediaPlayer with the given file set as its media, reusing an idle player if there is one.
+
+        @param file_path: str
+
+        @return vlc.MediaPlayer
+        """
+        instance = self.get_instance()
+
+        if len(self._idle) > 0:
+            mp = self._idle.pop()
+            self.players_reused += 1
+        else:
+            mp = instance.media_player_new()
+            self.players_created += 1
+
+        media = instance.media_new(file_path)
+        self.media_created += 1
+        mp.set_media(media)
+        media.release() # The player holds its own reference to the media
+
+        self._acquired.add(mp)
+        return mp
+
+    def set_playing(self, mp, playing):
+        """ Records whether the given player, borrowed from this pool, is playing or paused. Playback time is measured
+        by a single clock that runs while any player is playing, so players that overlap (e.g. a song starting while
+        the last one is torn down) aren't counted twice.
+
+        @param mp: vlc.MediaPlayer
+        @param playing: bool
+        """
+        if playing and mp in self._acquired:
+            if len(self._playing) == 0:
+                self._playing_since = time.monotonic()
+            self._playing.add(mp)
+        elif mp in self._playing:
+            self._playing.discard(mp)
+            if len(self._playing) == 0:
+                self._seconds_playing += time.monotonic() - self._playing_since
+                self._playing_since = None
+
+    def release(self, mp):
+        """ Stops the given player and returns it to the pool, or frees it if the pool is full.
+
+        @param mp: vlc.MediaPlayer
+        """
+        mp.stop()
+        self.set_playing(mp, False)
+        self._acquired.discard(mp)
+
+        if len(self._idle) < self.size:
+            self._idle.append(mp)
+        else:
+            mp.release()
+
+    def native_objects_per_hour(self):
+        """ Returns how many native VLC objects (players and media) were created per hour of playback so far, or None
+        if nothing has played yet.
+
+        @return float
+        """
+        seconds = self._seconds_playing
+        if self._playing_since is not None:
+            seconds += time.monotonic() - self._playing_since
+        hours = seconds / 3600
+        if hours == 0:
+            return None
+
+        return (self.players_created + self.media_created) / hours
+
+    def stats(self):
+        """ Returns the pool's metrics.
+
+        @return dict(str -> number)
+        """
+        return {
+            "players_created": self.players_created,
+            "players_reused": self.players_reused,
+            "media_created": self.media_created,
+            "players_idle": len(self._idle),
+            "players_in_use": len(self._acquired),
+            "native_objects_per_hour": self.native_objects_per_hour()
+        }
+
+_default_pool = None
+
+def get_default_pool():
+    """ Returns the pool shared by all songs.
+
+    @return PlayerPool
+    """
+    global _default_pool
+    if _default_pool is None:
+        _default_pool = PlayerPool()
+    return _default_pool
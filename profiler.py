@@ -0,0 +1,144 @@
+import sys, os, signal, threading, time, collections
+
+""" Sampling profiler that can be switched on and off in a running player. An interval timer interrupts the main thread
+at a fixed rate, and each tick records the stacks of every thread; the counts are written as collapsed stacks
+("thread;outer;...;inner <count>" lines), the input format of flamegraph.pl, speedscope and similar tools. Sampling on a
+timer rather than tracing every call keeps the overhead low and independent of how much Python code runs.
+"""
+
+DEFAULT_INTERVAL = 0.005 # Seconds between samples
+
+class ProfilerException(Exception):
+    pass
+
+class SamplingProfiler:
+    """ Samples the stacks of all threads from a SIGALRM (wall clock) or SIGPROF (CPU time) handler. Wall clock sampling
+    also shows where threads wait, e.g. in blocking VLC calls; CPU time sampling only ticks while the process is busy.
+    Must be started and stopped from the main thread, which is where Python runs signal handlers.
+    """
+
+    def __init__(self, interval = DEFAULT_INTERVAL, cpu_time = False):
+        """ @param interval: float, seconds between samples
+        @param cpu_time: bool, whether to sample on CPU time rather than wall clock time
+        """
+        self.interval = interval
+        self.cpu_time = cpu_time
+        self.samples = collections.Counter() # (thread ident, tuple of frame labels, outermost first) -> count
+        self.num_samples = 0
+        self.sample_seconds = 0.0 # Time spent in the signal handler itself
+        self._start_time = None
+        self._elapsed = 0.0
+        self._labels = {} # Code object -> frame label
+        self._previous_handler = None
+
+    @property
+    def running(self):
+        return self._start_time is not None
+
+    def start(self):
+        """ Starts sampling. Raises ProfilerException if the profiler is already running or this isn't the main thread.
+        """
+        if self.running:
+            raise ProfilerException("Profiler is already running")
+        elif threading.current_thread() is not threading.main_thread():
+            raise ProfilerException("Profiler must be started from the main thread")
+
+        signum, timer = self._signal()
+        self._previous_handler = signal.signal(signum, self._sample)
+        self._start_time = time.perf_counter()
+        signal.setitimer(timer, self.interval, self.interval)
+
+    def stop(self):
+        """ Stops sampling, keeping the samples taken so far. Raises ProfilerException if the profiler isn't running.
+        """
+        if not self.running:
+            raise ProfilerException("Profiler isn't running")
+
+        signum, timer = self._signal()
+        signal.setitimer(timer, 0)
+        signal.signal(signum, self._previous_handler)
+        self._elapsed += time.perf_counter() - self._start_time
+        self._start_time = None
+
+    def overhead(self):
+        """ Returns the fraction of the profiled time spent taking samples.
+
+        @return float
+        """
+        elapsed = self._elapsed + (time.perf_counter() - self._start_time if self.running else 0.0)
+        return self.sample_seconds / max(elapsed, 1e-9)
+
+    def collapsed(self):
+        """ Returns the samples as collapsed stacks, one "<thread>;<frame>;...;<frame> <count>" line per distinct stack,
+        most frequent first.
+
+        @return str
+        """
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        lines = collections.Counter()
+        for (ident, stack), count in self.samples.items():
+            thread = names.get(ident, "thread-%i" % ident).replace(";", ":").replace(" ", "_")
+            lines[";".join((thread,) + stack)] += count
+
+        return "".join("%s %i\n" % (stack, count) for stack, count in lines.most_common())
+
+    def write_collapsed(self, file_path):
+        """ Writes the samples to the given file as collapsed stacks.
+
+        @param file_path: str
+        """
+        with open(file_path, "w") as f:
+            f.write(self.collapsed())
+
+    def describe(self):
+        """ Returns a summary of the profiler's state and the functions most often on top of a stack.
+
+        @return str
+        """
+        state = "running" if self.running else "stopped"
+        summary = "Profiler %s: %i samples, %.2f%% overhead" % (state, self.num_samples, self.overhead() * 100)
+
+        leaves = collections.Counter()
+        for (_, stack), count in self.samples.items():
+            if len(stack) > 0:
+                leaves[stack[-1]] += count
+        total = max(sum(leaves.values()), 1)
+        lines = ["\t%5.1f%% %s" % (count / total * 100, label) for label, count in leaves.most_common(5)]
+
+        return "\n".join([summary] + lines)
+
+    # Helper functions below
+
+    def _signal(self):
+        # The signal and interval timer used for sampling
+        if self.cpu_time:
+            return signal.SIGPROF, signal.ITIMER_PROF
+        return signal.SIGALRM, signal.ITIMER_REAL
+
+    def _sample(self, signum, frame):
+        # Signal handler; frame is where the main thread was interrupted, while its entry in sys._current_frames()
+        # would be this handler. Takes no locks, as the interrupted code might be holding them.
+        start = time.perf_counter()
+        main_ident = threading.main_thread().ident
+
+        for ident, thread_frame in sys._current_frames().items():
+            stack = self._stack(frame if ident == main_ident else thread_frame)
+            self.samples[(ident, stack)] += 1
+
+        self.num_samples += 1
+        self.sample_seconds += time.perf_counter() - start
+
+    def _stack(self, frame):
+        # Returns the labels of the given frame and its callers, outermost first
+        labels = []
+        while frame is not None:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = "%s (%s:%i)" % (code.co_name, os.path.basename(code.co_filename),
+                                                             code.co_firstlineno)
+            labels.append(label)
+            frame = frame.f_back
+
+        labels.reverse()
+        return tuple(labels)
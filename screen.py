@@ -0,0 +1,214 @@
+import sys, time
+
+""" Draws the player's display. The bottom of the console holds a region with the main line and an optional status bar,
+followed by the input line; everything else (echoed input and command output) scrolls above it.
+"""
+
+PLAY_STR          = "Playing \"%s\""
+USER_INPUT_MARKER = "> "
+
+# ANSI escape sequences
+MOVE_UP      = "\033[%iA"
+LINE_START   = "\033[1G"
+CLEAR_LINE   = "\033[K"
+SAVE_CURSOR  = "\0337"
+LOAD_CURSOR  = "\0338"
+MOVE_DOWN    = "\033[%iB"
+INSERT_LINES = "\033[%iL"
+INDEX        = "\033D" # Moves the cursor down a line, in the same column, scrolling the screen at the bottom
+
+def format_time(seconds):
+    """ Formats the given number of seconds as minutes and seconds, e.g. "3:05".
+
+    @param seconds: float
+
+    @return str
+    """
+    return "%i:%02i" % divmod(int(seconds), 60)
+
+def progress_line(elapsed, length, width, label = ""):
+    """ Returns a playback progress line of the given width, e.g. "1:05 [=====>     ] 3:20 label".
+
+    @param elapsed: float, in seconds
+    @param length: float, in seconds
+    @param width: int
+    @param label: str
+
+    @return str
+    """
+    elapsed = min(max(elapsed, 0), length)
+    left, right = format_time(elapsed) + " [", "] " + format_time(length) + (" " + label if label else "")
+    bar_width = width - len(left) - len(right)
+    if bar_width < 2:
+        return (format_time(elapsed) + " / " + format_time(length))[: width]
+
+    filled = int(bar_width * elapsed / length) if length > 0 else 0
+    bar = "=" * filled + (">" if filled < bar_width else "") + " " * (bar_width - filled - 1)
+    return left + bar[: bar_width] + right
+
+class Screen:
+    """ Keeps the frame last drawn in the region at the bottom of the console, so that redrawing it only rewrites the
+    lines that changed, and does so in a single buffered write. Status bar updates (e.g. a progress line) are limited
+    to a maximum frame rate; updates arriving faster are coalesced and drawn by flush().
+    """
+
+    def __init__(self, width, supports_ansi = True, input_marker = "> ", max_fps = 10):
+        """ Initializes a screen.
+
+        @param width: func(void -> int), returning the width of the console
+        @param supports_ansi: bool
+        @param input_marker: str
+        @param max_fps: float, the maximum number of status bar redraws per second
+        """
+        self.width = width
+        self.supports_ansi = supports_ansi
+        self.input_marker = input_marker
+        self.min_interval = 1 / max_fps
+
+        self._main_line = ""
+        self._status = [] # Lines of the status bar, drawn below the main line
+        self._frame = None # Lines of the region as they were last drawn, or None if the region hasn't been drawn
+        self._last_status_draw = 0.0
+        self._status_pending = False # Whether the status bar changed since it was last drawn
+
+    def draw(self, main_line, inp = None, output_message = None):
+        """ Displays the given main line. If input was given, the cursor is assumed to be at the start of the line
+        below the input line (i.e. the user just pressed enter), and the input is moved above the region followed by
+        the output message.
+
+        @param main_line: str
+        @param inp: str
+        @param output_message: str
+        """
+        self._main_line = main_line
+
+        if not self.supports_ansi:
+            self._write(main_line.center(self.width()) + "\n" + self.input_marker)
+        elif inp is not None:
+            self._write(self._scroll(inp.rstrip("\n"), output_message))
+        else:
+            self._write(self._update())
+
+    def notify(self, main_line, output_message):
+        """ Displays the given main line and prints the given message above the region, for messages that aren't a
+        response to user input (e.g. a finished download). Unlike draw(), the cursor is assumed to still be on the input
+        line, where it's left as it was, along with anything the user was typing.
+
+        @param main_line: str
+        @param output_message: str
+        """
+        self._main_line = main_line
+
+        if not self.supports_ansi:
+            self._write("\n" + output_message + "\n" + main_line.center(self.width()) + "\n" + self.input_marker)
+        elif self._frame is None:
+            self._write(self._scroll(None, output_message))
+        else:
+            self._write(self._insert(output_message))
+
+    def set_status(self, lines):
+        """ Sets the lines of the status bar, redrawing them now unless the status bar was drawn less than
+        self.min_interval seconds ago.
+
+        @param lines: list(str)
+        """
+        self._status = list(lines)
+        self._status_pending = True
+        self.flush()
+
+    def flush(self):
+        """ Draws pending status bar changes, if enough time has passed since it was last drawn. Returns whether
+        anything is still pending.
+
+        @return bool
+        """
+        if self._status_pending and time.monotonic() - self._last_status_draw >= self.min_interval:
+            if self.supports_ansi and self._frame is not None:
+                self._write(self._update())
+            self._status_pending = False
+
+        return self._status_pending
+
+    # Helper functions below
+
+    def _region(self):
+        """ Returns the lines of the region to draw: a blank separator line, the centered main line and the status
+        bar, each fitted to the console width so none of them wrap.
+
+        @return list(str)
+        """
+        width = self.width()
+        lines = ["", self._main_line.center(width)] + self._status
+        return [line[: width] for line in lines]
+
+    def _scroll(self, inp, output_message):
+        # Overwrite the old region with the input and output, then draw the region again below them
+        old_frame, frame = self._frame, self._region()
+        self._mark_drawn(frame)
+
+        buf = []
+        if old_frame is not None:
+            buf.append(MOVE_UP % (len(old_frame) + 1)) # Up past the input line to the top of the old region
+        lines = [inp] if inp is not None else []
+        for line in lines + (output_message.split("\n") if output_message is not None else []) + frame:
+            buf.append(LINE_START + line + CLEAR_LINE + "\n")
+        buf.append(LINE_START + CLEAR_LINE + self.input_marker)
+
+        return "".join(buf)
+
+    def _insert(self, output_message):
+        # Insert lines for the output, and the region's growth if any, between the output above the region and the
+        # region itself, pushing the region and the input line down without touching what's been typed on it
+        old_frame, frame = self._frame, self._region()
+        self._mark_drawn(frame)
+
+        lines = output_message.split("\n") + frame
+        lines += [""] * (len(old_frame) - len(lines)) # Blank out what's left of a region that shrank
+        count = len(lines) - len(old_frame) # Lines to insert
+
+        buf = []
+        if count > 0:
+            # Make room below the input line first, so the inserted lines don't push it off the screen
+            buf.append(INDEX * count + MOVE_UP % count)
+        buf.append(SAVE_CURSOR + MOVE_UP % len(old_frame) + LINE_START)
+        if count > 0:
+            buf.append(INSERT_LINES % count)
+        buf += [LINE_START + line + CLEAR_LINE + "\n" for line in lines[: -1]]
+        buf.append(LINE_START + lines[-1] + CLEAR_LINE)
+
+        buf.append(LOAD_CURSOR) # Back to where the cursor was on the input line, which has since moved down
+        if count > 0:
+            buf.append(MOVE_DOWN % count)
+        return "".join(buf)
+
+    def _update(self):
+        # Redraw the lines of the region that changed, leaving the cursor (and anything typed) on the input line
+        old_frame, frame = self._frame, self._region()
+        self._mark_drawn(frame)
+
+        if old_frame is None: # Nothing drawn yet
+            return "".join(LINE_START + line + CLEAR_LINE + "\n" for line in frame) + LINE_START + self.input_marker
+        elif len(old_frame) != len(frame): # The region changed size, so it can't be redrawn in place
+            buf = [MOVE_UP % len(old_frame)]
+            buf += [LINE_START + line + CLEAR_LINE + "\n" for line in frame]
+            buf.append(LINE_START + CLEAR_LINE + self.input_marker)
+            return "".join(buf)
+
+        buf = []
+        for i, line in enumerate(frame):
+            if line != old_frame[i]:
+                buf.append(LOAD_CURSOR + MOVE_UP % (len(frame) - i) + LINE_START + line + CLEAR_LINE)
+
+        if len(buf) == 0:
+            return ""
+        return SAVE_CURSOR + "".join(buf) + LOAD_CURSOR
+
+    def _mark_drawn(self, frame):
+        self._frame = frame
+        self._last_status_draw = time.monotonic()
+        self._status_pending = False
+
+    def _write(self, buf):
+        if len(buf) > 0:
+            sys.stdout.write(buf)
+            sys.stdout.flush()
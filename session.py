@@ -0,0 +1,174 @@
+import os, json, time
+
+""" Keeps the player's session (library order, history and queue, position, volume) in an append-only log, so a restart
+picks up exactly where the last run left off. The log starts with a snapshot of the whole session; each checkpoint
+after that appends only what changed: a splice for each list that was edited, and the pointers, volume and position.
+Once the appended records outgrow the snapshot, the log is compacted into a new snapshot.
+"""
+
+DEFAULT_SESSION_FILE = os.path.join(os.path.expanduser("~"), ".music_player_session")
+CHECKPOINT_INTERVAL = 5 # Seconds between checkpoints of the play position while a song is playing
+
+class SessionLog:
+    """ Append-only log of session state. Checkpoints compare the library's lists against the previous checkpoint by
+    object identity, which takes a few C-level list comparisons rather than a Python loop over every song. The first
+    checkpoint of each run writes a fresh snapshot, so the log is also compacted on every restart.
+    """
+
+    def __init__(self, file_path = DEFAULT_SESSION_FILE):
+        """ @param file_path: str
+        """
+        self.file_path = file_path
+        self.records_written = 0 # Since the last snapshot
+        self.compactions = 0
+        self._file = None
+        self._snapshot_size = 0 # Size of the last snapshot record, in bytes
+        self._log_size = 0 # Size of the records appended after it, in bytes
+        self._lists = None # List name -> (ids of the songs in it at the last checkpoint, their paths)
+        self._state = None # Pointers, volume and position at the last checkpoint
+
+    def load(self):
+        """ Replays the log and returns the session state it ends with, as a dict with the library's and history's file
+        paths ("lib" and "history"), "current_index", "queue_index", "volume" and "position" (seconds into the current
+        song), or None if there's no usable log. A record cut short by a crash is ignored.
+
+        @return dict
+        """
+        try:
+            with open(self.file_path) as f:
+                lines = f.readlines()
+        except OSError:
+            return None
+
+        state = None
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError: # Partially written last record
+                break
+
+            if record["type"] == "snapshot":
+                state = dict(record, history = [record["lib"][i] for i in record["history"]])
+            elif state is None: # Log doesn't start with a snapshot
+                return None
+            elif record["type"] == "splice":
+                state[record["list"]][record["start"] : record["end"]] = record["items"]
+            elif record["type"] == "state":
+                state.update(record)
+
+        if state is not None:
+            del state["type"]
+        return state
+
+    def checkpoint(self, library, volume, position):
+        """ Records the given library's current state, with the player's volume and position in the current song,
+        appending only what changed since the last checkpoint. The first checkpoint writes a snapshot.
+
+        @param library: Library
+        @param volume: int
+        @param position: float, in seconds, or None to keep the last recorded position
+        """
+        if position is None:
+            position = self._state["position"] if self._state is not None else 0
+
+        if self._file is None:
+            self._write_snapshot(library, volume, position)
+            return
+
+        for name, songs in (("lib", library.lib), ("history", library.history)):
+            old_ids, old_paths = self._lists[name]
+            ids = list(map(id, songs))
+            if ids == old_ids:
+                continue
+
+            start, end, new_end = _splice_bounds(old_ids, ids)
+            items = [song.get_file_path() for song in songs[start : new_end]]
+            self._append({"type": "splice", "list": name, "start": start, "end": end, "items": items})
+            old_paths[start : end] = items
+            self._lists[name] = (ids, old_paths)
+
+        state = _state(library, volume, position)
+        if state != self._state:
+            self._append(dict(state, type = "state"))
+            self._state = state
+
+        if self._log_size > max(self._snapshot_size, 4096): # Replaying would cost more than rereading a snapshot
+            self._write_snapshot(library, volume, position)
+            self.compactions += 1
+
+    def close(self):
+        """ Closes the log. The next checkpoint starts it over with a snapshot.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # Helper functions below
+
+    def _append(self, record):
+        line = json.dumps(record, separators = (",", ":")) + "\n"
+        self._file.write(line)
+        self._file.flush()
+        self._log_size += len(line)
+        self.records_written += 1
+
+    def _write_snapshot(self, library, volume, position):
+        # Writes a new log holding just a snapshot, and swaps it in for the old one
+        paths = [song.get_file_path() for song in library.lib]
+        index = {id(song): i for i, song in enumerate(library.lib)}
+        state = _state(library, volume, position)
+
+        record = dict(state, type = "snapshot", time = time.time(), lib = paths,
+                      history = [index[id(song)] for song in library.history])
+        line = json.dumps(record, separators = (",", ":")) + "\n"
+
+        if self._file is not None:
+            self._file.close()
+        temp_path = self.file_path + ".tmp"
+        with open(temp_path, "w") as f:
+            f.write(line)
+        os.replace(temp_path, self.file_path) # Atomic, so a crash leaves either the old log or the new one
+        self._file = open(self.file_path, "a")
+
+        self._snapshot_size, self._log_size, self.records_written = len(line), 0, 0
+        self._lists = {
+            "lib": (list(map(id, library.lib)), paths),
+            "history": (list(map(id, library.history)), [paths[i] for i in record["history"]])
+        }
+        self._state = state
+
+def _state(library, volume, position):
+    return {
+        "current_index": library.current_index,
+        "queue_index": library.queue_index,
+        "volume": volume,
+        "position": round(position, 1)
+    }
+
+def _splice_bounds(old, new):
+    """ Returns (start, end, new_end) such that replacing old[start : end] with new[start : new_end] turns old into new,
+    found by bisecting on slice equality for the common prefix and suffix.
+
+    @param old: list(int)
+    @param new: list(int)
+
+    @return tuple(int, int, int)
+    """
+    low, high = 0, min(len(old), len(new))
+    while low < high: # Longest common prefix
+        mid = (low + high + 1) // 2
+        if old[low : mid] == new[low : mid]:
+            low = mid
+        else:
+            high = mid - 1
+    start = low
+
+    low, high = 0, min(len(old), len(new)) - start
+    while low < high: # Longest common suffix not overlapping the prefix
+        mid = (low + high + 1) // 2
+        if old[len(old) - mid : len(old) - low] == new[len(new) - mid : len(new) - low]:
+            low = mid
+        else:
+            high = mid - 1
+
+    return start, len(old) - low, len(new) - low
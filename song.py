@@ -1,12 +1,10 @@
-from vlc import MediaPlayer
-from mutagen.mp3 import MP3
-from mutagen.easyid3 import EasyID3
-from mutagen.id3 import ID3NoHeaderError
+from player_pool import get_default_pool
 from datetime import datetime
 from song_exception import SongException
-import os, time
+import os, time, tag_readers, instrumentation
+
+SEEK_TOLERANCE = 1.0 # How close, in seconds, the reported play time has to be to a seek's target for it to be done
 
-# TODO: Add support for non-MP3 music, perhaps by converting to MP3 on demand
 class Song:
     """Represents a song in the library.
     """
@@ -14,9 +12,10 @@ class Song:
     ID3_COLUMNS = ("title", "artist", "album", "genre", "year")
     NON_ID3_COLUMNS = ("length", "date_modified")
 
+    @instrumentation.timed("song.__init__")
     def __init__(self, file_path, title = None, artist = None, album = None, genre = None, year = None, override_id3 = True):
-        """ Given an absolute file path, and data about the song a initialize a Song object. Parses ID3 tags for additional metadata if it exists. If
-        the override_id3 is true, the given name and artist will override the name and artist contained in the ID3 tag.
+        """ Given an absolute file path, and data about the song a initialize a Song object. Parses tags for additional metadata if they exist, in any
+        format tag_readers supports; raises SongException for other formats. If the override_id3 is true, the given name and artist will override the name and artist contained in the ID3 tag.
 
         @param file_path: str
         @param title: str
@@ -29,12 +28,16 @@ class Song:
         self._file_path = file_path
         self._mp = None
         self._time = None # What time, in seconds, of the song playback to play at
+        self._events = [] # VLC event types with callbacks attached to the current MediaPlayer
+        self._owns_player = False # Whether self._mp was borrowed from the player pool, rather than bound by its owner
+        self._seek = None # Target time, start time and callback of the seek in progress, until VLC reports it done
 
-        # Fill in column values, first by parsing ID3 tags and then manually
+        # Fill in column values, first by parsing tags and then manually
+        tags, length = Song._read_tags(file_path)
         self._columns = {}
-        for tag_name, tag in zip(Song.ID3_COLUMNS, Song._get_ID3_tags(file_path)):
+        for tag_name, tag in zip(Song.ID3_COLUMNS, tags):
             self._columns[tag_name] = tag
-        self._columns["length"] = int(MP3(file_path).info.length + 0.5) # Read length and round to nearest integer
+        self._columns["length"] = int(length + 0.5) # Round to nearest integer
         self._columns["date_modified"] = Song.get_date_modified(file_path)
 
         # If overriding, only do so for passed parameters
@@ -45,25 +48,83 @@ class Song:
             self._columns["genre"] = genre if genre is not None else self._columns["genre"]
             self._columns["year"] = year if year is not None else self._columns["year"]
 
+    @instrumentation.timed("song.init")
     def init(self):
         if self._mp is None: # Only initialize if not already initialized
-            self._mp = MediaPlayer(self._file_path)
+            self._mp = get_default_pool().acquire(self._file_path)
+            self._owns_player = True
+
+    def bind(self, mp):
+        """ Initializes this song with a MediaPlayer that's owned elsewhere (e.g. by a MediaListPlayer) and already has
+        this song's media set, instead of borrowing one from the pool. Stopping the song unbinds it without stopping
+        the player.
+
+        @param mp: vlc.MediaPlayer
+        """
+        if self._mp is not None:
+            raise SongException("Song already initialized")
+
+        self._mp = mp
+        self._owns_player = False
+        self._time = None # The owner starts the player, so a time set beforehand would only apply on the next play()
+
+    def prefetch(self):
+        """ Initializes this song ahead of playing it and starts parsing its media in the background, so that playing
+        it later doesn't pay for opening and probing the file.
+        """
+        if self._mp is not None:
+            return
+
+        from libvlc import MediaParseFlag
+
+        self.init()
+        try:
+            self._mp.get_media().parse_with_options(MediaParseFlag.local, -1) # Asynchronous, with VLC's default timeout
+        except NotImplementedError: # Asynchronous parsing requires LibVLC 3.0; opening the player is still worthwhile
+            pass
+
+    def is_initialized(self):
+        """ Returns if this song has a MediaPlayer, i.e. if it's been initialized and not yet stopped.
+
+        @return bool
+        """
+        return self._mp is not None
+
+    def attach_event(self, event_type, callback):
+        """ Registers a callback for the given VLC event on this song's MediaPlayer. The callback is invoked from a VLC
+        thread with the vlc.Event as its only argument, and is detached automatically when the song is stopped.
 
+        @param event_type: vlc.EventType
+        @param callback: func(vlc.Event -> void)
+        """
+        if self._mp is None:
+            raise SongException("Song not initialized")
+
+        self._mp.event_manager().event_attach(event_type, callback)
+        self._events.append(event_type)
+
+    @instrumentation.timed("song.play")
     def play(self, sleep_interval = 0.1):
-        """ Plays this song.
+        """ Plays this song, then sleeps for the given interval so that self.playing() returns properly. Callers that
+        are notified of state changes through attach_event() can pass an interval of 0 to return immediately.
+
+        @param sleep_interval: float
         """
         # Create the MediaPlayer on demand to save system resources (and prevent VLC from freaking out).
         if self._mp is None:
             raise SongException("Song not initialized")
 
         self._mp.play()
+        if self._owns_player:
+            get_default_pool().set_playing(self._mp, True)
 
         if self._time is not None:
             self._mp.set_time(int(self._time * 1000)) # Seconds to milliseconds
             self._time = None
 
         # Sleep a bit to allow VLC to play the song, so self.playing() returns properly
-        time.sleep(sleep_interval)
+        if sleep_interval > 0:
+            time.sleep(sleep_interval)
 
     def pause(self):
         """ Pauses this song, if it's playing.
@@ -72,31 +133,64 @@ class Song:
             raise SongException("Song not initialized")
 
         self._mp.pause()
+        if self._owns_player:
+            get_default_pool().set_playing(self._mp, False)
 
-    def set_time(self, time):
+    def set_time(self, seconds, on_seeked = None):
         """ Sets the current play time of this song, so when the song is played (or if it's currently played)
-        it will play from that time, or start playing from that time now if the song is currently playing. Given 
-        time should be in seconds.
+        it will play from that time, or start playing from that time now if the song is currently playing. Given
+        time should be in seconds. Seeks the live player in place when its media supports seeking, and otherwise
+        restarts playback from the given time. Returns False if the time was out of range.
 
-        @param time: int or float
+        VLC seeks asynchronously, so the seek is only done once VLC reports a play time near the new one. If the song
+        is initialized, on_seeked is then called, from a VLC thread, with how long that took in milliseconds.
+
+        @param seconds: int or float
+        @param on_seeked: func(float -> void)
+
+        @return bool
         """
-        if time < 0:
+        if seconds < 0:
             raise SongException("Can't jump to negative timestamp")
+        elif seconds >= self._columns["length"]:
+            return False
+
+        if self._mp is not None and on_seeked is not None:
+            from libvlc import EventType
+
+            self._seek = (seconds, time.perf_counter(), on_seeked)
+            if EventType.MediaPlayerTimeChanged not in self._events:
+                self.attach_event(EventType.MediaPlayerTimeChanged, self._on_time_changed)
 
-        if time < self._columns["length"]:
-            self._time = time
-            if self.playing():
-                self.stop()
-                self.init()
-                self.play()
+        if self._mp is not None and self._mp.is_seekable(): # Only true once the media's been opened
+            self._mp.set_time(int(seconds * 1000)) # Seconds to milliseconds
+        elif self._mp is not None and self.playing():
+            # Can't seek this format, so restart the player from the given time. Reuses the same player, so
+            # attached events stay attached.
+            self._time = seconds
+            self._mp.stop()
+            self.play(sleep_interval = 0)
+        else:
+            self._time = seconds
+
+        return True
+
+    def _on_time_changed(self, event):
+        # Called from a VLC thread as the play time advances; completes the seek in progress once it's reached
+        seek, mp = self._seek, self._mp
+        if seek is None or mp is None or abs(max(mp.get_time(), 0) / 1000 - seek[0]) > SEEK_TOLERANCE:
+            return
+
+        self._seek = None
+        seek[2]((time.perf_counter() - seek[1]) * 1000)
 
     def get_current_time(self):
-        """ Returns the current play time, in seconds, of this song, if it's playing.
+        """ Returns the current play time, in seconds, of this song, if it's playing or paused.
 
         @return float
         """
-        if self.playing():
-            return self._mp.get_time() / 1000
+        if self._mp is not None:
+            return max(self._mp.get_time(), 0) / 1000 # VLC returns -1 before the media is opened
 
     def set_volume(self, percentage):
         """ Sets the volume to the given percentage (between 0 and 100).
@@ -159,12 +253,26 @@ class Song:
         self._mp.stop()
 
     def stop(self):
-        """ Terminates this song, freeing system resources and cleaning up.
+        """ Terminates this song, returning its player to the pool and cleaning up.
         """
         if self._mp is not None:
-            self._mp.stop()
+            event_manager = self._mp.event_manager()
+            for event_type in self._events:
+                event_manager.event_detach(event_type)
+            self._events = []
+            self._seek = None
+
+            if self._owns_player:
+                get_default_pool().release(self._mp) # Stops the player and keeps it around for the next song
             self._mp = None
 
+    def get_file_path(self):
+        """ Returns the absolute path to this song's file.
+
+        @return str
+        """
+        return self._file_path
+
     def delete_from_disk(self):
         """ Deletes this song from the hard drive, returning if the deletion was successful.
 
@@ -183,35 +291,32 @@ class Song:
         if tag not in ID3_COLUMNS:
             return False
 
+        from mutagen.easyid3 import EasyID3
+
         tags = EasyID3(self.file_path)
         tags[tag] = value
         tags.save()
         return True
 
     @staticmethod
-    def _get_ID3_tags(file_path):
-        """ Given a file path to an mp3 song, returns the ID3 tags for title, artist, album, genre, and year (in that order), or 
-        empty tuple if no tags are found.
+    def _read_tags(file_path):
+        """ Given a file path to a song, returns its tags for title, artist, album, genre, and year (in that order, with
+        None for missing tags) and its length in seconds. The title defaults to the file name.
 
-        @param filename: str
+        @param file_path: str
 
-        @return: tuple of ID3 tags
+        @return: tuple(tuple of tags, float)
         """
-        ret = [None for _ in range(len(Song.ID3_COLUMNS))]
-        try:
-            tags = EasyID3(file_path)
-            for tag in Song.ID3_COLUMNS:
-                if tag in tags:
-                    ret.append(tags[tag][0])
-                else:
-                    ret.append(None)
-        except ID3NoHeaderError:
-            pass
-        
+        reader = tag_readers.get_reader(file_path)
+        if reader is None:
+            raise SongException("Unsupported audio format")
+
+        tags, length = reader(file_path)
+        ret = [tags.get(tag) for tag in Song.ID3_COLUMNS]
         if not ret[Song.ID3_COLUMNS.index("title")]:
-            ret[Song.ID3_COLUMNS.index("title")] = file_path.split("/")[-1][: -4] # Parse file name from absolute file path and delete file extension
+            ret[Song.ID3_COLUMNS.index("title")] = os.path.splitext(os.path.basename(file_path))[0] # Delete file extension
 
-        return tuple(ret)
+        return tuple(ret), length
 
     @staticmethod
     def get_date_modified(file_path):
@@ -1,4 +1,588 @@
+#!/usr/bin/python
+
+import sys, os, json, hashlib, struct, subprocess, threading, queue, time
+
+""" Syncs a music library with a copy on another device. Both sides describe their files in a manifest of sizes and
+modification times, the manifests are diffed, and only files whose size or modification time differ are looked at, so
+syncing an unchanged library costs just the manifest. Those files are hashed in chunks, and only the chunks that the
+other side's copy (or what an interrupted transfer already delivered) doesn't hold are sent, optionally over several
+streams at once. Everything goes over a byte transport, normally an SSH session running
+"python syncer.py serve <directory>" on the other device, but anything that moves bytes both ways will do.
+"""
+
+CHUNK_SIZE = 128 * 1024 # Bytes per transferred chunk
+ID3_HEADER_SIZE = 10
+PARTIAL_FILE_PREFIX = ".sync-" # Hidden, so library scans skip files being received
+PARTIAL_FILE_SUFFIX = ".part"
+SERVE_THREAD_NAME = "sync-serve" # Name of the threads started by serve_in_thread()
+
+class SyncException(Exception):
+    def __init__(self, err_msg):
+        """ Initializes a sync exception with the given error message.
+
+        err_msg: str
+        """
+        Exception.__init__(self, err_msg)
+
+class StreamTransport:
+    """ Byte transport over a pair of binary file objects, e.g. the standard streams of a subprocess or the two ends of
+    pipes. Counts the bytes moved in each direction.
+    """
+
+    def __init__(self, rfile, wfile, process = None):
+        """ Initializes a transport reading from rfile and writing to wfile.
+
+        @param rfile: binary file object
+        @param wfile: binary file object
+        @param process: subprocess.Popen, waited on when the transport is closed
+        """
+        self._rfile = rfile
+        self._wfile = wfile
+        self._process = process
+
+        self.bytes_read = self.bytes_written = 0
+
+    def read(self, size):
+        """ Reads exactly size bytes. Raises SyncException if the other side closes the stream first.
+
+        @param size: int
+
+        @return bytes
+        """
+        data = self._rfile.read(size)
+        while len(data) < size:
+            more = self._rfile.read(size - len(data))
+            if not more:
+                raise SyncException("Connection closed")
+            data += more
+
+        self.bytes_read += size
+        return data
+
+    def write(self, data):
+        """ Writes the given bytes.
+
+        @param data: bytes
+        """
+        self._wfile.write(data)
+        self.bytes_written += len(data)
+
+    def flush(self):
+        self._wfile.flush()
+
+    def close(self):
+        """ Closes both streams, waiting for the subprocess (if any) to exit.
+        """
+        for f in (self._wfile, self._rfile):
+            try:
+                f.close()
+            except (OSError, ValueError):
+                pass
+
+        if self._process is not None:
+            self._process.wait()
+
+def subprocess_transport(args):
+    """ Starts the given command and returns a transport over its standard input and output.
+
+    @param args: list(str)
+
+    @return StreamTransport
+    """
+    process = subprocess.Popen(args, stdin = subprocess.PIPE, stdout = subprocess.PIPE)
+    return StreamTransport(process.stdout, process.stdin, process)
+
+def ssh_transport(host, remote_directory, remote_script = "syncer.py", python = "python3"):
+    """ Returns a transport to a sync server run over SSH on the given host, serving the given directory.
+
+    @param host: str
+    @param remote_directory: str
+    @param remote_script: str, the path of this module on the host
+    @param python: str
+
+    @return StreamTransport
+    """
+    return subprocess_transport(["ssh", "-e", "none", host, python, remote_script, "serve", remote_directory])
+
+def pipe_transports():
+    """ Returns two transports connected to each other through local pipes, e.g. to run a server in another thread.
+
+    @return tuple(StreamTransport, StreamTransport)
+    """
+    a_read, b_write = os.pipe()
+    b_read, a_write = os.pipe()
+    a = StreamTransport(os.fdopen(a_read, "rb"), os.fdopen(a_write, "wb"))
+    b = StreamTransport(os.fdopen(b_read, "rb"), os.fdopen(b_write, "wb"))
+    return a, b
+
+class InterruptingTransport:
+    """ Wraps a transport, cutting the connection once a given number of bytes has been written through it, to exercise
+    resuming interrupted transfers.
+    """
+
+    def __init__(self, transport, fail_after):
+        """ Initializes a transport that fails after fail_after bytes are written.
+
+        @param transport: StreamTransport
+        @param fail_after: int
+        """
+        self.transport = transport
+        self.fail_after = fail_after
+
+    def read(self, size):
+        return self.transport.read(size)
+
+    def write(self, data):
+        remaining = self.fail_after - self.transport.bytes_written
+        if len(data) > remaining:
+            self.transport.write(data[: max(remaining, 0)])
+            self.transport.close() # The other side sees the connection close mid-message
+            raise SyncException("Connection interrupted")
+
+        self.transport.write(data)
+
+    def flush(self):
+        self.transport.flush()
+
+    def close(self):
+        self.transport.close()
+
+    @property
+    def bytes_read(self):
+        return self.transport.bytes_read
+
+    @property
+    def bytes_written(self):
+        return self.transport.bytes_written
+
+def serve_in_thread(directory):
+    """ Starts a sync server for the given directory on a background thread, connected through local pipes, and returns
+    the transport to talk to it over. Stands in for a remote device, e.g. for testing.
+
+    @param directory: str
+
+    @return StreamTransport
+    """
+    client, server = pipe_transports()
+
+    def serve():
+        try:
+            Syncer(directory, server).serve()
+        except SyncException: # The client went away
+            pass
+        finally:
+            server.close()
+
+    threading.Thread(target = serve, name = SERVE_THREAD_NAME, daemon = True).start()
+    return client
+
+class BandwidthLimiter:
+    """ Token bucket shared by all of a push's streams, capping their combined rate. Callers that take more than is
+    available are put to sleep until the bucket would have refilled.
+    """
+
+    def __init__(self, rate, burst = None):
+        """ Initializes a limiter allowing rate bytes per second on average, and up to burst bytes at once.
+
+        @param rate: float
+        @param burst: int, CHUNK_SIZE by default
+        """
+        self.rate = rate
+        self.burst = burst if burst is not None else CHUNK_SIZE
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, num_bytes):
+        """ Takes num_bytes from the bucket, sleeping as long as needed to keep under the rate.
+
+        @param num_bytes: int
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= num_bytes # Going negative reserves bytes that later callers have to wait for too
+            wait = -self._tokens / self.rate
+
+        if wait > 0:
+            time.sleep(wait)
+
 class Syncer:
-    """ Class for syncing this library with an existing music library on another device, through SSH.
+    """ Class for syncing this library with an existing music library on another device. One side calls push() and the
+    other serve(); afterwards the serving side's directory holds the same files as the pushing side's.
+
+    Messages are a 4 byte length followed by a JSON header; chunk contents follow the header that announces them. Chunks
+    are matched by hash rather than position, so a chunk that moved (e.g. audio behind an ID3 tag that grew) is copied
+    from the serving side's existing copy instead of being sent again. The serving side assembles each file in a
+    partial file next to it and renames it into place once every chunk's hash checks out. If the transfer is
+    interrupted, the partial file is kept, and the next push only sends the chunks it doesn't already hold.
+
+    Files can be pushed over extra streams (each to its own serve() on the other side) in parallel with the main one.
+    Files are handed out to the streams smallest first, so most of the other library is usable early on, and only files
+    the other side may already have part of cost a round trip before their chunks are sent.
     """
 
+    def __init__(self, directory, transport, streams = ()):
+        """ Initializes a syncer for the library in the given directory, talking over the given transport and pushing
+        files over the given extra transports as well.
+
+        @param directory: str
+        @param transport: StreamTransport, or anything with the same read, write and flush methods
+        @param streams: list(StreamTransport)
+        """
+        self.directory = os.path.abspath(directory)
+        self._chunk_cache = {} # Maps (file path, size, modification time) to the file's chunks
+        self.transport = transport
+        self.streams = list(streams)
+        self._limiter = None
+
+    def push(self, delete = False, max_bandwidth = None):
+        """ Sends the files that are missing or differ on the other side, and optionally deletes the other side's files
+        that don't exist here. Returns a summary of what was sent, including each stream's throughput and the aggregate
+        throughput in bytes per second.
+
+        @param delete: bool
+        @param max_bandwidth: float, the cap on all streams' combined rate in bytes per second, or None for no cap
+
+        @return dict
+        """
+        start = self.transport.bytes_read
+        self._send({"type": "manifest_request"})
+        manifest = self._expect("manifest")
+        remote, partials = manifest["files"], set(manifest["partials"])
+        manifest_bytes = self.transport.bytes_read - start
+
+        local = build_manifest(self.directory)
+        changed, removed = diff_manifests(local, remote)
+
+        paths = queue.SimpleQueue()
+        for path in sorted(changed, key = lambda path: (local[path][0], path)): # Smallest first
+            paths.put(path)
+
+        limiter = BandwidthLimiter(max_bandwidth) if max_bandwidth is not None else None
+        stream_syncers = [self] + [Syncer(self.directory, transport) for transport in self.streams]
+        stream_stats = [{"files": 0, "chunks_sent": 0, "chunks_skipped": 0, "bytes": 0, "seconds": 0.0}
+                        for _ in stream_syncers]
+        errors = []
+
+        def run_stream(syncer, stats):
+            syncer._limiter = limiter
+            start = time.monotonic()
+            try:
+                while len(errors) == 0:
+                    try:
+                        path = paths.get_nowait()
+                    except queue.Empty:
+                        break
+
+                    sent, skipped, num_bytes = syncer._send_file(path, local[path][1], path in remote or path in partials)
+                    stats["files"] += 1
+                    stats["chunks_sent"] += sent
+                    stats["chunks_skipped"] += skipped
+                    stats["bytes"] += num_bytes
+            except Exception as e:
+                errors.append(e)
+            finally:
+                stats["seconds"] = time.monotonic() - start
+
+        push_start = time.monotonic()
+        threads = [threading.Thread(target = run_stream, args = args) for args in zip(stream_syncers[1 :], stream_stats[1 :])]
+        for thread in threads:
+            thread.start()
+        run_stream(self, stream_stats[0]) # The main stream sends files too
+        for thread in threads:
+            thread.join()
+        seconds = time.monotonic() - push_start
+
+        if len(errors) > 0:
+            # Close every stream, so the other side's servers (including those of streams that finished) stop waiting
+            for transport in [self.transport] + self.streams:
+                transport.close()
+            raise errors[0]
+
+        for syncer in stream_syncers[1 :]:
+            syncer._send({"type": "done"})
+            syncer._expect("done")
+
+        if delete:
+            for path in removed:
+                self._send({"type": "delete", "path": path})
+
+        self._send({"type": "done"})
+        self._expect("done")
+
+        for stats in stream_stats:
+            stats["bytes_per_sec"] = stats["bytes"] / stats["seconds"] if stats["seconds"] > 0 else 0.0
+
+        bytes_sent = sum(stats["bytes"] for stats in stream_stats)
+        return {
+            "files_sent": len(changed),
+            "chunks_sent": sum(stats["chunks_sent"] for stats in stream_stats),
+            "chunks_skipped": sum(stats["chunks_skipped"] for stats in stream_stats),
+            "bytes_sent": bytes_sent,
+            "files_deleted": len(removed) if delete else 0,
+            "manifest_bytes": manifest_bytes,
+            "seconds": seconds,
+            "bytes_per_sec": bytes_sent / seconds if seconds > 0 else 0.0,
+            "streams": stream_stats
+        }
+
+    def serve(self):
+        """ Answers a pushing syncer's requests until it's done.
+        """
+        while True:
+            header = self._recv()
+
+            if header["type"] == "manifest_request":
+                partials = []
+                files = build_manifest(self.directory, partials)
+                self._send({"type": "manifest", "files": files, "partials": partials})
+            elif header["type"] == "chunks_request":
+                chunks = header["chunks"]
+                sources = self._chunk_sources(self._local_path(header["path"]), chunks)
+                self._send({"type": "chunks", "have": [i for i, chunk in enumerate(chunks) if chunk[2] in sources]})
+            elif header["type"] == "chunk":
+                self._receive_chunk(self._local_path(header["path"]), header["offset"], header["size"], header["hash"])
+            elif header["type"] == "commit":
+                self._commit_file(self._local_path(header["path"]), header["size"], header["mtime"], header["chunks"])
+            elif header["type"] == "delete":
+                path = self._local_path(header["path"])
+                if os.path.isfile(path):
+                    os.remove(path)
+            elif header["type"] == "done":
+                self._send({"type": "done"})
+                return
+            else:
+                raise SyncException("Unexpected message \"%s\"" % header["type"])
+
+    # Helper functions below
+
+    def _send(self, header, payload = b""):
+        data = json.dumps(header, separators = (",", ":")).encode()
+        self.transport.write(struct.pack(">I", len(data)) + data + payload)
+        self.transport.flush()
+
+    def _recv(self):
+        size, = struct.unpack(">I", self.transport.read(4))
+        return json.loads(self.transport.read(size).decode())
+
+    def _expect(self, message_type):
+        header = self._recv()
+        if header["type"] != message_type:
+            raise SyncException("Expected \"%s\" message, got \"%s\"" % (message_type, header["type"]))
+        return header
+
+    def _send_file(self, path, mtime, remote_copy = True):
+        # Sends the chunks of the file that the other side can't find in its copy, then has it put the file together.
+        # Without a copy (or partial file) on the other side there's nothing to ask for, so every chunk is sent right
+        # away. Returns the number of chunks sent and skipped, and the number of bytes sent.
+        abs_path = os.path.join(self.directory, path)
+        chunks = self._file_chunks(abs_path)
+
+        have = set()
+        if remote_copy:
+            self._send({"type": "chunks_request", "path": path, "chunks": chunks})
+            have = set(self._expect("chunks")["have"])
+
+        sent = num_bytes = 0
+        with open(abs_path, "rb") as f:
+            for i, (offset, size, digest) in enumerate(chunks):
+                if i in have:
+                    continue
+
+                f.seek(offset)
+                data = f.read(size)
+                if self._limiter is not None:
+                    self._limiter.consume(len(data))
+                self._send({"type": "chunk", "path": path, "offset": offset, "size": len(data), "hash": digest}, data)
+                sent += 1
+                num_bytes += len(data)
+
+        size = chunks[-1][0] + chunks[-1][1] if len(chunks) > 0 else 0
+        self._send({"type": "commit", "path": path, "size": size, "mtime": mtime, "chunks": chunks})
+        return sent, len(chunks) - sent, num_bytes
+
+    def _chunk_sources(self, path, chunks):
+        # Returns where each of the given chunks can be found on this side, as {hash: (file path, offset)}: in the
+        # partial file, where an earlier chunk message or interrupted transfer left it, or anywhere in the existing copy
+        sources = {}
+        partial_path = _partial_path(path)
+        if os.path.isfile(partial_path):
+            with open(partial_path, "rb") as f:
+                for offset, size, digest in chunks:
+                    f.seek(offset)
+                    if _chunk_hash(f.read(size)) == digest:
+                        sources.setdefault(digest, (partial_path, offset))
+
+        if os.path.isfile(path):
+            for offset, _, digest in self._file_chunks(path):
+                sources.setdefault(digest, (path, offset))
+
+        return sources
+
+    def _receive_chunk(self, path, offset, size, digest):
+        # Writes the chunk into the file's partial file, where it goes in the sender's file
+        data = self.transport.read(size)
+        if _chunk_hash(data) != digest:
+            raise SyncException("Chunk at %i of \"%s\" is corrupt" % (offset, path))
+
+        partial_path = self._open_partial(path)
+        with open(partial_path, "r+b") as f:
+            f.seek(offset)
+            f.write(data)
+
+    def _commit_file(self, path, size, mtime, chunks):
+        # Fills in the chunks that weren't sent from wherever they are on this side, then renames the partial file into
+        # place once it matches the sender's file
+        sources = self._chunk_sources(path, chunks)
+        partial_path = self._open_partial(path)
+
+        missing = [chunk for chunk in chunks if chunk[2] not in sources]
+        with open(partial_path, "r+b") as f:
+            for offset, chunk_size, digest in chunks:
+                source_path, source_offset = sources.get(digest, (partial_path, offset))
+                if (source_path, source_offset) == (partial_path, offset): # Already in place, or missing
+                    continue
+
+                # A chunk found in the partial file is already in its own place there, which is never written to
+                with open(source_path, "rb") as source:
+                    source.seek(source_offset)
+                    data = source.read(chunk_size)
+                f.seek(offset)
+                f.write(data)
+            f.truncate(size)
+
+        if len(missing) > 0 or file_chunks(partial_path) != chunks:
+            os.remove(partial_path) # Start over next time rather than resuming from bad data
+            raise SyncException("\"%s\" doesn't match after transfer" % path)
+
+        os.utime(partial_path, (mtime, mtime))
+        os.replace(partial_path, path)
+
+    def _file_chunks(self, path):
+        # Returns the file's chunks, hashing it only if it changed since it was last hashed by this syncer
+        stat = os.stat(path)
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        if key not in self._chunk_cache:
+            self._chunk_cache[key] = file_chunks(path)
+        return self._chunk_cache[key]
+
+    def _open_partial(self, path):
+        # Returns the path of the file's partial file, creating it if needed
+        partial_path = _partial_path(path)
+        if not os.path.exists(partial_path):
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+            open(partial_path, "wb").close()
+
+        return partial_path
+
+    def _local_path(self, path):
+        # Resolves a path from the other side, refusing any that would leave this library's directory
+        abs_path = os.path.abspath(os.path.join(self.directory, path))
+        if os.path.commonpath([abs_path, self.directory]) != self.directory or abs_path == self.directory:
+            raise SyncException("Refusing path \"%s\" outside the library" % path)
+        return abs_path
+
+def build_manifest(directory, partials = None):
+    """ Returns the manifest of the given directory: each file's path (relative, with "/" separators) mapped to its
+    size and modification time (in whole seconds, which is all some file systems keep). Hidden files and directories are skipped. If a list is given, the paths of
+    files with a partial file (i.e. an interrupted transfer) are added to it.
+
+    @param directory: str
+    @param partials: list(str)
+
+    @return dict(str -> list)
+    """
+    manifest = {}
+    for root, dir_names, file_names in os.walk(directory):
+        dir_names[:] = [name for name in dir_names if not name.startswith(".")]
+
+        for file_name in file_names:
+            if file_name.startswith("."):
+                if partials is not None and file_name.startswith(PARTIAL_FILE_PREFIX) and file_name.endswith(PARTIAL_FILE_SUFFIX):
+                    path = os.path.join(root, file_name[len(PARTIAL_FILE_PREFIX) : -len(PARTIAL_FILE_SUFFIX)])
+                    partials.append(os.path.relpath(path, directory).replace(os.sep, "/"))
+                continue
+
+            abs_path = os.path.join(root, file_name)
+            stat = os.stat(abs_path)
+            path = os.path.relpath(abs_path, directory).replace(os.sep, "/")
+            manifest[path] = [stat.st_size, int(stat.st_mtime)]
+
+    return manifest
+
+def file_chunks(file_path):
+    """ Returns the offset, size and hash of each of the given file's chunks. A leading ID3v2 tag is chunked apart from
+    the audio after it, so that editing the tag (which often changes its size) doesn't shift every chunk of the audio:
+    the tag and the audio are each split into CHUNK_SIZE byte chunks, the last of each possibly shorter.
+
+    @param file_path: str
+
+    @return list(list)
+    """
+    chunks = []
+    with open(file_path, "rb") as f:
+        tag_end = id3_tag_size(f.read(ID3_HEADER_SIZE))
+        f.seek(0)
+
+        offset = 0
+        while True:
+            size = min(tag_end - offset, CHUNK_SIZE) if offset < tag_end else CHUNK_SIZE
+            data = f.read(size)
+            if not data:
+                break
+
+            chunks.append([offset, len(data), _chunk_hash(data)])
+            offset += len(data)
+
+    return chunks
+
+def id3_tag_size(header):
+    """ Returns the size in bytes of the ID3v2 tag (including its header and footer, if any) that the given first bytes
+    of a file start, or 0 if they don't start one.
+
+    @param header: bytes, the file's first ID3_HEADER_SIZE bytes
+
+    @return int
+    """
+    if len(header) < ID3_HEADER_SIZE or not header.startswith(b"ID3") or any(b & 0x80 for b in header[6 :]):
+        return 0
+
+    size = 0
+    for b in header[6 : 10]: # Syncsafe, 7 bits per byte
+        size = (size << 7) | b
+    footer = ID3_HEADER_SIZE if header[5] & 0x10 else 0
+
+    return ID3_HEADER_SIZE + size + footer
+
+def _chunk_hash(data):
+    return hashlib.blake2b(data, digest_size = 16).hexdigest()
+
+def _partial_path(path):
+    # Where the file is assembled while being received
+    return os.path.join(os.path.dirname(path), PARTIAL_FILE_PREFIX + os.path.basename(path) + PARTIAL_FILE_SUFFIX)
+
+def diff_manifests(local, remote):
+    """ Returns the paths of files that are missing from the remote manifest or differ in size or modification time, and
+    of files that only exist in the remote manifest, each sorted. Files whose size and modification time match are
+    taken to be unchanged without reading them; the others may still turn out to hold the same content, in which case
+    sending them costs only their chunk hashes.
+
+    @param local: dict(str -> list)
+    @param remote: dict(str -> list)
+
+    @return tuple(list(str), list(str))
+    """
+    changed = [path for path, entry in local.items() if path not in remote or remote[path][: 2] != entry[: 2]]
+    removed = [path for path in remote if path not in local]
+
+    return sorted(changed), sorted(removed)
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != "serve":
+        print("Usage: python syncer.py serve <directory>")
+        sys.exit(1)
+
+    transport = StreamTransport(sys.stdin.buffer, sys.stdout.buffer)
+    Syncer(sys.argv[2], transport).serve()
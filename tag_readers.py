@@ -0,0 +1,178 @@
+import importlib
+
+""" Reads the tags and duration of audio files. Each container format has a reader, found by sniffing the file's first
+bytes rather than trusting its extension.
+"""
+
+SNIFF_SIZE = 64 # Bytes read from the start of a file to identify its container
+ID3_HEADER_SIZE = 10
+
+MP3  = "mp3"
+FLAC = "flac"
+MP4  = "mp4"
+OGG_VORBIS = "ogg_vorbis"
+OGG_OPUS   = "ogg_opus"
+OGG_FLAC   = "ogg_flac"
+WAV  = "wav"
+
+_READERS = {} # Container name -> func(str -> tuple(dict(str -> str), float))
+
+def sniff(file_path):
+    """ Returns the container format of the given file based on its magic bytes, or None if it isn't recognized.
+
+    @param file_path: str
+
+    @return str
+    """
+    with open(file_path, "rb") as f:
+        header = f.read(SNIFF_SIZE)
+        tag_size = id3_tag_size(header)
+        if tag_size > 0: # Identify what the tag is prepended to instead
+            f.seek(tag_size)
+            return _sniff_tagged(f.read(SNIFF_SIZE))
+
+    return sniff_bytes(header)
+
+def sniff_bytes(header):
+    """ Returns the container format of a file starting with the given bytes, or None if it isn't recognized. A
+    prepended ID3v2 tag is skipped if the bytes reach past it, and otherwise taken to mean MP3.
+
+    @param header: bytes
+
+    @return str
+    """
+    tag_size = id3_tag_size(header)
+    if tag_size > 0:
+        return _sniff_tagged(header[tag_size :])
+    elif header.startswith(b"fLaC"):
+        return FLAC
+    elif header[4 : 8] == b"ftyp":
+        return MP4
+    elif header.startswith(b"RIFF") and header[8 : 12] == b"WAVE":
+        return WAV
+    elif header.startswith(b"OggS"):
+        # The first page holds the codec's identification header, after the 27 byte page header and its segment table
+        packet = header[27 + header[26] :] if len(header) > 26 else b""
+        if packet.startswith(b"\x01vorbis"):
+            return OGG_VORBIS
+        elif packet.startswith(b"OpusHead"):
+            return OGG_OPUS
+        elif packet.startswith(b"\x7fFLAC"):
+            return OGG_FLAC
+    elif len(header) >= 2 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0 and header[1] & 0x06 != 0:
+        return MP3 # MPEG audio frame without an ID3 tag; a layer of 0 would be AAC instead
+
+    return None
+
+def id3_tag_size(header):
+    """ Returns the size in bytes of the ID3v2 tag (including its header and footer, if any) that the given first bytes
+    of a file start, or 0 if they don't start one. Mirrors syncer.id3_tag_size, as syncer has to run standalone.
+
+    @param header: bytes, at least the file's first ID3_HEADER_SIZE bytes
+
+    @return int
+    """
+    if len(header) < ID3_HEADER_SIZE or not header.startswith(b"ID3") or any(b & 0x80 for b in header[6 : 10]):
+        return 0
+
+    size = 0
+    for b in header[6 : 10]: # Syncsafe, 7 bits per byte
+        size = (size << 7) | b
+    footer = ID3_HEADER_SIZE if header[5] & 0x10 else 0
+
+    return ID3_HEADER_SIZE + size + footer
+
+def register_reader(container, reader):
+    """ Registers the reader for the given container format, replacing any existing one. A reader takes a file path
+    and returns the file's tags (keyed by Song.ID3_COLUMNS) and its duration in seconds, reading no more of the file
+    than it needs to.
+
+    @param container: str
+    @param reader: func(str -> tuple(dict(str -> str), float))
+    """
+    _READERS[container] = reader
+
+def supported_containers():
+    """ Returns the container formats that have a reader.
+
+    @return list(str)
+    """
+    return sorted(_READERS)
+
+def get_reader(file_path):
+    """ Returns the reader for the given file, or None if its format isn't supported.
+
+    @param file_path: str
+
+    @return func(str -> tuple(dict(str -> str), float))
+    """
+    return _READERS.get(sniff(file_path))
+
+def read(file_path):
+    """ Returns the tags and duration of the given file. Raises ValueError if its format isn't supported.
+
+    @param file_path: str
+
+    @return tuple(dict(str -> str), float)
+    """
+    container = sniff(file_path)
+    if container not in _READERS:
+        raise ValueError("Unsupported audio format")
+
+    return _READERS[container](file_path)
+
+def _sniff_tagged(data):
+    # Identifies a file from the bytes after its ID3v2 tag. MP3 is the format that normally carries one, so it's assumed
+    # when those bytes are unrecognized (or weren't read), except for AAC's ADTS frames, which have no reader
+    container = sniff_bytes(data)
+    if container is None and not (len(data) >= 2 and data[0] == 0xFF and data[1] & 0xF6 == 0xF0):
+        return MP3
+
+    return container
+
+# Readers below, built on mutagen's format-specific classes, which only parse headers and metadata blocks
+
+def mutagen_reader(module_name, class_name):
+    """ Returns a reader that opens files with the given mutagen class, which should expose "easy" tag names. The
+    module is imported on first use, so formats that never come up cost nothing.
+
+    @param module_name: str
+    @param class_name: str
+
+    @return func(str -> tuple(dict(str -> str), float))
+    """
+    def reader(file_path):
+        audio = getattr(importlib.import_module(module_name), class_name)(file_path)
+        return _easy_tags(audio.tags), audio.info.length
+
+    return reader
+
+def _easy_tags(tags):
+    # Takes the first value of each tag, as mutagen gives lists of values
+    ret = {}
+    if tags is None:
+        return ret
+
+    for tag, key in (("title", "title"), ("artist", "artist"), ("album", "album"), ("genre", "genre"), ("year", "date")):
+        try:
+            values = tags[key]
+        except (KeyError, ValueError):
+            continue
+
+        if len(values) > 0:
+            ret[tag] = str(values[0])[: 4] if tag == "year" else str(values[0])
+
+    return ret
+
+def _wav_reader(file_path):
+    # WAV files rarely carry tags, and mutagen exposes those that exist only as raw ID3 frames
+    from mutagen.wave import WAVE
+    return {}, WAVE(file_path).info.length
+
+register_reader(MP3, mutagen_reader("mutagen.mp3", "EasyMP3"))
+register_reader(FLAC, mutagen_reader("mutagen.flac", "FLAC"))
+register_reader(MP4, mutagen_reader("mutagen.easymp4", "EasyMP4"))
+register_reader(OGG_VORBIS, mutagen_reader("mutagen.oggvorbis", "OggVorbis"))
+register_reader(OGG_OPUS, mutagen_reader("mutagen.oggopus", "OggOpus"))
+register_reader(OGG_FLAC, mutagen_reader("mutagen.oggflac", "OggFLAC"))
+register_reader(WAV, _wav_reader)
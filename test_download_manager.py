@@ -0,0 +1,148 @@
+import asyncio, os, shutil, tempfile, threading, unittest
+import download_manager
+
+""" Tests for the download manager, with local stand-ins for the Youtube search and download functions.
+"""
+
+class FakeYoutube:
+    """ Stands in for the downloader's search and download functions. Every search returns two results, and every
+    download writes a small file, after waiting for its release event if one is set.
+    """
+
+    def __init__(self):
+        self.release = None # threading.Event that downloads wait for, if not None
+        self.running = self.max_running = 0
+        self._lock = threading.Lock()
+
+    def search(self, query):
+        if query == "nothing":
+            return []
+        return [{"id": query + "1", "title": query + " (1)"}, {"id": query + "2", "title": query + " (2)"}]
+
+    def download(self, url, file_path, file_name):
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            if self.release is not None:
+                self.release.wait(timeout = 5)
+            if "fail" in url:
+                return False
+
+            path = os.path.join(file_path, file_name)
+            with open(path, "wb") as f:
+                f.write(bytes(1000))
+            return path
+        finally:
+            with self._lock:
+                self.running -= 1
+
+class DownloadManagerTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.youtube = FakeYoutube()
+        self.manager = download_manager.DownloadManager(max_workers = 2, search = self.youtube.search,
+                                                        download = self.youtube.download)
+
+    def tearDown(self):
+        if self.youtube.release is not None:
+            self.youtube.release.set()
+        self.manager.shutdown()
+        shutil.rmtree(self.directory, ignore_errors = True)
+
+    async def test_job_states(self):
+        self.youtube.release = threading.Event()
+        job = self.manager.submit("song", self.directory)
+        self.assertEqual(job.state, download_manager.QUEUED)
+
+        states = []
+        async def choose(results):
+            states.append(job.state)
+            return results[1]
+
+        task = asyncio.create_task(self.manager.run(job, choose))
+        await self._wait_for(lambda: job.state == download_manager.DOWNLOADING)
+        self.youtube.release.set()
+        await task
+
+        self.assertEqual(states, [download_manager.CHOOSING])
+        self.assertEqual(job.state, download_manager.DONE)
+        self.assertEqual(job.title, "song (2)")
+        self.assertEqual(job.path, os.path.join(self.directory, "song (2).mp3"))
+        self.assertEqual(job.size, 1000)
+        self.assertFalse(job.is_active())
+
+    async def test_failed_jobs(self):
+        no_results = await self.manager.run(self.manager.submit("nothing", self.directory))
+        self.assertEqual(no_results.state, download_manager.FAILED)
+
+        async def choose_none(results):
+            return None
+        not_chosen = await self.manager.run(self.manager.submit("song", self.directory), choose_none)
+        self.assertEqual(not_chosen.state, download_manager.FAILED)
+
+        failed = await self.manager.run(self.manager.submit("fail", self.directory, use_first_match = True))
+        self.assertEqual(failed.state, download_manager.FAILED)
+        self.assertEqual(failed.error, "Download failed")
+        self.assertEqual(self.manager.active_jobs(), [])
+
+    async def test_worker_bound(self):
+        self.youtube.release = threading.Event()
+        jobs = [self.manager.submit("song%i" % i, self.directory, use_first_match = True) for i in range(3)]
+        tasks = [asyncio.create_task(self.manager.run(job)) for job in jobs]
+
+        # Two downloads take both workers, and the third job waits for one of them
+        await self._wait_for(lambda: self.youtube.running == 2)
+        await asyncio.sleep(0.05)
+        self.assertEqual(sorted(job.state for job in jobs), [download_manager.DOWNLOADING] * 2 +
+                                                             [download_manager.QUEUED])
+        self.assertEqual(len(self.manager.active_jobs()), 3)
+
+        self.youtube.release.set()
+        await asyncio.gather(*tasks)
+        self.assertEqual([job.state for job in jobs], [download_manager.DONE] * 3)
+        self.assertEqual(self.youtube.max_running, 2)
+
+    def test_throughput(self):
+        self.assertEqual(self.manager.throughput(), 0.0)
+
+        # Two overlapping downloads and a separate one, busy for 4 seconds in all
+        for start, end in ((0.0, 2.0), (1.0, 3.0), (5.0, 6.0)):
+            job = self.manager.submit("song", self.directory)
+            job.state, job.size = download_manager.DONE, 1000
+            job.download_start, job.download_end = start, end
+        self.manager.submit("song", self.directory) # Unfinished, so not counted
+
+        self.assertAlmostEqual(self.manager.throughput(), 750.0)
+
+    async def test_shutdown(self):
+        self.youtube.release = threading.Event()
+        jobs = [self.manager.submit("song%i" % i, self.directory, use_first_match = True) for i in range(3)]
+        tasks = [asyncio.create_task(self.manager.run(job)) for job in jobs]
+        await self._wait_for(lambda: self.youtube.running == 2)
+
+        # The queued job is abandoned, while the running ones finish
+        self.manager.shutdown()
+        self.youtube.release.set()
+        results = await asyncio.gather(*tasks, return_exceptions = True)
+        self.assertEqual(sum(isinstance(result, asyncio.CancelledError) for result in results), 1)
+        self.assertEqual(sum(job.state == download_manager.DONE for job in jobs), 2)
+
+        # No new work is taken
+        job = await self.manager.run(self.manager.submit("song", self.directory, use_first_match = True))
+        self.assertEqual(job.state, download_manager.FAILED)
+
+    # Helper functions below
+
+    async def _wait_for(self, condition, timeout = 5):
+        # Waits until the given function returns True, failing the test if it doesn't within the given time
+        loop = asyncio.get_running_loop()
+        end = loop.time() + timeout
+        while not condition():
+            if loop.time() > end:
+                self.fail("Timed out")
+            await asyncio.sleep(0.01)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import os, shutil, tempfile, unittest
+from unittest import mock
+import downloader
+
+""" Tests for the downloader's Youtube search cache, searching through a fake Youtube API service.
+"""
+
+class FakeYoutubeService:
+    """ Stands in for the googleapiclient Youtube service, answering every search with one video and counting the
+    searches that reach it.
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def search(self):
+        return self
+
+    def list(self, q, part, maxResults):
+        self.queries.append(q)
+        self._query = q
+        return self
+
+    def execute(self):
+        snippet = {"title": self._query, "channelTitle": "Channel", "publishedAt": "2020-01-01", "description": ""}
+        return {"items": [{"id": {"kind": "youtube#video", "videoId": "id%i" % len(self.queries)}, "snippet": snippet}]}
+
+class SearchCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.directory, "search_cache")
+        self.service = FakeYoutubeService()
+        downloader.configure_search_cache(ttl = 60, file_name = self.cache_file)
+        downloader.set_youtube_service(self.service)
+
+    def tearDown(self):
+        downloader.set_youtube_service(None)
+        downloader.configure_search_cache(file_name = downloader.DEFAULT_SEARCH_CACHE_FILE)
+        shutil.rmtree(self.directory, ignore_errors = True)
+
+    def test_repeated_search_is_cached(self):
+        results = downloader.youtube_search("some song")
+        self.assertEqual(downloader.youtube_search("some song"), results)
+        self.assertEqual(self.service.queries, ["some song"])
+
+        downloader.youtube_search("some song", max_results = 5) # Different search
+        self.assertEqual(len(self.service.queries), 2)
+
+    def test_query_is_normalized(self):
+        results = downloader.youtube_search("Some  Song ")
+        self.assertEqual(downloader.youtube_search("some song"), results)
+        self.assertEqual(len(self.service.queries), 1)
+
+    def test_entries_expire(self):
+        now = 1000000.0
+        with mock.patch("downloader.time.time", lambda: now):
+            downloader.youtube_search("some song")
+            now += 59
+            downloader.youtube_search("some song")
+            self.assertEqual(len(self.service.queries), 1)
+
+            now += 2
+            downloader.youtube_search("some song")
+            self.assertEqual(len(self.service.queries), 2)
+
+    def test_cache_persists(self):
+        results = downloader.youtube_search("some song")
+        downloader.configure_search_cache(ttl = 60, file_name = self.cache_file) # As on the next run
+
+        self.assertEqual(downloader.youtube_search("some song"), results)
+        self.assertEqual(len(self.service.queries), 1)
+
+if __name__ == "__main__":
+    unittest.main()
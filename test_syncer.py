@@ -0,0 +1,208 @@
+import os, random, shutil, tempfile, threading, unittest
+from unittest import mock
+import syncer, mp3_fixtures
+
+""" Tests for syncer: pushes between two temporary directories, with the serving side on a background thread.
+"""
+
+class SyncerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.src = tempfile.mkdtemp()
+        self.dst = tempfile.mkdtemp()
+        self.rand = random.Random(0)
+
+    def tearDown(self):
+        shutil.rmtree(self.src, ignore_errors = True)
+        shutil.rmtree(self.dst, ignore_errors = True)
+
+    def test_push_copies_library(self):
+        self._write_song("a.mp3", {"TIT2": "A"}, 300000)
+        self._write_song("album/b.mp3", {"TIT2": "B"}, 50000)
+
+        result = self._push()
+        self.assertEqual(result["files_sent"], 2)
+        self._assert_synced()
+
+        result = self._push()
+        self.assertEqual(result["files_sent"], 0)
+
+    def test_same_size_edit_is_sent(self):
+        self._write_song("a.mp3", {"TIT2": "A"}, 10 * syncer.CHUNK_SIZE)
+        self._push()
+
+        # Rewrite a chunk in the middle, which leaves the size and both ends of the file as they were
+        path = os.path.join(self.src, "a.mp3")
+        with open(path, "r+b") as f:
+            f.seek(syncer.id3_tag_size(f.read(syncer.ID3_HEADER_SIZE)) + 5 * syncer.CHUNK_SIZE)
+            f.write(self.rand.randbytes(1000))
+        mtime = os.path.getmtime(path) + 10
+        os.utime(path, (mtime, mtime))
+
+        result = self._push()
+        self.assertEqual(result["files_sent"], 1)
+        self.assertEqual(result["chunks_sent"], 1)
+        self._assert_synced()
+
+    def test_unchanged_file_isnt_read(self):
+        self._write_song("a.mp3", {"TIT2": "A"}, 300000)
+        self._push()
+
+        with mock.patch("syncer.file_chunks", side_effect = AssertionError("File was hashed")):
+            result = self._push()
+        self.assertEqual(result["files_sent"], 0)
+
+    def test_interrupted_push_resumes(self):
+        self._write_song("a.mp3", {"TIT2": "A"}, 10 * syncer.CHUNK_SIZE)
+        total = sum(chunk[1] for chunk in syncer.file_chunks(os.path.join(self.src, "a.mp3")))
+
+        with self.assertRaises(syncer.SyncException):
+            self._push(fail_after = total // 2)
+        self.assertFalse(os.path.exists(os.path.join(self.dst, "a.mp3")))
+
+        result = self._push()
+        self.assertGreater(result["chunks_skipped"], 0) # What the interrupted push delivered isn't sent again
+        self.assertLess(result["bytes_sent"], total * 3 // 4)
+        self._assert_synced()
+        self.assertEqual(os.listdir(self.dst), ["a.mp3"]) # No partial file left behind
+
+    def test_tag_growth_resends_only_changed_chunks(self):
+        audio = self._write_song("a.mp3", {"TIT2": "A"}, 10 * syncer.CHUNK_SIZE + 1000)
+        self._push()
+
+        # Retagging with cover art grows the tag, shifting all of the audio after it
+        path = os.path.join(self.src, "a.mp3")
+        with open(path, "wb") as f:
+            f.write(mp3_fixtures.id3_tag({"TIT2": "A", "TPE1": "Artist"}, cover_art_size = 5000) + audio)
+
+        result = self._push()
+        with open(path, "rb") as f:
+            tag_size = syncer.id3_tag_size(f.read(syncer.ID3_HEADER_SIZE))
+        tag_chunks = [chunk for chunk in syncer.file_chunks(path) if chunk[0] < tag_size]
+        self.assertEqual(result["chunks_sent"], len(tag_chunks)) # The audio's chunks are moved on the other side
+        self.assertLess(result["bytes_sent"], syncer.CHUNK_SIZE)
+        self._assert_synced()
+
+    def test_small_files_first(self):
+        for i in range(10):
+            self._write_song("%02i.mp3" % i, {"TIT2": str(i)}, self.rand.randrange(1000, 300000))
+        arrivals = self._record_arrivals()
+
+        self._push()
+        expected = sorted(syncer.build_manifest(self.src).items(), key = lambda item: (item[1][0], item[0]))
+        self.assertEqual([path for _, path in arrivals], [path for path, _ in expected])
+
+    def test_multiple_streams(self):
+        for i in range(30):
+            self._write_song("%02i.mp3" % i, {"TIT2": str(i)}, self.rand.randrange(1000, 200000))
+        arrivals = self._record_arrivals()
+        manifest = syncer.build_manifest(self.src)
+
+        streams = [syncer.serve_in_thread(self.dst) for _ in range(2)]
+        result = syncer.Syncer(self.src, syncer.serve_in_thread(self.dst), streams).push()
+        self._assert_synced()
+
+        # Each stream takes the smallest file left, so each server receives its files smallest first
+        servers = {}
+        for server, path in arrivals:
+            servers.setdefault(server, []).append(path)
+        self.assertEqual(len(servers), 3)
+        for paths in servers.values():
+            self.assertEqual(paths, sorted(paths, key = lambda path: (manifest[path][0], path)))
+
+        # The per-stream stats add up to the aggregate
+        self.assertEqual(len(result["streams"]), 3)
+        for key, total in (("files", "files_sent"), ("chunks_sent", "chunks_sent"), ("bytes", "bytes_sent")):
+            self.assertEqual(sum(stats[key] for stats in result["streams"]), result[total])
+        self.assertEqual(result["files_sent"], 30)
+        self.assertAlmostEqual(result["bytes_per_sec"], result["bytes_sent"] / result["seconds"])
+        for stats in result["streams"]:
+            self.assertGreater(stats["files"], 0)
+            self.assertAlmostEqual(stats["bytes_per_sec"], stats["bytes"] / stats["seconds"])
+
+    def test_bandwidth_cap(self):
+        for i in range(8):
+            self._write_song("%02i.mp3" % i, {"TIT2": str(i)}, 150000)
+        cap = 2 * 1024 * 1024
+
+        streams = [syncer.serve_in_thread(self.dst) for _ in range(2)]
+        result = syncer.Syncer(self.src, syncer.serve_in_thread(self.dst), streams).push(max_bandwidth = cap)
+        self._assert_synced()
+
+        # All but the initial burst is paced by the shared limiter, across every stream
+        self.assertGreater(result["bytes_sent"], 1000000)
+        self.assertLessEqual((result["bytes_sent"] - syncer.CHUNK_SIZE) / result["seconds"], cap * 1.05)
+
+    def test_failed_stream_closes_all(self):
+        for i in range(10):
+            self._write_song("%02i.mp3" % i, {"TIT2": str(i)}, 100000)
+
+        streams = [syncer.serve_in_thread(self.dst), syncer.InterruptingTransport(syncer.serve_in_thread(self.dst), 50000)]
+        with self.assertRaises(syncer.SyncException):
+            syncer.Syncer(self.src, syncer.serve_in_thread(self.dst), streams).push()
+
+        # No server is left waiting for the rest of the push
+        for thread in threading.enumerate():
+            if thread.name == syncer.SERVE_THREAD_NAME:
+                thread.join(timeout = 5)
+                self.assertFalse(thread.is_alive())
+
+    def test_id3_tag_size(self):
+        tag = mp3_fixtures.id3_tag({"TIT2": "Title"}, padding = 100)
+        self.assertEqual(syncer.id3_tag_size(tag[: syncer.ID3_HEADER_SIZE]), len(tag))
+        self.assertEqual(syncer.id3_tag_size(b"ID3\x04\x00\x10\x00\x00\x00\x05"), 25) # Footer flag set
+        self.assertEqual(syncer.id3_tag_size(b"\xff\xfb\x90\x00" + bytes(6)), 0)
+        self.assertEqual(syncer.id3_tag_size(b"ID3"), 0)
+
+    # Helper functions below
+
+    def _write_song(self, path, tags, audio_size):
+        # Writes a song with the given tags followed by audio_size bytes of random audio, and returns the audio
+        audio = self.rand.randbytes(audio_size)
+        abs_path = os.path.join(self.src, path)
+        os.makedirs(os.path.dirname(abs_path), exist_ok = True)
+        with open(abs_path, "wb") as f:
+            f.write(mp3_fixtures.id3_tag(tags) + audio)
+        return audio
+
+    def _record_arrivals(self):
+        # Returns a list that (server, path) is appended to as each file is put in place on the serving side
+        arrivals, commit_file = [], syncer.Syncer._commit_file
+
+        def record(server, path, *args):
+            commit_file(server, path, *args)
+            arrivals.append((server, os.path.relpath(path, self.dst)))
+
+        patcher = mock.patch.object(syncer.Syncer, "_commit_file", record)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return arrivals
+
+    def _push(self, fail_after = None):
+        client, server = syncer.pipe_transports()
+        transport = syncer.InterruptingTransport(client, fail_after) if fail_after is not None else client
+
+        def serve():
+            try:
+                syncer.Syncer(self.dst, server).serve()
+            except syncer.SyncException: # The push was interrupted
+                pass
+
+        thread = threading.Thread(target = serve)
+        thread.start()
+        try:
+            return syncer.Syncer(self.src, transport).push()
+        finally:
+            transport.close()
+            thread.join()
+            server.close()
+
+    def _assert_synced(self):
+        paths = sorted(syncer.build_manifest(self.src))
+        self.assertEqual(paths, sorted(syncer.build_manifest(self.dst)))
+        for path in paths:
+            with open(os.path.join(self.src, path), "rb") as src, open(os.path.join(self.dst, path), "rb") as dst:
+                self.assertEqual(src.read(), dst.read(), path)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import os, shutil, tempfile, unittest
+import tag_readers, mp3_fixtures
+
+""" Tests for identifying audio containers from their first bytes.
+"""
+
+FLAC_HEADER = b"fLaC\x00\x00\x00\x22" + bytes(34)
+ADTS_HEADER = b"\xff\xf1\x50\x80\x02\x1f\xfc" # AAC, which has no reader
+
+class SniffTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors = True)
+
+    def test_untagged(self):
+        self.assertEqual(tag_readers.sniff_bytes(FLAC_HEADER), tag_readers.FLAC)
+        self.assertEqual(tag_readers.sniff_bytes(mp3_fixtures.frame_header(128)), tag_readers.MP3)
+        self.assertIsNone(tag_readers.sniff_bytes(ADTS_HEADER))
+
+    def test_id3_tag_is_skipped(self):
+        tag = mp3_fixtures.id3_tag({"TIT2": "Title"}, cover_art_size = 5000) # Much longer than SNIFF_SIZE
+        self.assertEqual(self._sniff(tag + mp3_fixtures.frame_header(128)), tag_readers.MP3)
+        self.assertEqual(self._sniff(tag + FLAC_HEADER), tag_readers.FLAC)
+        self.assertIsNone(self._sniff(tag + ADTS_HEADER))
+        self.assertEqual(self._sniff(tag), tag_readers.MP3)
+
+        small_tag = mp3_fixtures.id3_tag({"TIT2": "T"}, padding = 0)
+        self.assertEqual(tag_readers.sniff_bytes(small_tag + FLAC_HEADER), tag_readers.FLAC)
+        self.assertEqual(tag_readers.sniff_bytes(tag[: tag_readers.SNIFF_SIZE]), tag_readers.MP3) # Can't see past it
+
+    # Helper functions below
+
+    def _sniff(self, data):
+        # Writes the given data to a file and sniffs it
+        path = os.path.join(self.directory, "song")
+        with open(path, "wb") as f:
+            f.write(data)
+        return tag_readers.sniff(path)
+
+if __name__ == "__main__":
+    unittest.main()
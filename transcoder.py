@@ -0,0 +1,111 @@
+import os, shutil, subprocess, tempfile, threading
+
+""" Converts audio files to MP3 in the background with ffmpeg.
+"""
+
+TRANSCODE_EXTENSIONS = (".m4a", ".aac", ".flac", ".ogg", ".opus", ".wav", ".wma", ".webm")
+TEMP_FILE_PREFIX = ".transcode-" # Hidden, so library scans skip files being written
+
+def ffmpeg_installed():
+    """ Returns if ffmpeg is available to transcode with.
+
+    @return bool
+    """
+    return shutil.which("ffmpeg") is not None
+
+class Transcoder:
+    """ Runs ffmpeg jobs converting files to MP3, at most max_jobs at a time. Each job's ffmpeg process is waited on by
+    a worker thread, so the worker pool bounds the number of processes. Output is written to a hidden temporary file
+    next to the target and renamed into place, so it appears in the library directory only once it's complete.
+    """
+
+    def __init__(self, max_jobs = None, bitrate = "256k"):
+        """ Initializes a transcoder running at most max_jobs ffmpeg processes at once, one per CPU by default.
+
+        @param max_jobs: int
+        @param bitrate: str, in ffmpeg's format
+        """
+        if max_jobs is None:
+            max_jobs = os.cpu_count() or 1
+
+        self.max_jobs = max_jobs
+        self.bitrate = bitrate
+        from concurrent.futures import ThreadPoolExecutor # Only once needed, as the library imports this module
+        self._executor = ThreadPoolExecutor(max_workers = max_jobs)
+        self._processes = set() # Running ffmpeg processes
+        self._lock = threading.Lock()
+        self._shut_down = False
+
+    def submit(self, source, target = None, remove_source = False):
+        """ Queues the given file to be converted to MP3. Returns a future resolving to the target path once the target
+        has been written.
+
+        @param source: str
+        @param target: str, the source's path with an .mp3 extension by default
+        @param remove_source: bool, whether to delete the source once it's been converted
+
+        @return concurrent.futures.Future
+        """
+        if target is None:
+            target = os.path.splitext(source)[0] + ".mp3"
+
+        return self._executor.submit(self._transcode, source, target, remove_source)
+
+    def shutdown(self):
+        """ Abandons queued jobs and kills running ffmpeg processes.
+        """
+        with self._lock:
+            self._shut_down = True
+            for process in self._processes:
+                process.kill()
+
+        self._executor.shutdown(wait = False, cancel_futures = True)
+
+    # Helper functions below, run on worker threads
+
+    def _transcode(self, source, target, remove_source):
+        fd, temp_file = tempfile.mkstemp(prefix = TEMP_FILE_PREFIX, suffix = ".mp3", dir = os.path.dirname(os.path.abspath(target)))
+        os.close(fd)
+
+        try:
+            with self._lock:
+                if self._shut_down:
+                    raise RuntimeError("Transcoder shut down")
+
+                process = subprocess.Popen(["ffmpeg", "-nostdin", "-loglevel", "error", "-y", "-i", source, "-vn",
+                                            "-acodec", "libmp3lame", "-ab", self.bitrate, temp_file],
+                                           stdout = subprocess.DEVNULL, stderr = subprocess.PIPE)
+                self._processes.add(process)
+
+            try:
+                _, err = process.communicate()
+            finally:
+                with self._lock:
+                    self._processes.discard(process)
+
+            if process.returncode != 0:
+                raise RuntimeError("ffmpeg couldn't convert \"%s\": %s" % (source, err.decode(errors = "replace").strip()))
+
+            os.replace(temp_file, target) # Atomic, since it's in the same directory
+        finally:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+        if remove_source:
+            os.remove(source)
+
+        return target
+
+_default_transcoder = None
+_default_transcoder_lock = threading.Lock() # Downloads ask for the transcoder from worker threads
+
+def get_default_transcoder():
+    """ Returns the transcoder shared by the library loader and the downloader.
+
+    @return Transcoder
+    """
+    global _default_transcoder
+    with _default_transcoder_lock:
+        if _default_transcoder is None:
+            _default_transcoder = Transcoder()
+        return _default_transcoder
@@ -1,9 +1,10 @@
-import main
+import screen, instrumentation
 from song import Song
-import select, sys, os, signal
+import sys, os, signal, shutil
 
-USER_INPUT_MARKER = main.USER_INPUT_MARKER
+USER_INPUT_MARKER = screen.USER_INPUT_MARKER
 _SAVE_STDOUT, _SAVE_STDERR = None, None
+_CONSOLE_SIZE = None # Cached terminal size, invalidated when the terminal is resized
 
 """ Contains various external functions that are used throughout the program but don't belong in any particular class.
 """
@@ -49,62 +50,41 @@ def vlc_installed():
     """
     return os.path.exists("/usr/bin/vlc")
 
-def read_stdin(timeout):
-    """ Puts the current thread to sleep for TIMEOUT seconds, reading input to stdin simultaneously. If user input is detected, returns it.
-
-    @param timeout: float
-
-    @return str
-    """
-    inp, out, err = select.select([sys.stdin], [], [], timeout)
-
-    if len(inp) == 0:
-        return None
-    else:
-        return sys.stdin.readline()
-
+@instrumentation.timed("util.print_main")
 def print_main(s, inp = None, output_message = None):
     """ Displays the given string by printing it in the middle of the console and overwriting the last displayed
     string. If input was given, it would have been printed below the previously displayed line, and so is moved
-    above the displayed line. Assumes that display line is always one line above current line.
+    above the displayed line, followed by the output message. Only the lines that changed are redrawn.
 
     @param s: str
     @param inp: str
+    @param output_message: str
     """
-    centered_s = s.center(console_width())
-
-    if SUPPORTS_ANSI:
-        # Useful ANSI escape sequences
-        mul = "\033[1A" # Move up line
-        mdl = "\n"      # Move down line
-        rts = "\033[1G" # Return to start
-        cl = "\033[K"   # Clear line
-
-        if inp is not None:
-            # Get rid of newline if input isn't already stripped
-            if inp[-1] == "\n":
-                inp = inp[: -1]
-
-            # Move inp up two lines
-            print(rts + mul * 3 + rts + cl, end = "")
-            print(rts + inp + mdl, end = "")
-
-            # Print output message below inp
-            if output_message is not None:
-                for line in output_message.split("\n"):
-                    print(rts + cl, end = "")
-                    print(rts + line + mdl, end = "")
-
-            # Print the new main line underneath where the last main line was
-            print(rts + cl + mdl, end = "")
-            print(rts + centered_s + mdl, end = "")
-        else:
-            # Erase last main line and print the new one
-            print(rts + mul + rts + cl + centered_s + mdl, end = "")
-    else:
-        print(centered_s)
+    _SCREEN.draw(s, inp, output_message)
+
+def print_notification(s, output_message):
+    """ Displays the given main string, printing the given message above it, without disturbing the input line. For
+    messages that aren't a response to user input, which print_main() assumes.
 
-    print(USER_INPUT_MARKER, end = "", flush = True)
+    @param s: str
+    @param output_message: str
+    """
+    _SCREEN.notify(s, output_message)
+
+def set_status(lines):
+    """ Sets the lines of the status bar displayed below the main line. Redraws are limited to the screen's frame
+    rate; call flush_status() later to draw changes that were held back.
+
+    @param lines: list(str)
+    """
+    _SCREEN.set_status(lines)
+
+def flush_status():
+    """ Draws status bar changes held back by the frame rate limit, if they're due. Returns if any are still pending.
+
+    @return bool
+    """
+    return _SCREEN.flush()
 
 # Helper functions below
 
@@ -140,6 +120,10 @@ def help_message():
     help_str += "\tshuffle\n"
     help_str += "\tsearch\n"
     help_str += "\tdownload\n"
+    help_str += "\tdownloads\n"
+    help_str += "\tstats\n"
+    help_str += "\tprofile\n"
+    help_str += "\tplays\n"
     help_str += "Type \"help <command>\" to get specific help information for a given command.\n"
     help_str += "\n\n"
 
@@ -160,7 +144,8 @@ help_dict = {
                 "This will affect the previous history of played songs and therefore the \"back\" command.",
     "repeat":   "\"repeat\" command\n\tPlays the song again after it's over.",
     "restart":  "\"restart\" command\n\tPlays current song from beginning.",
-    "time":     "\"time [<t>]\" command\n\tJump to time t (in seconds) of the current song, or just \"time\" to see the current time.",
+    "time":     "\"time [<t>]\" command\n\tJump to time t (in seconds) of the current song, reporting how long the seek took, " + \
+                "or just \"time\" to see the current time.",
     "info":     "\"info\" command\n\tDisplays stored column information about current song.",
     "queue":    "\"queue [<song>]\" command\n\tAdds <song> to queue, or just \"queue\" to display queue.",
     "dequeue":  "\"dequeue [-all] <song>\" command\n\tRemoves the first occurrence, and optionally all occurrences, of the given " + \
@@ -176,20 +161,68 @@ help_dict = {
     "download": "\"download <query>\" command\n\tTries to download the song given by the query, from multiple sources " + \
                 "(e.g. YouTube, etc.)\n\tQuery format: -query \"<search query>\" [-filepath] \"<where to save song>\" [-best]\n\t" + \
                 "Options in brackets are optional; the \"best\" option specifies whether to automatically use the first returned " + \
-                "search match; otherwise, you will be prompted for each match."
+                "search match; otherwise, you will be prompted for each match.",
+    "downloads": "\"downloads\" command\n\tLists queued, running and finished downloads, and the aggregate download speed.",
+    "stats":    "\"stats [<prefix> | dump <file>]\" command\n\tShows call counts and latency percentiles for commands, song " + \
+                "loading and playback, searches and redraws, plus player pool metrics, or writes them all to a JSON file. " + \
+                "\"stats trace\" shows the spans of skip, back, jump, restart and time, from parsing to the new song playing.",
+    "profile":  "\"profile start [cpu] | stop [<file>]\" command\n\tStarts sampling what every thread is doing (on wall clock " + \
+                "time, or CPU time with \"cpu\"), or stops and writes the samples as collapsed stacks for flame graph tools. " + \
+                "Just \"profile\" shows the functions seen most often.",
+    "plays":    "\"plays [most | recent | never] [<n>]\" command\n\tShows the n (10 by default) songs played to the end the " + \
+                "most times (the default), played most recently, or never played, from the log of every song played."
 }
 
 def console_width():
-    stty = os.popen("stty size")
-    width = int(stty.read().split()[1]) # Width of console in characters
-    stty.close()
+    """ Returns the width of the console in characters. The size is read once (with the TIOCGWINSZ ioctl, through
+    shutil) and cached until the terminal sends SIGWINCH, so redrawing doesn't cost a system call or a subprocess.
 
-    return width
+    @return int
+    """
+    global _CONSOLE_SIZE
+    if _CONSOLE_SIZE is None:
+        if not _watch_console_size():
+            return shutil.get_terminal_size().columns # Can't be notified of resizes, so don't cache
+
+        _CONSOLE_SIZE = shutil.get_terminal_size()
+
+    return _CONSOLE_SIZE.columns
+
+def _watch_console_size():
+    """ Installs a SIGWINCH handler that invalidates the cached console size, if it isn't installed already. Returns if
+    the handler is installed; signal handlers can only be installed from the main thread.
+
+    @return bool
+    """
+    if not hasattr(signal, "SIGWINCH"):
+        return False
+    elif signal.getsignal(signal.SIGWINCH) is _on_resize:
+        return True
 
-# TODO Make this function return more readable output
-def get_thread_str(play_str, thread):
-    if thread is not None:
+    try:
+        signal.signal(signal.SIGWINCH, _on_resize)
+        return True
+    except ValueError: # Not the main thread
+        return False
+
+def _on_resize(signum, frame):
+    global _CONSOLE_SIZE
+    _CONSOLE_SIZE = None
+
+_SCREEN = screen.Screen(console_width, SUPPORTS_ANSI, USER_INPUT_MARKER)
+
+def get_thread_str(play_str, num_downloads):
+    """ Returns the given main string, annotated with the number of songs being downloaded in the background.
+
+    @param play_str: str
+    @param num_downloads: int
+
+    @return str
+    """
+    if num_downloads == 1:
         return play_str + ", downloading song"
+    elif num_downloads > 1:
+        return play_str + ", downloading %i songs" % num_downloads
     else:
         return play_str
 